@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Micro-benchmark of the per-tweet cost of parsing a tweet body
+
+    Compares the three-regex parsing pymetrify used to do (one pass for
+    @-mentions, one for the retweet marker, one over a lowercased copy for
+    a trailing "via @") with pymetrify.scan_body(), which finds the
+    mentions and the retweet marker in one pass, and checks they agree.
+
+    Usage: python benchmarks/parse_body.py [-n N] [ACTIVITY_STREAMS_FILE]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import pymetrify
+
+SAMPLE_BODIES = [
+    u'Just landed in Boston, what a flight',
+    u'@alice see you at the talk tomorrow?',
+    u'RT @bob: new paper on retweet networks http://t.co/abc123 #icwsm',
+    u'This is great RT @carol: slides from my #ht2013 talk are up',
+    u'"@dave: anyone have a spare badge?" I do!',
+    u'"@erin: lunch at noon"',
+    u'Worth a read on hashtags and publics http://t.co/xyz via @frank',
+    u'MT @grace: long thread on sampling bias, cc @heidi @ivan',
+    u'@judy @mallory @oscar @peggy thanks all for coming',
+    u'no mentions or retweets here, just a long-ish sentence about data',
+    # Lower-casing the dotted capital I adds a character
+    u'via @rtrt\u01301a',
+    # Mentions that run into the retweet marker after them
+    u'@bobRT @carol: hi',
+    u'@bobRT @carol hi "@dave',
+    u'thanks @evia @frank',
+]
+
+re_mention = re.compile(r'@([A-Za-z0-9_]+)')
+re_retweet = re.compile(r'(\"@|RT @|MT @|via @)([A-Za-z0-9_]+)')
+re_via = re.compile(r'via @[a-z0-9_]*$')
+
+
+def legacy_parse(body):
+    """Parse body the way pymetrify did before scan_body()"""
+    mentions = [m for m in re_mention.finditer(body)]
+    edited = False
+    m = re_retweet.search(body)
+    if m:
+        if not body[:2].lower() in ('rt', 'mt'):
+            if (body[:2] == '"@'):
+                if not (body[-1] == '"'):
+                    edited = True
+            elif not re_via.search(body.lower()):
+                edited = True
+    return mentions, m, edited
+
+
+def same(body):
+    """Return True if both parsers find the same mentions, retweet and edit"""
+    mentions, rt, edited = legacy_parse(body)
+    legacy = ([(mention.start(1)-1, mention.group(1)) for mention in mentions],
+              rt and rt.groups(), edited)
+    mentions, rt, edited = pymetrify.scan_body(body)
+    indices = pymetrify.mention_indices(body)
+    return (legacy == (indices, rt, bool(rt) and edited) and
+            [username for marker, username in mentions] == [username for start, username in indices])
+
+
+def read_bodies(path):
+    bodies = []
+    for line in pymetrify.read_lines(path):
+        line = line.strip()
+        if line:
+            tweet = json.loads(line)
+            if u'body' in tweet:
+                bodies.append(tweet[u'body'])
+    return bodies
+
+
+def per_tweet(parse, bodies, number):
+    """Return the best processor time in microseconds to parse one body"""
+    def run():
+        for body in bodies:
+            parse(body)
+    best = min(timeit.repeat(run, number=number, repeat=9, timer=time.clock))
+    return best / number / len(bodies) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--number', type=int, default=200,
+                        help='passes over the bodies per timing (default 200)')
+    parser.add_argument('input', nargs='?',
+                        help='file of Activity Streams tweets (default: built-in sample)')
+    args = parser.parse_args()
+
+    bodies = read_bodies(args.input) if args.input else SAMPLE_BODIES
+    for body in bodies:
+        if not same(body):
+            raise ValueError(u"Parsers disagree on: {0}".format(body).encode('utf-8'))
+
+    before = per_tweet(legacy_parse, bodies, args.number)
+    after = per_tweet(pymetrify.scan_body, bodies, args.number)
+    print("bodies:       {0}".format(len(bodies)))
+    print("before:       {0:.2f} us/tweet".format(before))
+    print("after:        {0:.2f} us/tweet".format(after))
+    print("speedup:      {0:.2f}x".format(before / after))
+
+if __name__ == '__main__':
+    main()
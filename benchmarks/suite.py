@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark eating, grouping and reporting synthetic collections
+
+    For each collection size, a fresh process eats that many tweets from
+    benchmarks/synthetic.py and records the time taken by Metrifier.eat_many(),
+    Metrifier.group_users_by_percentile() and report() at every period
+    granularity, along with the peak memory of the process. Results are
+    saved as JSON so that runs on different commits can be compared; on
+    commits without eat_many() or the newer Metrifier options, the suite
+    eats one tweet at a time with the options that commit has.
+
+    Usage: python benchmarks/suite.py [--sizes 10000,1000000,10000000] [-o FILE]
+           python benchmarks/suite.py --compare OLD.json NEW.json
+"""
+
+import argparse
+import datetime
+import inspect
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir))
+import pymetrify
+import synthetic
+
+SIZES = (10000, 1000000, 10000000)
+PERIODS = getattr(pymetrify, 'PERIODS', ('year', 'month', 'day', 'hour', 'minute', 'second'))
+PERCENTILES = (1, 9, 90)
+# Tweets generated at a time; generating them is not timed
+CHUNK = 10000
+
+
+def peak_memory():
+    """Return the peak resident memory of this process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def accepts(function, name):
+    """Return True if function takes an argument called name"""
+    return name in inspect.getargspec(function).args
+
+
+def make_metrifier(columnar=False, streaming=False):
+    """Return a Metrifier that tracks every period, passing only the
+        options that this version of pymetrify has
+    """
+    init = pymetrify.Metrifier.__init__
+    options = {}
+    if accepts(init, 'periods'):
+        options['periods'] = PERIODS
+    for name, value in (('columnar', columnar), ('streaming', streaming)):
+        if value:
+            if not accepts(init, name):
+                raise ValueError("This version of pymetrify has no {0} option.".format(name))
+            options[name] = value
+    return pymetrify.Metrifier(**options)
+
+
+def run(tweets, users=None, columnar=False, streaming=False, includeusers=False, seed=1):
+    """Eat that many synthetic tweets, then group and report them
+        Returns a dict of timings in seconds and the peak memory in bytes.
+        Run it in a fresh process, the peak memory covers the whole process.
+    """
+    if users is None:
+        users = max(tweets // 20, 100)
+    metrifier = make_metrifier(columnar, streaming)
+    eat_many = getattr(metrifier, 'eat_many', None)
+    generated = synthetic.generate(tweets, users=users, seed=seed)
+    result = {
+        u'tweets': tweets,
+        u'users': users,
+        u'columnar': columnar,
+        u'streaming': streaming,
+        u'includeusers': includeusers,
+        u'memory_before': peak_memory()
+    }
+
+    elapsed = 0.0
+    while True:
+        chunk = list(itertools.islice(generated, CHUNK))
+        if not chunk:
+            break
+        start = time.time()
+        if eat_many is not None:
+            eat_many(chunk)
+        else:
+            for tweet in chunk:
+                metrifier.eat(tweet)
+        elapsed += time.time() - start
+    result[u'eat'] = elapsed
+    result[u'eat_tweets_per_second'] = tweets / elapsed if elapsed else 0.0
+    result[u'memory_eaten'] = peak_memory()
+
+    grouping = {}
+    if accepts(pymetrify.Metrifier.group_users_by_percentile, 'include_tweets'):
+        grouping['include_tweets'] = not streaming
+    start = time.time()
+    for group in metrifier.group_users_by_percentile(PERCENTILES, **grouping):
+        pass
+    result[u'group_users_by_percentile'] = time.time() - start
+
+    result[u'report'] = {}
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for period in PERIODS:
+            start = time.time()
+            pymetrify.report(metrifier, period, PERCENTILES, includeusers)
+            result[u'report'][period] = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    result[u'memory_peak'] = peak_memory()
+    return result
+
+
+def git_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE, stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    """Print the change in every timing and memory figure from old to new"""
+    old_runs = dict((r[u'tweets'], r) for r in old[u'runs'])
+    print("{0:>10}  {1:<32}{2:>14}{3:>14}{4:>9}".format('tweets', 'measure', 'old', 'new', 'change'))
+    for run_new in new[u'runs']:
+        run_old = old_runs.get(run_new[u'tweets'])
+        if run_old is None:
+            continue
+        measures = [u'eat', u'group_users_by_percentile']
+        measures += [u'report.' + period for period in PERIODS]
+        measures += [u'memory_eaten', u'memory_peak']
+        for measure in measures:
+            if measure.startswith(u'report.'):
+                a = run_old[u'report'].get(measure[7:])
+                b = run_new[u'report'].get(measure[7:])
+            else:
+                a = run_old.get(measure)
+                b = run_new.get(measure)
+            if a is None or b is None:
+                continue
+            change = (b - a) * 100.0 / a if a else 0.0
+            print("{0:>10}  {1:<32}{2:>14.6g}{3:>14.6g}{4:>+8.1f}%".format(run_new[u'tweets'], measure, a, b, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', help="Comma-separated numbers of tweets (default 10000,1000000,10000000)",
+                        default=','.join(str(size) for size in SIZES))
+    parser.add_argument('--users', type=int, help="Number of users (default: one per 20 tweets)")
+    parser.add_argument('--columnar', action='store_true', help="Use Metrifier(columnar=True)")
+    parser.add_argument('-s', '--streaming', action='store_true', help="Use Metrifier(streaming=True)")
+    parser.add_argument('-u', '--includeusers', action='store_true', help="Include per-user statistics in reports")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the synthetic tweets (default 1)")
+    parser.add_argument('-o', '--output', default='benchmark.json', help="JSON file for the results (default benchmark.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="Compare two result files and exit")
+    parser.add_argument('--run', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as old, open(args.compare[1]) as new:
+            compare(json.load(old), json.load(new))
+        return
+
+    options = {
+        'users': args.users,
+        'columnar': args.columnar,
+        'streaming': args.streaming,
+        'includeusers': args.includeusers,
+        'seed': args.seed
+    }
+
+    # Child process: one size, result as JSON on stdout
+    if args.run is not None:
+        json.dump(run(args.run, **options), sys.stdout)
+        return
+
+    results = {
+        u'commit': git_commit(),
+        u'date': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        u'python': platform.python_version(),
+        u'platform': platform.platform(),
+        u'options': options,
+        u'runs': []
+    }
+    for size in (int(s) for s in args.sizes.split(',')):
+        command = [sys.executable, os.path.abspath(__file__), '--run', str(size), '--seed', str(args.seed)]
+        if args.users:
+            command += ['--users', str(args.users)]
+        for flag in ('columnar', 'streaming', 'includeusers'):
+            if options[flag]:
+                command.append('--' + flag)
+        result = json.loads(subprocess.check_output(command))
+        results[u'runs'].append(result)
+        sys.stderr.write("{0} tweets: eat {1:.2f}s ({2:.0f} tweets/s), group {3:.2f}s, report {4:.2f}s, peak {5:.0f} MB\n".format(
+            size, result[u'eat'], result[u'eat_tweets_per_second'], result[u'group_users_by_percentile'],
+            sum(result[u'report'].values()), result[u'memory_peak'] / 1048576.0))
+        # Save after every size so a long run that is cut short is not lost
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Deterministic generator of synthetic Activity Streams tweets
+
+    The same arguments and seed always produce the same tweets, so runs of
+    the benchmarks on different commits eat exactly the same collection.
+    User activity, the users that are mentioned or retweeted, URLs and
+    hashtags all follow Zipf distributions, as they do in real collections.
+
+    Usage: python benchmarks/synthetic.py [options] N > tweets.json
+"""
+
+import argparse
+import bisect
+import json
+import random
+import sys
+import time
+
+WORDS = (u'the', u'data', u'public', u'today', u'new', u'great', u'read',
+         u'talk', u'paper', u'live', u'thanks', u'vote', u'news', u'why',
+         u'this', u'is', u'a', u'at', u'for', u'we', u'our', u'now')
+
+# 2013-01-01T00:00:00Z
+START = 1356998400
+
+
+class Zipf:
+    """Draw ranks 0..n-1 where rank k is drawn in proportion to 1/(k+1)**s"""
+
+    def __init__(self, n, s, rng):
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for k in xrange(n):
+            total += 1.0 / (k + 1) ** s
+            self.cumulative.append(total)
+        self.total = total
+
+    def draw(self):
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.total)
+
+
+def username(user):
+    return u'user{0}'.format(user)
+
+
+def user_id_str(user):
+    return unicode(user + 1)
+
+
+def generate(tweets, users=10000, mentions=0.3, retweets=0.25, shares=0.5,
+             urls=0.3, hashtags=0.2, zipf=1.1, start=START, seconds=7*86400,
+             seed=1):
+    """Yield tweets as Activity Streams dicts, like json.loads() of a Gnip line
+        tweets: number of tweets
+        users: number of distinct users who author, are mentioned or retweeted
+        mentions: share of the tweets that @-mention someone (half are replies)
+        retweets: share of the tweets that are retweets
+        shares: share of the retweets that use the "share" verb, the rest
+            are posts with "RT @username" in the text
+        urls, hashtags: share of the tweets with a URL or a hashtag
+        zipf: exponent of the Zipf distributions
+        start, seconds: tweets are spread over seconds from epoch start,
+            slightly out of order
+        seed: seed for the random number generator
+    """
+    rng = random.Random(seed)
+    user = Zipf(users, zipf, rng)
+    page = Zipf(max(users // 10, 1), zipf, rng)
+    tag = Zipf(max(users // 20, 1), zipf, rng)
+    step = float(seconds) / max(tweets, 1)
+
+    for i in xrange(tweets):
+        author = user.draw()
+        posted = int(start + i * step) + rng.randint(-30, 30)
+        text = u' '.join(rng.choice(WORDS) for _ in xrange(rng.randint(3, 12)))
+        entities = {u'user_mentions': [], u'urls': [], u'hashtags': []}
+        tweet = {
+            u'id': u'tag:search.twitter.com,2005:{0}'.format(300000000000000000 + i),
+            u'verb': u'post',
+            u'postedTime': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(posted)),
+            u'actor': {
+                u'id': u'id:twitter.com:{0}'.format(user_id_str(author)),
+                u'id_str': user_id_str(author),
+                u'preferredUsername': username(author)
+            },
+            u'twitter_entities': entities
+        }
+
+        r = rng.random()
+        if r < retweets:
+            other = user.draw()
+            share = rng.random() < shares
+            # Some retweets that are posts add a comment in front
+            comment = u'' if share or rng.random() < 0.7 else rng.choice(WORDS) + u' '
+            body = u'{0}RT @{1}: {2}'.format(comment, username(other), text)
+            at = len(comment) + 3
+            entities[u'user_mentions'].append({
+                u'id_str': user_id_str(other),
+                u'indices': [at, at + 1 + len(username(other))],
+                u'screen_name': username(other)
+            })
+            if share:
+                tweet[u'verb'] = u'share'
+                tweet[u'object'] = {
+                    u'actor': {
+                        u'id': u'id:twitter.com:{0}'.format(user_id_str(other)),
+                        u'preferredUsername': username(other)
+                    },
+                    u'body': text
+                }
+        elif r < retweets + mentions:
+            others = [user.draw() for _ in xrange(1 + (rng.random() < 0.3))]
+            names = u' '.join(u'@' + username(other) for other in others)
+            if rng.random() < 0.5:
+                body = names + u' ' + text
+            else:
+                body = text + u' ' + names
+            at = 0
+            for other in others:
+                at = body.index(u'@' + username(other), at)
+                entities[u'user_mentions'].append({
+                    u'id_str': user_id_str(other),
+                    u'indices': [at, at + 1 + len(username(other))],
+                    u'screen_name': username(other)
+                })
+                at += 1
+        else:
+            body = text
+
+        if rng.random() < urls:
+            body += u' http://t.co/{0:x}'.format(rng.getrandbits(32))
+            entities[u'urls'].append({u'expanded_url': u'http://example.com/{0}'.format(page.draw())})
+        if rng.random() < hashtags:
+            ht = u'tag{0}'.format(tag.draw())
+            body += u' #' + ht
+            entities[u'hashtags'].append({u'text': ht})
+        tweet[u'body'] = body
+        yield tweet
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('tweets', type=int, help='number of tweets')
+    parser.add_argument('--users', type=int, default=10000, help='number of users (default 10000)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default 1)')
+    parser.add_argument('--days', type=float, default=7, help='days the tweets are spread over (default 7)')
+    args = parser.parse_args()
+    for tweet in generate(args.tweets, users=args.users, seed=args.seed, seconds=int(args.days * 86400)):
+        sys.stdout.write(json.dumps(tweet))
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
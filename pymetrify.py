@@ -25,15 +25,60 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from collections import Counter, defaultdict
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict, defaultdict, deque
+import Queue
 import argparse
-import datetime
+import asyncore
+import atexit
+import bz2
+import calendar
+import functools
+import glob
+import hashlib
+import io
 import itertools
 import json
 import math
+import mmap
+import multiprocessing
 import operator
+import os
 import re
+import signal
+import socket
+import stat
+import struct
 import sys
+import threading
+import time
+import urlparse
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 #
 # Globals
@@ -41,7 +86,130 @@ import sys
 
 ISOFORMAT = '%Y-%m-%dT%H:%M:%S.000Z'
 SEPARATOR = u','
-VERBOSE = True
+VERBOSE = False
+
+# Set to a Profiler to time each stage of a run, see Profiler
+PROFILER = None
+# Seconds between the progress lines of a Profiler
+PROGRESS_INTERVAL = 10
+
+# Formats that report() can write, see open_writer()
+FORMATS = ('csv', 'ndjson', 'parquet', 'arrow')
+FORMAT_EXTENSIONS = {
+    '.csv': 'csv',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow'
+}
+
+# Bytes of output that a writer buffers before writing them out
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Stages of a run that a Profiler times, in the order they happen
+STAGES = (u'read', u'decode', u'parse', u'count', u'merge', u'group', u'report')
+
+# Periods that a Metrifier can keep running totals for
+PERIODS = ('year', 'month', 'day', 'hour', 'minute', 'second')
+
+# Length of the periods that always have the same length
+PERIOD_SECONDS = {
+    'day': 86400,
+    'hour': 3600,
+    'minute': 60,
+    'second': 1
+}
+
+# Start of every postedTime minute parsed so far, see parse_postedTime()
+MINUTE_CACHE = {}
+MINUTE_CACHE_SIZE = 100000
+
+# Start of the month or year that each day falls in, see period_start()
+CALENDAR_CACHE = {}
+
+# Boolean flags that Metrifier.eat() may set on each tweet it stores
+TWEET_FLAGS = (
+    u'is_mention',
+    u'is_reply',
+    u'is_retweet',
+    u'is_edited_retweet',
+    u'is_unedited_retweet',
+    u'is_original',
+    u'has_url',
+    u'has_hashtag'
+)
+
+# Counters kept for every user, see UserTable
+USER_COUNTERS = (
+    u'tweet',
+    u'is_original',
+    u'is_mention',
+    u'outbound_mention',
+    u'outbound_replies',
+    u'outbound_retweets',
+    u'outbound_unedited_retweets',
+    u'outbound_edited_retweets',
+    u'tweets_with_url',
+    u'has_url',
+    u'tweets_with_hashtag',
+    u'has_hashtag',
+    u'inbound_mention',
+    u'inbound_replies',
+    u'inbound_retweets',
+    u'inbound_unedited_retweets',
+    u'inbound_edited_retweets'
+)
+
+# Arrays of an EntityIndex with an entry per tweet or per entity
+ENTITY_INDEX_ARRAYS = (
+    u'author',
+    u'retweeted',
+    u'mention_user',
+    u'mention_reply',
+    u'mention_end',
+    u'url_id',
+    u'url_end',
+    u'hashtag_id',
+    u'hashtag_end'
+)
+
+# Every field of PeriodMetrics.frequency
+PERIOD_COUNTERS = (u'tweet', u'author') + TWEET_FLAGS
+
+# Leading bytes of each compressed format that read_lines() understands
+COMPRESSION_MAGIC = (
+    ('gzip', b'\x1f\x8b'),
+    ('bz2', b'BZh'),
+    ('xz', b'\xfd7zXZ\x00'),
+    ('zstd', b'\x28\xb5\x2f\xfd')
+)
+
+# array typecode for 64-bit integers ('q' is not available before Python 3.3)
+INT64 = 'l' if array('l').itemsize == 8 else 'q'
+
+# Kinds of report columns and the array typecodes they are kept in.
+# Text columns are lists. Ratio columns hold ratio(), which is 0 or -1
+# when a count is zero, so those are read back as ints.
+COLUMN_TYPECODES = {
+    u'text': None,
+    u'int': INT64,
+    u'float': 'd',
+    u'ratio': 'd'
+}
+
+# Tweet frequencies paired with the per-user counters that sum to them
+COHORT_FREQUENCY = (
+    (u'tweet', u'tweet'),
+    (u'is_original', u'is_original'),
+    (u'is_mention', u'is_mention'),
+    (u'is_reply', u'outbound_replies'),
+    (u'is_retweet', u'outbound_retweets'),
+    (u'is_unedited_retweet', u'outbound_unedited_retweets'),
+    (u'is_edited_retweet', u'outbound_edited_retweets'),
+    (u'has_url', u'tweets_with_url'),
+    (u'has_hashtag', u'tweets_with_hashtag')
+)
 
 
 #
@@ -56,32 +224,176 @@ def debug(s):
         sys.stderr.write(s)
 
 
-def from_postedTime_slow(postedTime):
-    """Convert date an ISO formatted strings to Python datetime objects
+def parse_postedTime(postedTime):
+    """Convert an ISO formatted string to integer seconds since the epoch.
+        Tweets arrive in dense clusters, so the start of each minute is
+        parsed once and cached.
     """
-    return datetime.datetime.strptime(postedTime, ISOFORMAT)
+    minute = postedTime[:16]
+    start = MINUTE_CACHE.get(minute)
+    if start is None:
+        if len(MINUTE_CACHE) >= MINUTE_CACHE_SIZE:
+            MINUTE_CACHE.clear()
+        start = MINUTE_CACHE[minute] = calendar.timegm((int(postedTime[:4]),
+                                                        int(postedTime[5:7]),
+                                                        int(postedTime[8:10]),
+                                                        int(postedTime[11:13]),
+                                                        int(postedTime[14:16]),
+                                                        0))
+    return start + int(postedTime[17:19])
+
+
+def format_epoch(seconds):
+    """Convert integer seconds since the epoch to an ISO formatted string
+    """
+    return time.strftime(ISOFORMAT, time.gmtime(seconds))
 
 
-def from_postedTime(postedTime):
-    """Convert date an ISO formatted strings to Python datetime objects
+def to_epoch(postedTimeObj):
+    """Convert a (UTC) datetime object to integer seconds since the epoch
     """
-    return datetime.datetime(int(postedTime[:4]),
-                             int(postedTime[5:7]),
-                             int(postedTime[8:10]),
-                             int(postedTime[11:13]),
-                             int(postedTime[14:16]),
-                             int(postedTime[17:19]))
+    return calendar.timegm(postedTimeObj.timetuple())
+
+
+def pack_flags(tweet):
+    """Return the TWEET_FLAGS set on tweet as a bitfield"""
+    bits = 0
+    for bit, flag in enumerate(TWEET_FLAGS):
+        if flag in tweet:
+            bits |= 1 << bit
+    return bits
+
+
+def unpack_flags(bits, tweet):
+    """Set the TWEET_FLAGS in bitfield bits on tweet"""
+    for bit, flag in enumerate(TWEET_FLAGS):
+        if bits & (1 << bit):
+            tweet[flag] = True
+    return tweet
+
+
+def period_start(period, seconds):
+    """Return the start, in epoch seconds, of the period (see PERIODS)
+        that the epoch second seconds falls in. Periods are identified by
+        their start.
+    """
+    length = PERIOD_SECONDS.get(period)
+    if length:
+        return seconds - seconds % length
+    day = (period, seconds // 86400)
+    start = CALENDAR_CACHE.get(day)
+    if start is None:
+        t = time.gmtime(seconds)
+        month = t.tm_mon if period == 'month' else 1
+        start = CALENDAR_CACHE[day] = calendar.timegm((t.tm_year, month, 1, 0, 0, 0))
+    return start
+
+
+def period_end(period, start):
+    """Return the end, in epoch seconds, of the period that begins at start"""
+    length = PERIOD_SECONDS.get(period)
+    if length:
+        return start + length
+    t = time.gmtime(start)
+    if period == 'month':
+        year, month = divmod(t.tm_year * 12 + t.tm_mon, 12)
+        return calendar.timegm((year, month + 1, 1, 0, 0, 0))
+    return calendar.timegm((t.tm_year + 1, 1, 1, 0, 0, 0))
+
+
+RE_TWEET_ID = re.compile(r'([0-9]+)$')
+RE_USER_ID = re.compile(r':([0-9]*)$')
+RE_MENTION = re.compile(r'@([A-Za-z0-9_]+)')
+RE_RETWEET = re.compile(r'(\"@|RT @|MT @|via @)([A-Za-z0-9_]+)')
+# Every @-mention in a body, with the retweet marker or plain @ before it.
+# Starting with a choice of literals keeps the quick search for the first
+# character that an optional group in front would lose.
+RE_BODY = re.compile(r'(RT @|MT @|via @|\"@|@)([A-Za-z0-9_]+)')
+# A mention that ends like this may have taken in the start of a retweet
+# marker right after it, e.g. @bobRT @carol
+MARKER_STARTS = (u'RT', u'MT', u'via')
+RE_VIA = re.compile(r'via @[a-z0-9_]*$')
+NO_MENTIONS = ((), None, False)
+
+
+def parse_tweet_id(id_str):
+    """Return the numeric Tweet ID at the end of id_str as an int
+        e.g., u'tag:search.twitter.com,2005:1234' returns 1234
+    """
+    m = RE_TWEET_ID.search(id_str)
+    if not m:
+        raise ValueError("Not a numeric tweet ID: {0}".format(id_str))
+    return int(m.group(1))
+
+
+def scan_body(body):
+    """Find the mentions and retweet markers in the text of a tweet, in one
+        pass of RE_BODY
+        Returns a tuple (mentions, retweet, edited):
+            mentions -- (marker, username) for every @-mention, where the
+                        marker is "@, RT @, MT @, via @ or just @ (see
+                        mention_indices() for where they are)
+            retweet  -- (marker, username) for the first "@ quote, RT @,
+                        MT @ or via @ in the text, or None
+            edited   -- True if the retweet carries added commentary (only
+                        meaningful for a u'post'): it does not start with
+                        RT or MT, and is a "@ quote without a closing " or
+                        does not end with via @username, in any case
+    """
+    # Every pattern needs an @
+    if not u'@' in body:
+        return NO_MENTIONS
+    mentions = RE_BODY.findall(body)
+    retweet = None
+    for marker, username in mentions:
+        if marker != u'@':
+            retweet = (marker, username)
+            break
+        if username.endswith(MARKER_STARTS):
+            # Rare: look for the first marker again, letters and all
+            retweet = RE_RETWEET.search(body)
+            if retweet is not None:
+                retweet = retweet.groups()
+            break
+    edited = False
+    if retweet is not None:
+        if not body[:2].lower() in (u'rt', u'mt'):
+            if body[:2] == u'"@':
+                edited = body[-1] != u'"'
+            else:
+                edited = not RE_VIA.search(body.lower())
+    return mentions, retweet, edited
+
+
+def mention_indices(body):
+    """Return (index of the @, username) for every @-mention in body, in
+        the order of the mentions of scan_body()
+    """
+    return [(m.start(), m.group(1)) for m in RE_MENTION.finditer(body)]
+
 
 def extract_user_id(s):
     """ Return Twitter User ID found in s
         Return None if no matches found
     """
-    m = re.search(r':([0-9]*)$', s)                
+    m = RE_USER_ID.search(s)
     if m:
         return m.group(1)
     else:
         return None
 
+def url_domain(url):
+    """Return the host name in url, in lower case and without a leading
+        "www.", or an empty string if it has none
+    """
+    try:
+        domain = urlparse.urlsplit(url).hostname or u''
+    except ValueError:
+        return u''
+    if domain.startswith(u'www.'):
+        domain = domain[4:]
+    return domain
+
 def ratio(n, m):
     """Return ratio of n:m as a float, returns -1 if m == 0
     """
@@ -98,48 +410,965 @@ def percent(n, m):
     return (100.0 * ratio(n, m))
 
 
+def as_numpy(values):
+    """Return a numpy array that shares the memory of an array.array"""
+    if not values:
+        return numpy.zeros(0, dtype=numpy.dtype(values.typecode))
+    return numpy.frombuffer(values, dtype=numpy.dtype(values.typecode))
+
+
+def take(column, rows):
+    """Return column[row] for each of rows, both array.arrays, as an
+        array.array of the type of column
+    """
+    if numpy is not None:
+        return array(column.typecode, as_numpy(column)[as_numpy(rows)].tostring())
+    return array(column.typecode, map(column.__getitem__, rows))
+
+
+def ratio_column(n, m):
+    """Return ratio(n[i], m[i]) for every i of two integer array.arrays,
+        as an array('d'), computed a whole column at a time with numpy if
+        it is installed
+    """
+    if numpy is not None:
+        n = as_numpy(n)
+        m = as_numpy(m)
+        column = numpy.full(len(n), -1.0)
+        numpy.true_divide(n, m, out=column, where=m != 0)
+        column[n == 0] = 0.0
+        return array('d', column.tostring())
+    return array('d', [0.0 if not a else -1.0 if not b else a / float(b)
+                       for a, b in itertools.izip(n, m)])
+
+
+def percent_column(n, m):
+    """Return percent(n[i], m[i]) for every i, see ratio_column()"""
+    column = ratio_column(n, m)
+    if numpy is not None:
+        return array('d', (100.0 * as_numpy(column)).tostring())
+    return array('d', [100.0 * value for value in column])
+
+
 #
 # Main classes
 #
 
 
-class Metrifier:
+class PeriodMetrics:
+    """Running totals for the tweets posted during one time period.
+        Exposes the frequency, timebounds, and url attributes that
+        report_period_row() reads from a Metrifier.
+    """
+
+    def __init__(self, sketch=False, precision=12):
+        """sketch: estimate the number of unique URLs with a HyperLogLog
+            of this precision rather than keeping a set of them
+        """
+        self.timebounds = {}
+        self.frequency = Counter()
+        self.author = set()
+        if sketch:
+            self.url = HyperLogLog(precision)
+        else:
+            self.url = set()
+
+    def add(self, tweet, author_id_str, urls):
+        """Count a tweet that has already been eaten by a Metrifier.
+            tweet: the dict that Metrifier.eat() stored for this tweet
+        """
+        self.add_many(((tweet, author_id_str, urls),))
+
+    def add_many(self, tweets):
+        """Count a sequence of (tweet, author_id_str, urls), see add()"""
+        frequency = self.frequency
+        author = self.author
+        first = last = None
+        flags = dict.fromkeys(TWEET_FLAGS, 0)
+        count = 0
+        for tweet, author_id_str, urls in tweets:
+            count += 1
+            epoch = tweet[u'epoch']
+            if first is None or epoch < first:
+                first = epoch
+            if last is None or epoch > last:
+                last = epoch
+            if not author_id_str in author:
+                author.add(author_id_str)
+                frequency[u'author'] += 1
+            for key in tweet:
+                if key in flags:
+                    flags[key] += 1
+            if urls:
+                self.url.update(urls)
+        if first is None:
+            return
+        if not u'tweet' in frequency:
+            self.timebounds[u'first'] = first
+            self.timebounds[u'last'] = last
+        else:
+            if first < self.timebounds[u'first']:
+                self.timebounds[u'first'] = first
+            if last > self.timebounds[u'last']:
+                self.timebounds[u'last'] = last
+        frequency[u'tweet'] += count
+        for flag in TWEET_FLAGS:
+            if flags[flag]:
+                frequency[flag] += flags[flag]
+
+    def merge(self, other):
+        """Add the totals of another PeriodMetrics for the same period"""
+        if not other.frequency:
+            return
+        if not self.frequency:
+            self.timebounds = dict(other.timebounds)
+        else:
+            if other.timebounds[u'first'] < self.timebounds[u'first']:
+                self.timebounds[u'first'] = other.timebounds[u'first']
+            if other.timebounds[u'last'] > self.timebounds[u'last']:
+                self.timebounds[u'last'] = other.timebounds[u'last']
+        self.frequency.update(other.frequency)
+        self.author.update(other.author)
+        self.frequency[u'author'] = len(self.author)
+        self.url.update(other.url)
+
+
+class BloomFilter:
+    """Fixed-memory set of integers. Membership tests may return false
+        positives, at about error_rate once capacity items have been added,
+        but never false negatives.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, n):
+        # Double hashing: two 64-bit hashes stand in for k hash functions
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(str(n)).digest())
+        return [(h1 + i * h2) % self.size for i in xrange(self.hashes)]
+
+    def __contains__(self, n):
+        bits = self.bits
+        for position in self.positions(n):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, n):
+        bits = self.bits
+        for position in self.positions(n):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def update(self, other):
+        """Add every item in another BloomFilter of the same size"""
+        if (self.size, self.hashes) != (other.size, other.hashes):
+            raise ValueError("Cannot combine Bloom filters of different sizes.")
+        bits = self.bits
+        for i, byte in enumerate(other.bits):
+            if byte:
+                bits[i] |= byte
+
+
+class HyperLogLog:
+    """Fixed-memory estimate of the number of distinct items added.
+        len() is usually within error (1.04 / sqrt(2 ** precision)) of
+        the true count, e.g. 1.6% with 4 KB of registers at precision 12.
+        While few registers are set they are kept in a dict (sparse), and
+        only once more than 1/128 of them are in a bytearray of 2 **
+        precision bytes, so that a sketch of a few items stays small.
+        Both give the same estimates.
+    """
+
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 16:
+            raise ValueError("HyperLogLog precision must be from 4 to 16.")
+        self.precision = precision
+        self.size = 1 << precision
+        self.error = 1.04 / math.sqrt(self.size)
+        self.sparse = {}
+        self.registers = None
+
+    def __len__(self):
+        m = self.size
+        if self.registers is None:
+            ranks = self.sparse.values()
+            empty = m - len(ranks)
+            total = empty + sum(2.0 ** -r for r in ranks)
+        else:
+            empty = self.registers.count(b'\x00')
+            total = sum(2.0 ** -r for r in self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / total
+        # Linear counting is more accurate while many registers are empty
+        if estimate <= 2.5 * m and empty:
+            estimate = m * math.log(m / float(empty))
+        return int(round(estimate))
+
+    def add(self, item):
+        if isinstance(item, unicode):
+            item = item.encode('utf-8')
+        else:
+            item = str(item)
+        h, = struct.unpack('<Q', hashlib.md5(item).digest()[:8])
+        bits = 64 - self.precision
+        # Position of the first 1 bit in what is left of the hash
+        self.set(h >> bits, bits - (h & ((1 << bits) - 1)).bit_length() + 1)
+
+    def set(self, index, rank):
+        """Raise register index to rank, if it is lower"""
+        if self.registers is None:
+            sparse = self.sparse
+            if rank > sparse.get(index, 0):
+                sparse[index] = rank
+                if len(sparse) > self.size >> 7:
+                    self.densify()
+        elif rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def densify(self):
+        """Move the registers from the dict to a bytearray"""
+        registers = bytearray(self.size)
+        for index, rank in self.sparse.iteritems():
+            registers[index] = rank
+        self.registers = registers
+        self.sparse = None
+
+    def iterregisters(self):
+        """Return the (index, rank) of each register that is set, in order"""
+        if self.registers is None:
+            return sorted(self.sparse.iteritems())
+        return [(index, rank) for index, rank in enumerate(self.registers) if rank]
+
+    def update(self, items):
+        """Add every item in items, which may be another HyperLogLog of
+            the same precision
+        """
+        if isinstance(items, HyperLogLog):
+            if self.precision != items.precision:
+                raise ValueError("Cannot combine HyperLogLogs of different precisions.")
+            if items.registers is None:
+                for index, rank in items.sparse.iteritems():
+                    self.set(index, rank)
+                return
+            if self.registers is None:
+                self.densify()
+            registers = self.registers
+            for i, rank in enumerate(items.registers):
+                if rank > registers[i]:
+                    registers[i] = rank
+        else:
+            for item in items:
+                self.add(item)
+
+
+class SpaceSaving:
+    """Fixed-memory, Counter-like tally of the most frequent items added.
+        At most size items are counted. When a new item arrives and the
+        table is full, it replaces the item with the lowest count and
+        inherits that count, so counts may be overestimated but never
+        underestimated, and any item seen more than 1/size of the time is
+        always kept. bounds() returns the range the true count lies in.
+        len() estimates the number of distinct items with a HyperLogLog of
+        the given precision.
+    """
+
+    def __init__(self, size, precision=12):
+        if size < 1:
+            raise ValueError("A SpaceSaving table must count at least one item.")
+        self.size = size
+        self.count = {}
+        self.error = {}
+        self.bucket = {}    # count -> set of the items with that count
+        self.minimum = 0
+        self.distinct = HyperLogLog(precision)
+
+    def __len__(self):
+        return len(self.distinct)
+
+    def __iter__(self):
+        return iter(self.count)
+
+    def __contains__(self, item):
+        return item in self.count
+
+    def __getitem__(self, item):
+        return self.count.get(item, 0)
+
+    def floor(self):
+        """Return the most times an item that is not counted may have been added"""
+        if len(self.count) < self.size:
+            return 0
+        return self.minimum
+
+    def bounds(self, item):
+        """Return (lowest, highest) number of times item may have been added"""
+        if item in self.count:
+            return self.count[item] - self.error[item], self.count[item]
+        return 0, self.floor()
+
+    def most_common(self, n=None):
+        """Return a list of the n most common items and their counts,
+            from the most common to the least, like Counter.most_common()
+        """
+        items = sorted(self.count.iteritems(), key=operator.itemgetter(1), reverse=True)
+        if n is None:
+            return items
+        return items[:n]
+
+    def move(self, item, old, new):
+        bucket = self.bucket
+        bucket[old].discard(item)
+        if not bucket[old]:
+            del bucket[old]
+            # Every other item has a count above old
+            if old == self.minimum:
+                self.minimum = new
+        if new in bucket:
+            bucket[new].add(item)
+        else:
+            bucket[new] = set([item])
+        self.count[item] = new
+
+    def add(self, item):
+        self.distinct.add(item)
+        count = self.count
+        if item in count:
+            self.move(item, count[item], count[item] + 1)
+        elif len(count) < self.size:
+            count[item] = 1
+            self.error[item] = 0
+            self.bucket.setdefault(1, set()).add(item)
+            self.minimum = 1
+        else:
+            minimum = self.minimum
+            evicted = self.bucket[minimum].pop()
+            del count[evicted]
+            del self.error[evicted]
+            self.bucket[minimum].add(item)
+            self.error[item] = minimum
+            self.move(item, minimum, minimum + 1)
+
+    def update(self, items):
+        """Add every item in items, which may be another SpaceSaving
+            table, in which case both sets of counts are summed
+        """
+        if not isinstance(items, SpaceSaving):
+            for item in items:
+                self.add(item)
+            return
+        floor, other_floor = self.floor(), items.floor()
+        count = {}
+        error = {}
+        for item in set(self.count) | set(items.count):
+            count[item] = self.count.get(item, floor) + items.count.get(item, other_floor)
+            error[item] = self.error.get(item, floor) + items.error.get(item, other_floor)
+        kept = sorted(count, key=count.get, reverse=True)[:self.size]
+        self.count = dict((item, count[item]) for item in kept)
+        self.error = dict((item, error[item]) for item in kept)
+        self.bucket = {}
+        for item, n in self.count.iteritems():
+            self.bucket.setdefault(n, set()).add(item)
+        self.minimum = min(self.bucket) if self.bucket else 0
+        self.distinct.update(items.distinct)
+
+
+class TweetStore:
+    """Columnar storage for the tweets eaten by a Metrifier.
+        Each tweet is kept as the integer at the end of its id, the index
+        of the rest of its id (e.g. u'tag:search.twitter.com,2005:') in a
+        list of the prefixes seen, its posted time in epoch seconds, and a
+        bitfield of its TWEET_FLAGS, in arrays that grow as tweets are
+        added. Tweets are read back as the same dicts that a Metrifier
+        stores by default.
+    """
 
-    re_mention = re.compile(r'@([A-Za-z0-9_]+)')
-    re_retweet = re.compile(r'(\"@|RT @|MT @|via @)([A-Za-z0-9_]+)')
-    re_via = re.compile(r'via @[a-z0-9_]*$')
+    def __init__(self):
+        self.id = array(INT64)
+        self.prefix_id = array('H')
+        self.prefix = []
+        self.prefixes = {}
+        self.time = array(INT64)
+        self.flags = array('B')
+
+    def __len__(self):
+        return len(self.id)
+
+    def __iter__(self):
+        for row in xrange(len(self.id)):
+            yield self.id_str(row)
+
+    def intern_prefix(self, prefix):
+        i = self.prefixes.get(prefix)
+        if i is None:
+            i = len(self.prefix)
+            if i > 0xFFFF:
+                raise ValueError("Too many different tweet id prefixes to store.")
+            self.prefixes[prefix] = i
+            self.prefix.append(prefix)
+        return i
+
+    def append(self, tweet_id, epoch, tweet):
+        """Store a tweet dict built by Metrifier.eat() under an int tweet_id
+            (parsed from its u'id_str') and its posted time in epoch seconds
+        """
+        id_str = tweet[u'id_str']
+        # Any leading zeros of the number stay in the prefix
+        self.prefix_id.append(self.intern_prefix(id_str[:len(id_str) - len(str(tweet_id))]))
+        self.id.append(tweet_id)
+        self.time.append(epoch)
+        self.flags.append(pack_flags(tweet))
+
+    def extend(self, other):
+        """Append every tweet in another TweetStore"""
+        ids = [self.intern_prefix(prefix) for prefix in other.prefix]
+        if ids == range(len(ids)):
+            self.prefix_id.extend(other.prefix_id)
+        else:
+            self.prefix_id.extend(ids[i] for i in other.prefix_id)
+        self.id.extend(other.id)
+        self.time.extend(other.time)
+        self.flags.extend(other.flags)
+
+    def id_str(self, row):
+        """Return the id of the tweet at row as it was eaten"""
+        return self.prefix[self.prefix_id[row]] + unicode(self.id[row])
+
+    def record(self, row):
+        """Return the tweet stored at row as a dict"""
+        tweet = {
+            u'id_str': self.id_str(row),
+            u'epoch': self.time[row]
+        }
+        return unpack_flags(self.flags[row], tweet)
+
+
+class TimeIndex:
+    """Rows of a Metrifier's tweet store ordered by posted time.
+        Rows are appended as tweets are eaten, and only sorted again (by
+        time, then row) when one arrives out of order, which makes range
+        queries a pair of binary searches.
+    """
+
+    def __init__(self):
+        self.time = array(INT64)
+        self.row = array(INT64)
+        self.is_sorted = True
+
+    def __len__(self):
+        return len(self.row)
+
+    def add(self, epoch, row):
+        if self.time and epoch < self.time[-1]:
+            self.is_sorted = False
+        self.time.append(epoch)
+        self.row.append(row)
+
+    def extend(self, other, offset):
+        """Append the rows of another TimeIndex, shifted by offset"""
+        if other.time and self.time and other.time[0] < self.time[-1]:
+            self.is_sorted = False
+        self.is_sorted = self.is_sorted and other.is_sorted
+        self.time.extend(other.time)
+        self.row.extend(row + offset for row in other.row)
+
+    def sort(self):
+        if not self.is_sorted:
+            pairs = sorted(itertools.izip(self.time, self.row))
+            self.time = array(INT64, (epoch for epoch, row in pairs))
+            self.row = array(INT64, (row for epoch, row in pairs))
+            self.is_sorted = True
+
+    def rows(self, start=None, end=None):
+        """Return the rows of tweets posted from start to end (inclusive),
+            in epoch seconds, in chronological order
+        """
+        self.sort()
+        lo = 0
+        hi = len(self.time)
+        if start is not None:
+            lo = bisect_left(self.time, start)
+        if end is not None:
+            hi = bisect_right(self.time, end)
+        return self.row[lo:hi]
+
+
+class Postings:
+    """For one kind of entity in an EntityIndex, the rows of the tweets
+        that contain each term, as sorted arrays. Terms are interned to
+        integer ids in the order they were first posted.
+    """
+
+    def __init__(self):
+        self.id = {}
+        self.term = []
+        self.rows = []
+
+    def __len__(self):
+        return len(self.term)
+
+    def __contains__(self, term):
+        return term in self.id
+
+    def intern(self, term):
+        i = self.id.get(term)
+        if i is None:
+            i = len(self.term)
+            self.id[term] = i
+            self.term.append(term)
+            self.rows.append(array(INT64))
+        return i
+
+    def add(self, term, row):
+        """Post row under term, and return the id of term.
+            Rows must be posted in order.
+        """
+        i = self.intern(term)
+        rows = self.rows[i]
+        # A tweet with the same hashtag twice is posted once
+        if not rows or rows[-1] != row:
+            rows.append(row)
+        return i
+
+    def get(self, term):
+        """Return the sorted array of rows that contain term"""
+        i = self.id.get(term)
+        if i is None:
+            return array(INT64)
+        return self.rows[i]
+
+    def extend(self, term, rows, offset):
+        """Post rows, shifted by offset, under term, and return its id"""
+        i = self.intern(term)
+        mine = self.rows[i]
+        if mine and rows and mine[-1] >= rows[0] + offset:
+            # Two terms elsewhere are one term here
+            self.rows[i] = array(INT64, sorted(set(mine).union(row + offset for row in rows)))
+        else:
+            mine.extend(row + offset for row in rows)
+        return i
+
+    def merge(self, other, offset, terms=None):
+        """Post the rows of another Postings, shifted by offset, after ours.
+            terms: the terms of other as they are known here, if not the same
+            Returns an array of the ids here of each of other's terms.
+        """
+        return array(INT64, (self.extend(term, rows, offset)
+                             for term, rows in itertools.izip(terms or other.term, other.rows)))
+
+
+class EntityIndex:
+    """Inverted indexes of a Metrifier's tweets by hashtag, URL, URL domain
+        (see url_domain()) and mentioned user (by UserTable index), each a
+        Postings of rows, as in Metrifier.record(), so the tweets with an
+        entity are found in time proportional to their number. Mentions of
+        users whose id was not known are all counted under the same user,
+        so they are posted under their lower-cased username instead.
+        For each row, the author, mentions, retweeted user, URLs and
+        hashtags are kept in flat arrays too, so that Metrifier.subset()
+        can count any of the tweets again without re-reading them. The
+        mentions of a row are mention_user[mention_end[row - 1]:
+        mention_end[row]], and likewise for URLs and hashtags.
+    """
 
     def __init__(self):
+        self.hashtag = Postings()
+        self.url = Postings()
+        self.domain = Postings()
+        self.mention = Postings()
+        self.unresolved = Postings()
+        self.author = array(INT64)
+        # -1 for tweets that are not retweets
+        self.retweeted = array(INT64)
+        self.mention_user = array(INT64)
+        self.mention_reply = array('B')
+        self.mention_end = array(INT64)
+        self.url_id = array(INT64)
+        self.url_end = array(INT64)
+        self.hashtag_id = array(INT64)
+        self.hashtag_end = array(INT64)
+
+    def __len__(self):
+        return len(self.author)
+
+    def add(self, author, mentions, retweeted, urls, hashtags):
+        """Index the next row.
+            author: UserTable index of the author
+            mentions: (UserTable index, is an @-reply, username) of each
+            mention, where username is None if the user's id is known
+            retweeted: UserTable index of the retweeted user, or -1
+            urls, hashtags: as parsed by the Metrifier
+        """
+        row = len(self.author)
+        self.author.append(author)
+        self.retweeted.append(retweeted)
+        for user, reply, username in mentions:
+            if username is None:
+                self.mention.add(user, row)
+            else:
+                self.unresolved.add(username, row)
+            self.mention_user.append(user)
+            self.mention_reply.append(reply)
+        self.mention_end.append(len(self.mention_user))
+        for url in urls:
+            self.url_id.append(self.url.add(url, row))
+            self.domain.add(url_domain(url), row)
+        self.url_end.append(len(self.url_id))
+        for hashtag in hashtags:
+            self.hashtag_id.append(self.hashtag.add(hashtag, row))
+        self.hashtag_end.append(len(self.hashtag_id))
+
+    def merge(self, other, users, usernames):
+        """Add the rows of another EntityIndex after ours
+            users: array of the UserTable index here of each user in other's
+            usernames: for each user in other's, the username to post its
+            mentions under if its id is not known here, else None
+        """
+        offset = len(self)
+        self.author.extend(users[user] for user in other.author)
+        self.retweeted.extend(-1 if user < 0 else users[user] for user in other.retweeted)
+
+        for user, rows in itertools.izip(other.mention.term, other.mention.rows):
+            if usernames[user] is None:
+                self.mention.extend(users[user], rows, offset)
+            else:
+                self.unresolved.extend(usernames[user], rows, offset)
+        self.unresolved.merge(other.unresolved, offset)
+        self.mention_end.extend(end + len(self.mention_user) for end in other.mention_end)
+        self.mention_user.extend(users[user] for user in other.mention_user)
+        self.mention_reply.extend(other.mention_reply)
+
+        ids = self.url.merge(other.url, offset)
+        self.url_end.extend(end + len(self.url_id) for end in other.url_end)
+        self.url_id.extend(ids[i] for i in other.url_id)
+        self.domain.merge(other.domain, offset)
+
+        ids = self.hashtag.merge(other.hashtag, offset)
+        self.hashtag_end.extend(end + len(self.hashtag_id) for end in other.hashtag_end)
+        self.hashtag_id.extend(ids[i] for i in other.hashtag_id)
+
+    def entities(self, row, ends, values):
+        """Return the slice of values for row, see the class docstring"""
+        return values[ends[row - 1] if row else 0:ends[row]]
+
+    def rows(self, hashtag=None, url=None, domain=None, mention=None, username=None):
+        """Return the sorted rows of the tweets that have all of the given
+            entities (all rows if none are given). Each row of the shortest
+            list of rows is looked up in the others with a binary search.
+            mention: a UserTable index
+            username: the lower-cased username of the same user, to find
+            the mentions of it from before its id was known
+        """
+        lists = []
+        for postings, term in ((self.hashtag, hashtag), (self.url, url),
+                               (self.domain, domain)):
+            if term is not None:
+                lists.append(postings.get(term))
+        if mention is not None or username is not None:
+            resolved = self.mention.get(mention)
+            unresolved = self.unresolved.get(username)
+            if resolved and unresolved:
+                lists.append(array(INT64, sorted(set(resolved).union(unresolved))))
+            else:
+                lists.append(resolved or unresolved)
+        if not lists:
+            return array(INT64, xrange(len(self)))
+        lists.sort(key=len)
+        rows = lists[0]
+        for other in lists[1:]:
+            found = array(INT64)
+            end = len(other)
+            for row in rows:
+                i = bisect_left(other, row)
+                if i < end and other[i] == row:
+                    found.append(row)
+            rows = found
+        return array(INT64, rows)
+
+
+class UserView:
+    """Read-only, Counter-like view of one user in a UserTable"""
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, key):
+        if key == u'id_str':
+            return self.table.id_str[self.index]
+        if key == u'username':
+            return self.table.username[self.index]
+        if key in self.table.counter:
+            return self.table.counter[key][self.index]
+        return 0
+
+    def __contains__(self, key):
+        if key in (u'id_str', u'username'):
+            return True
+        return bool(self[key])
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+
+class UserTable:
+    """Every user observed by a Metrifier, interned to a dense integer index.
+        Each of the USER_COUNTERS is a column: an integer array with one
+        entry per user. Looking up a user by id_str returns a UserView,
+        so the table can be read like a dict of Counters.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.id_str = []
+        self.username = []
+        self.counter = dict((key, array(INT64)) for key in USER_COUNTERS)
+        self.columns = self.counter.values()
+
+    def __len__(self):
+        return len(self.id_str)
+
+    def __contains__(self, id_str):
+        return id_str in self.index
+
+    def __getitem__(self, id_str):
+        return UserView(self, self.index[id_str])
+
+    def itervalues(self):
+        for index in xrange(len(self.id_str)):
+            yield UserView(self, index)
+
+    def intern(self, id_str, username):
+        """Return the index of the user with id_str, adding them if they are new"""
+        index = self.index.get(id_str)
+        if index is None:
+            index = len(self.id_str)
+            self.index[id_str] = index
+            self.id_str.append(id_str)
+            self.username.append(username)
+            for column in self.columns:
+                column.append(0)
+        return index
+
+    def merge(self, other, rename=None):
+        """Add the counters of every user in another UserTable.
+            Users new to this table keep the username they had in other.
+            rename: maps id_strs in other to the id_strs they are counted under
+            Returns the number of users who had no tweets here but do in
+            other, i.e. who are new authors.
+        """
+        rename = rename or {}
+        tweets = self.counter[u'tweet']
+        other_tweets = other.counter[u'tweet']
+        authors = 0
+        for i, id_str in enumerate(other.id_str):
+            index = self.intern(rename.get(id_str, id_str), other.username[i])
+            if other_tweets[i] and not tweets[index]:
+                authors += 1
+            for key, column in self.counter.iteritems():
+                column[index] += other.counter[key][i]
+        return authors
+
+    def column(self, key):
+        """Return the array of counts for key, indexed by user"""
+        return self.counter[key]
+
+
+class Metrifier:
+
+    def __init__(self, periods=('hour',), columnar=False, shard=False,
+                 dedup=None, capacity=10000000, error_rate=0.001,
+                 streaming=False, sketch=None, sketch_precision=12, index=False):
+        """periods: granularities (see PERIODS) to keep running
+            totals for, these are the periods that report() can break down
+            columnar: keep tweets in a compact TweetStore rather than a dict
+                of dicts (tweet ids must be numeric)
+            shard: this Metrifier eats one part of a larger collection and
+                will be merged into a Metrifier that ate the earlier parts
+            dedup: reject tweets whose id has already been eaten, either
+                'exact' (a set of every tweet id) or 'bloom' (a BloomFilter
+                sized for capacity tweets that wrongly rejects about
+                error_rate of new tweets); tweet ids must be numeric
+            streaming: keep only the per-user and per-period counters, not
+                the tweets themselves, so memory grows with the number of
+                users, periods and distinct URLs and hashtags rather than
+                tweets (with sketch, only users and periods)
+            sketch: count only about this many of the most frequent URLs
+                and hashtags, in SpaceSaving tables, and estimate the
+                number of unique URLs with HyperLogLogs
+            sketch_precision: precision of those HyperLogLogs, from 4 to 16;
+                each uses at most 2 ** sketch_precision bytes and is off
+                by about 104 / sqrt(2 ** sketch_precision) percent
+            index: keep an EntityIndex of the hashtags, URLs, domains and
+                mentioned users of every tweet, see query()
+        """
+        if streaming and (columnar or index):
+            raise ValueError("A streaming Metrifier does not store tweets.")
         # These default values may seem counterintuitive but
         # After two tweets are "eaten", they will make more sense
         self.timebounds = {
-            u'first': datetime.datetime.now(),
-            u'last': datetime.datetime(2006, 3, 21)  # Twitter founded
+            u'first': int(time.time()),
+            u'last': calendar.timegm((2006, 3, 21, 0, 0, 0))  # Twitter founded
         }
-        self.tweet = {}
-        self.tweet_id = []
+        self.columnar = columnar
+        self.shard = shard
+        self.streaming = streaming
+        self.dedup = dedup
+        if dedup == 'exact':
+            self.seen = set()
+        elif dedup == 'bloom':
+            self.seen = BloomFilter(capacity, error_rate)
+        elif dedup:
+            raise ValueError("Unknown dedup mode: {0}".format(dedup))
+        else:
+            self.seen = None
+        if streaming:
+            self.tweet = None
+            self.tweet_id = None
+            self.time_index = None
+            self.user_tweet = None
+        else:
+            if columnar:
+                # The store already holds each tweet's id
+                self.tweet = TweetStore()
+                self.tweet_id = None
+            else:
+                self.tweet = {}
+                self.tweet_id = []
+            self.time_index = TimeIndex()
+            # The tweets of each author, as rows of the TweetStore or id_strs
+            if columnar:
+                self.user_tweet = defaultdict(functools.partial(array, INT64))
+            else:
+                self.user_tweet = defaultdict(list)
         self.frequency = Counter()
-        self.user = {}
-        self.user_tweet = defaultdict(list)
-        self.url = Counter()
-        self.hashtag = Counter()
+        self.user = UserTable()
+        self.sketch = sketch
+        self.sketch_precision = sketch_precision
+        if sketch:
+            self.url = SpaceSaving(sketch, sketch_precision)
+            self.hashtag = SpaceSaving(sketch, sketch_precision)
+        else:
+            self.url = Counter()
+            self.hashtag = Counter()
         self.username = {}
         self.activity = []
+        self.periods = tuple(periods)
+        self.period = dict((period, {}) for period in self.periods)
+        self.index = EntityIndex() if index else None
+
+    def merge(self, other):
+        """Add everything that another Metrifier has eaten to this one.
+            other: a Metrifier that tracks the same periods with the same
+                kind of tweet store, e.g. one fed a different shard of a
+                collection
+            Returns this Metrifier.
+            Tweets eaten by both Metrifiers are counted twice, even when
+            rejecting duplicates, but later duplicates of either are rejected.
+        """
+        if self.periods != other.periods:
+            raise ValueError("Cannot merge Metrifiers that track different periods.")
+        if self.columnar != other.columnar or self.streaming != other.streaming:
+            raise ValueError("Cannot merge Metrifiers that store tweets differently.")
+        if self.dedup != other.dedup:
+            raise ValueError("Cannot merge Metrifiers that reject duplicates differently.")
+        if (self.sketch, self.sketch_precision) != (other.sketch, other.sketch_precision):
+            raise ValueError("Cannot merge Metrifiers that count URLs and hashtags differently.")
+        if (self.index is None) != (other.index is None):
+            raise ValueError("Cannot merge Metrifiers that index tweets differently.")
+
+        # A shard counts users it could not look up under placeholders,
+        # which are resolved with the usernames this Metrifier knows
+        rename = {}
+        for id_str in other.user.id_str:
+            if id_str.startswith(u'@'):
+                rename[id_str] = self.lookup_user_id_str(id_str[1:])
+
+        if other.timebounds[u'first'] < self.timebounds[u'first']:
+            self.timebounds[u'first'] = other.timebounds[u'first']
+        if other.timebounds[u'last'] > self.timebounds[u'last']:
+            self.timebounds[u'last'] = other.timebounds[u'last']
+
+        if self.columnar:
+            offset = len(self.tweet)
+            self.time_index.extend(other.time_index, offset)
+            self.tweet.extend(other.tweet)
+            for author_id_str, rows in other.user_tweet.iteritems():
+                self.user_tweet[author_id_str].extend(row + offset for row in rows)
+        elif not self.streaming:
+            self.time_index.extend(other.time_index, len(self.tweet_id))
+            self.tweet.update(other.tweet)
+            self.tweet_id.extend(other.tweet_id)
+            for author_id_str, tweets in other.user_tweet.iteritems():
+                self.user_tweet[author_id_str].extend(tweets)
+
+        # A user may be an author in one Metrifier and only mentioned in the other
+        authors = self.frequency[u'author'] + self.user.merge(other.user, rename)
+        if self.index is not None:
+            users = array(INT64, (self.user.index[rename.get(id_str, id_str)] for id_str in other.user.id_str))
+            usernames = [id_str[1:] if rename.get(id_str) == u'' else None
+                         for id_str in other.user.id_str]
+            self.index.merge(other.index, users, usernames)
+        for username, id_str in other.username.iteritems():
+            self.username[username] = rename.get(id_str, id_str)
+        self.url.update(other.url)
+        self.hashtag.update(other.hashtag)
+        self.activity.extend(other.activity)
+        if self.seen is not None:
+            self.seen.update(other.seen)
+
+        self.frequency.update(other.frequency)
+        if authors:
+            self.frequency[u'author'] = authors
+
+        for period in self.periods:
+            buckets = self.period[period]
+            for key, bucket in other.period[period].iteritems():
+                if not key in buckets:
+                    buckets[key] = PeriodMetrics(self.sketch, self.sketch_precision)
+                buckets[key].merge(bucket)
+
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def save(self, path):
+        """Write everything this Metrifier has eaten to a state file at path,
+            see save_state()
+        """
+        save_state(self, path)
+
+    @classmethod
+    def load(cls, path):
+        """Return the Metrifier saved in the state file at path, ready to eat
+            more tweets, see load_state()
+        """
+        return load_state(path)
 
     def lookup_user_id_str(self, username):
-        return self.username.get(username.lower(), u'')
+        username = username.lower()
+        if self.shard:
+            # Resolved by merge(), see __init__
+            return self.username.get(username, u'@' + username)
+        return self.username.get(username, u'')
 
-    def parse_mentions(self, tweet):
+    def parse_mentions(self, tweet, scan=None):
         mentions = tweet.get('twitter_entities', {}).get('user_mentions', [])
-        parsed = [m for m in self.re_mention.finditer(tweet.get('body', ''))]
-        if len(parsed) > len(mentions):
+        if scan is None:
+            scan = scan_body(tweet.get('body', ''))
+        if len(scan[0]) > len(mentions):
             starting_indices = [m[u'indices'][0] for m in mentions]
-            for mention in parsed:
-                if not (mention.start(1)-1) in starting_indices:
-                    username = mention.group(1)
+            for start, username in mention_indices(tweet.get('body', '')):
+                if not start in starting_indices:
                     u = {
                         u'id_str': self.lookup_user_id_str(username),
-                        u'indices': [mention.start(1)-1, mention.end(1)],
+                        u'indices': [start, start + 1 + len(username)],
                         u'screen_name': username
                         }
                     mentions.append(u)
@@ -154,7 +1383,7 @@ class Metrifier:
         hashtags = tweet.get('twitter_entities', {}).get('hashtags', [])
         return [ht[u'text'].lower() for ht in hashtags]
 
-    def parse_retweet(self, tweet):
+    def parse_retweet(self, tweet, scan=None):
         rt = {}
         if tweet.get(u'verb', u'') == 'share':
             retweeted_status = tweet.get('object', {})
@@ -166,9 +1395,11 @@ class Metrifier:
                 u'retweeted_author_username': retweeted_author.get('preferredUsername', u'')
             }
         else:
-            m = self.re_retweet.search(tweet.get(u'body', ''))
-            if m:
-                retweeted_author_username = m.group(2)
+            if scan is None:
+                scan = scan_body(tweet.get(u'body', ''))
+            mentions, retweet, edited = scan
+            if retweet:
+                retweeted_author_username = retweet[1]
                 rt = {
                     u'edited': False,
                     u'retweeted_author_username': retweeted_author_username,
@@ -177,30 +1408,50 @@ class Metrifier:
         # If RT, is there add'l commentary?
         if rt:
             if tweet[u'verb'] == 'post':
-                if not tweet[u'body'][:2].lower() in ('rt', 'mt'):
-                    if (tweet[u'body'][:2] == '"@'):
-                        if not (tweet[u'body'][-1] == '"'):
-                            rt[u'edited'] = True
-                    elif not self.re_via.search(tweet[u'body'].lower()):
-                            rt[u'edited'] = True
+                rt[u'edited'] = edited
         return rt
 
+    def record(self, row):
+        """Return the stored tweet at row (in the order tweets were eaten)"""
+        if self.streaming:
+            raise ValueError("A streaming Metrifier does not store tweets.")
+        if self.columnar:
+            return self.tweet.record(row)
+        return self.tweet[self.tweet_id[row]]
+
+    def user_tweet_ids(self, author_id_str):
+        """Return the id_strs of the stored tweets by a user, in the order
+            they were eaten
+        """
+        tweets = self.user_tweet.get(author_id_str, [])
+        if self.columnar:
+            return [self.tweet.id_str(row) for row in tweets]
+        return tweets
+
     def chronological(self, reverse=False):
         """ Iterator yields tweets in chronological order """
-        for id_str in sorted(self.tweet, reverse=reverse):
-            yield self.tweet[id_str]
-
-    def itertweets(self, key=u'body', start=None, end=None):
-        if not start:
-            start = datetime.datetime.fromtimestamp(0)
-        if not end:
-            end = datetime.datetime.now()
-        condition = lambda tweet: tweet.get(key, False)
-        iter_tweet_ids = (self.tweet[id_str] for id_str in sorted(self.tweet))
-        for tweet in itertools.ifilter(condition, iter_tweet_ids):
-            if tweet[u'postedTimeObj'] > end:
-                break
-            if tweet[u'postedTimeObj'] >= start:
+        if self.streaming:
+            raise ValueError("A streaming Metrifier does not store tweets.")
+        rows = self.time_index.rows()
+        if reverse:
+            rows = reversed(rows)
+        for row in rows:
+            yield self.record(row)
+
+    def itertweets(self, key=None, start=None, end=None):
+        """Iterate over the tweets posted from start to end (inclusive
+            datetimes) in chronological order.
+            key: only return tweets that have this key set, e.g. u'is_retweet'
+        """
+        if self.streaming:
+            raise ValueError("A streaming Metrifier does not store tweets.")
+        if start:
+            start = to_epoch(start)
+        if end:
+            end = to_epoch(end)
+        for row in self.time_index.rows(start, end):
+            tweet = self.record(row)
+            if key is None or tweet.get(key, False):
                 yield tweet
         return
 
@@ -208,29 +1459,48 @@ class Metrifier:
         """Iterate over all the users observed in this collection.
             Only users that have key in their dict keys will be returned.
         """
-        activity = []
-        for user in self.user.itervalues():
-            if include_inactive:
-                if not key in user:
-                    activity.append((0, user[u'id_str']))
-            else:
-                activity.append((user[key], user[u'id_str']))
-        for count, id_str in sorted(activity, reverse=reverse):
-            yield self.user[id_str]
+        users = self.user
+        if key in users.counter:
+            counts = users.column(key)
+        else:
+            counts = array(INT64, [0]) * len(users)
+        if include_inactive:
+            indices = [i for i in xrange(len(users)) if not counts[i]]
+        else:
+            indices = range(len(users))
+        id_str = users.id_str
+        indices.sort(key=lambda i: (counts[i], id_str[i]), reverse=reverse)
+        for i in indices:
+            yield UserView(users, i)
         return
 
     def group_users_by_activity(self, key=u'tweet', reverse=False, include_id_str=False):
-        iter_users_by_activity = itertools.groupby(
-                                    self.iterusers(key=key, reverse=reverse),
-                                    lambda u: u.get(key, 0))
-        for activity, cohort in iter_users_by_activity:
-            user = []
-            user_count = 0
-            for u in cohort:
-                if include_id_str:
-                    if not u[u'id_str'] in user:
-                        user.append(u[u'id_str'])
-                user_count += 1
+        """Yield metrics for each group of users with the same activity (key count).
+            Users are bucketed with a counting sort, which takes
+            O(users + max activity) rather than sorting every user.
+        """
+        buckets = {}
+        id_str = self.user.id_str
+        if key in self.user.counter:
+            counts = self.user.column(key)
+        else:
+            counts = array(INT64, [0]) * len(id_str)
+        for index, activity in enumerate(counts):
+            if activity in buckets:
+                buckets[activity].append(id_str[index])
+            else:
+                buckets[activity] = [id_str[index]]
+        if not buckets:
+            return
+        if reverse:
+            levels = xrange(max(buckets), -1, -1)
+        else:
+            levels = xrange(max(buckets) + 1)
+        for activity in levels:
+            if not activity in buckets:
+                continue
+            user = buckets.pop(activity)
+            user_count = len(user)
             count = user_count * activity
             per_cent = percent(count, self.frequency.get(key, -1))
             cohort_metrics = {
@@ -244,7 +1514,25 @@ class Metrifier:
                 cohort_metrics[u'user'] = user
             yield cohort_metrics
 
-    def group_users_by_percentile(self, divisions=(100,)):
+    def cohort_frequency(self, user_id_strs):
+        """Return the tweet frequencies for the tweets sent by a group of users.
+            Sums the per-user counters, so no tweets are revisited.
+        """
+        indices = [self.user.index[id_str] for id_str in user_id_strs]
+        frequency = Counter()
+        for key, user_key in COHORT_FREQUENCY:
+            column = self.user.column(user_key)
+            frequency[key] = sum(column[i] for i in indices)
+        return frequency
+
+    def group_users_by_percentile(self, divisions=(100,), include_tweets=True):
+        """Yield (percentile, cohort, tweets) for groups of users sorted by activity.
+            include_tweets: collect the id_str of every tweet sent by the cohort,
+                otherwise tweets is None (not available when streaming)
+        """
+
+        if include_tweets and self.streaming:
+            raise ValueError("A streaming Metrifier does not store tweets.")
 
         if not self.frequency:
             raise ValueError("I am hungry. Feed me tweets.")
@@ -270,14 +1558,15 @@ class Metrifier:
             n += group[u'count']
             cohort[u'activity'] = group.pop('cohort')
             group.pop('key')
+            # Each user belongs to exactly one activity group
+            cohort[u'user'].extend(group.pop(u'user'))
             cohort.update(group)
-            for user_id_str in group.get(u'user', []):
-                if not user_id_str in cohort[u'user']:
-                    cohort[u'user'].append(user_id_str)
             if n > boundary:
-                tweets = []
-                for author_id_str in cohort[u'user']:
-                    tweets.extend(self.user_tweet[author_id_str])
+                tweets = None
+                if include_tweets:
+                    tweets = []
+                    for author_id_str in cohort[u'user']:
+                        tweets.extend(self.user_tweet_ids(author_id_str))
                 yield divisions[p], cohort, tweets
                 n = 0
                 cohort = Counter()
@@ -287,134 +1576,1446 @@ class Metrifier:
 
         # Sometimes we don't reach the last percentile, so we will combine them
         remaining = reduce(operator.add, divisions[p:])
-        tweets = []
-        for author_id_str in cohort[u'user']:
-            tweets.extend(self.user_tweet[author_id_str])
+        tweets = None
+        if include_tweets:
+            tweets = []
+            for author_id_str in cohort[u'user']:
+                tweets.extend(self.user_tweet_ids(author_id_str))
         yield remaining, cohort, tweets
 
+    def period_buckets(self, period):
+        """Return the PeriodMetrics of each period (see PERIODS), by
+            period_start(). Periods that were not given to the constructor
+            are counted again from the index, each time they are asked for.
+        """
+        if period in self.period:
+            return self.period[period]
+        if not period in PERIODS:
+            raise ValueError("Unknown period: {0}".format(period))
+        index = self.index
+        if index is None or self.streaming:
+            raise ValueError("This Metrifier did not keep totals by {0}, create it with "
+                             "periods=({1!r}, ...) or index=True.".format(period, period))
+        users = self.user
+        url_terms = index.url.term
+        batch_periods = defaultdict(list)
+        for row in xrange(len(index)):
+            record = self.record(row)
+            author_id_str = users.id_str[index.author[row]]
+            urls = [url_terms[i] for i in index.entities(row, index.url_end, index.url_id)]
+            batch_periods[period_start(period, record[u'epoch'])].append((record, author_id_str, urls))
+        buckets = {}
+        for key, tweets in batch_periods.iteritems():
+            buckets[key] = PeriodMetrics(self.sketch, self.sketch_precision)
+            buckets[key].add_many(tweets)
+        return buckets
+
+    def query(self, hashtag=None, url=None, domain=None, mention=None):
+        """Return a new Metrifier that has eaten only the tweets with all of
+            the given entities, found with the index (see subset())
+            hashtag: with or without the "#", in any case
+            url: an expanded URL
+            domain: a host name, e.g. u'example.com' (see url_domain())
+            mention: the username of a mentioned user, with or without the "@"
+        """
+        if self.index is None:
+            raise ValueError("This Metrifier does not index its tweets, create it with index=True.")
+        if hashtag is not None:
+            hashtag = hashtag.lstrip(u'#').lower()
+        if domain is not None:
+            domain = domain.lower()
+            if domain.startswith(u'www.'):
+                domain = domain[4:]
+        username = None
+        if mention is not None:
+            username = mention.lstrip(u'@').lower()
+            id_str = self.username.get(username)
+            mention = self.user.index[id_str] if id_str else -1
+        return self.subset(self.index.rows(hashtag, url, domain, mention, username))
+
+    def subset(self, rows):
+        """Return a new Metrifier that has eaten only the tweets at rows (see
+            record()), in order, as if it had been fed just those tweets.
+            They are counted again from the index rather than re-read, in
+            time proportional to the number of rows.
+        """
+        index = self.index
+        if index is None:
+            raise ValueError("This Metrifier does not index its tweets, create it with index=True.")
+        sub = Metrifier(periods=self.periods, columnar=self.columnar, sketch=self.sketch,
+                        sketch_precision=self.sketch_precision)
+        users = self.user
+        frequency = sub.frequency
+        counter = sub.user.counter
+        tweet_count = counter[u'tweet']
+        timebounds = sub.timebounds
+        url_terms = index.url.term
+        hashtag_terms = index.hashtag.term
+        interned = {}
+        batch_urls = []
+        batch_hashtags = []
+        batch_periods = defaultdict(list)
+
+        def intern_user(user):
+            """Return the index in sub of the user at index user here"""
+            i = interned.get(user)
+            if i is None:
+                username = users.username[user]
+                sub.username[username] = users.id_str[user]
+                i = interned[user] = sub.user.intern(users.id_str[user], username)
+            return i
+
+        try:
+            for row in rows:
+                record = dict(self.record(row))
+                id_str = record[u'id_str']
+                epoch = record[u'epoch']
+                frequency[u'tweet'] += 1
+                if epoch < timebounds[u'first']:
+                    timebounds[u'first'] = epoch
+                if epoch > timebounds[u'last']:
+                    timebounds[u'last'] = epoch
+
+                author_id_str = users.id_str[index.author[row]]
+                author = intern_user(index.author[row])
+                if not tweet_count[author]:
+                    frequency[u'author'] += 1
+                tweet_count[author] += 1
+                sub.user_tweet[author_id_str].append(len(sub.tweet) if sub.columnar else id_str)
+
+                mentioned = index.entities(row, index.mention_end, index.mention_user)
+                if mentioned:
+                    replies = index.entities(row, index.mention_end, index.mention_reply)
+                    frequency[u'is_mention'] += 1
+                    counter[u'is_mention'][author] += 1
+                    counter[u'outbound_mention'][author] += len(mentioned)
+                    for user, reply in itertools.izip(mentioned, replies):
+                        user = intern_user(user)
+                        counter[u'inbound_mention'][user] += 1
+                        if reply:
+                            frequency[u'is_reply'] += 1
+                            counter[u'outbound_replies'][author] += 1
+                            counter[u'inbound_replies'][user] += 1
+
+                retweeted = index.retweeted[row]
+                if retweeted >= 0:
+                    retweeted = intern_user(retweeted)
+                    frequency[u'is_retweet'] += 1
+                    counter[u'outbound_retweets'][author] += 1
+                    counter[u'inbound_retweets'][retweeted] += 1
+                    if record.get(u'is_edited_retweet'):
+                        frequency[u'is_edited_retweet'] += 1
+                        counter[u'outbound_edited_retweets'][author] += 1
+                        counter[u'inbound_edited_retweets'][retweeted] += 1
+                    else:
+                        frequency[u'is_unedited_retweet'] += 1
+                        counter[u'outbound_unedited_retweets'][author] += 1
+                        counter[u'inbound_unedited_retweets'][retweeted] += 1
+                else:
+                    frequency[u'is_original'] += 1
+                    counter[u'is_original'][author] += 1
+
+                urls = [url_terms[i] for i in index.entities(row, index.url_end, index.url_id)]
+                if urls:
+                    frequency[u'has_url'] += 1
+                    counter[u'tweets_with_url'][author] += 1
+                    counter[u'has_url'][author] += len(urls)
+                    batch_urls.extend(urls)
+
+                hashtags = [hashtag_terms[i] for i in index.entities(row, index.hashtag_end, index.hashtag_id)]
+                if hashtags:
+                    frequency[u'has_hashtag'] += 1
+                    counter[u'tweets_with_hashtag'][author] += 1
+                    counter[u'has_hashtag'][author] += len(hashtags)
+                    batch_hashtags.extend(hashtags)
+
+                for period in sub.periods:
+                    batch_periods[period, period_start(period, epoch)].append((record, author_id_str, urls))
+
+                if sub.columnar:
+                    sub.time_index.add(epoch, len(sub.tweet))
+                    sub.tweet.append(self.tweet.id[row], epoch, record)
+                else:
+                    if not id_str in sub.tweet:
+                        sub.time_index.add(epoch, len(sub.tweet_id))
+                    sub.tweet[id_str] = record
+                    sub.tweet_id.append(id_str)
+        finally:
+            if batch_urls:
+                sub.url.update(batch_urls)
+            if batch_hashtags:
+                sub.hashtag.update(batch_hashtags)
+            for (period, key), tweets in batch_periods.iteritems():
+                buckets = sub.period[period]
+                if not key in buckets:
+                    buckets[key] = PeriodMetrics(sub.sketch, sub.sketch_precision)
+                buckets[key].add_many(tweets)
+        return sub
+
     def eat(self, tweet):
+        """Eat one tweet. Returns False if it was skipped, because it has
+            no id or is a duplicate.
+        """
+        return self.eat_batch((tweet,)) == 1
 
-        # id_str is our unique key
-        if u'id_str' in tweet:
-            id_str = tweet[u'id_str']
-        elif u'id' in tweet:
-            id_str = tweet[u'id']
-        else:
-            return False
+    def eat_many(self, tweets, batch_size=1000):
+        """Eat an iterable of tweets, batch_size at a time (see eat_batch()).
+            Gives the same results as calling eat() on each tweet in turn.
+            Returns the number of tweets that were not skipped.
+        """
+        tweets = iter(tweets)
+        eaten = 0
+        while True:
+            batch = list(itertools.islice(tweets, batch_size))
+            if not batch:
+                return eaten
+            eaten += self.eat_batch(batch)
+
+    def eat_batch(self, batch):
+        """Eat an iterable of tweets in order.
+            Each distinct postedTime in the batch is parsed once, and the
+            URL and hashtag counts are updated once for the whole batch.
+            Tweets without an id are skipped. A tweet with a bad id or
+            postedTime raises ValueError before anything is counted for it,
+            leaving the tweets before it eaten, as eat() would.
+            Returns the number of tweets that were not skipped.
+        """
 
-        # Reject duplicates
-        # De-duping is too costly at scale
-        #if id_str in self.tweet_id:
-        #    return False
+        profiler = PROFILER
+        if profiler is not None:
+            began = time.time()
+            parsed = profiler.seconds[u'parse']
+
+        # The date and time of each tweet, parsed once per distinct string
+        times = {}
+        parse_time = parse_postedTime
+
+        frequency = self.frequency
+        users = self.user
+        username = self.username
+        counter = users.counter
+        intern_user = users.intern
+        # The counter columns of each user, by what they count
+        tweet_count = counter[u'tweet']
+        is_original = counter[u'is_original']
+        is_mention = counter[u'is_mention']
+        outbound_mention = counter[u'outbound_mention']
+        outbound_replies = counter[u'outbound_replies']
+        outbound_retweets = counter[u'outbound_retweets']
+        outbound_unedited_retweets = counter[u'outbound_unedited_retweets']
+        outbound_edited_retweets = counter[u'outbound_edited_retweets']
+        tweets_with_url = counter[u'tweets_with_url']
+        has_url = counter[u'has_url']
+        tweets_with_hashtag = counter[u'tweets_with_hashtag']
+        has_hashtag = counter[u'has_hashtag']
+        inbound_mention = counter[u'inbound_mention']
+        inbound_replies = counter[u'inbound_replies']
+        inbound_retweets = counter[u'inbound_retweets']
+        inbound_unedited_retweets = counter[u'inbound_unedited_retweets']
+        inbound_edited_retweets = counter[u'inbound_edited_retweets']
+        timebounds = self.timebounds
+        seen = self.seen
+        columnar = self.columnar
+        streaming = self.streaming
+        store = self.tweet
+        tweet_ids = self.tweet_id
+        time_index = self.time_index
+        user_tweet = self.user_tweet
+        index = self.index
+        user_index = users.index
+        periods = self.periods
+        scan_text = scan_body
+        parse_mentions = self.parse_mentions
+        parse_retweet = self.parse_retweet
+        parse_urls = self.parse_urls
+        parse_hashtags = self.parse_hashtags
+        if profiler is not None:
+            parse_time = profiler.timed(u'parse', parse_time)
+            scan_text = profiler.timed(u'parse', scan_text)
+            parse_mentions = profiler.timed(u'parse', parse_mentions)
+            parse_retweet = profiler.timed(u'parse', parse_retweet)
+            parse_urls = profiler.timed(u'parse', parse_urls)
+            parse_hashtags = profiler.timed(u'parse', parse_hashtags)
+        batch_urls = []
+        batch_hashtags = []
+        batch_periods = defaultdict(list)
+        eaten = 0
+
+        try:
+            for tweet in batch:
+
+                # id_str is our unique key
+                if u'id_str' in tweet:
+                    id_str = tweet[u'id_str']
+                elif u'id' in tweet:
+                    id_str = tweet[u'id']
+                else:
+                    continue
+
+                # Parse the id and the date and time that this tweet was
+                # sent now, so that a bad tweet is rejected before counting
+                if columnar or seen is not None:
+                    tweet_id = parse_tweet_id(id_str)
+                if u'postedTimeObj' in tweet:
+                    epoch = to_epoch(tweet[u'postedTimeObj'])
+                else:
+                    postedTime = tweet.get(u'postedTime')
+                    if postedTime is None:
+                        raise ValueError("Tweet {0} has no postedTime".format(id_str))
+                    epoch = times.get(postedTime)
+                    if epoch is None:
+                        epoch = times[postedTime] = parse_time(postedTime)
+
+                # Reject duplicates
+                if seen is not None:
+                    if tweet_id in seen:
+                        frequency[u'duplicate'] += 1
+                        continue
+                    seen.add(tweet_id)
+
+                # Add this tweet to the pile
+                record = {u'id_str': id_str}
+                if not columnar and not streaming:
+                    is_new = not id_str in store
+                    store[id_str] = record
+                    tweet_ids.append(id_str)
+                frequency[u'tweet'] += 1
+                eaten += 1
+                record[u'epoch'] = epoch
+
+                # Test the time bounds
+                if epoch < timebounds[u'first']:
+                    timebounds[u'first'] = epoch
+                if epoch > timebounds[u'last']:
+                    timebounds[u'last'] = epoch
+
+                # Increment tweet count for this author
+                actor = tweet.get(u'actor', {})
+                author_id_str = actor.get(u'id_str', '-1')
+                author_username = actor.get(u'preferredUsername', u'').lower()
+                username[author_username] = author_id_str
+                author = user_index.get(author_id_str)
+                if author is None:
+                    author = intern_user(author_id_str, author_username)
+                # Users first seen in a mention become authors with their first tweet
+                if not tweet_count[author]:
+                    frequency[u'author'] += 1
+                tweet_count[author] += 1
+                if columnar:
+                    user_tweet[author_id_str].append(len(store))
+                elif not streaming:
+                    user_tweet[author_id_str].append(id_str)
+
+                # Does the text include one or more @-mentions?
+                scan = scan_text(tweet.get(u'body', u''))
+                mentions = parse_mentions(tweet, scan)
+                if mentions:
+                    frequency[u'is_mention'] += 1
+                    record[u'is_mention'] = True
+                    is_mention[author] += 1
+                    for mention in mentions:
+                        # Placing the following line inside the loop means
+                        # that we are counting individual @s,
+                        # not just tweets containing >= 1 @s
+                        outbound_mention[author] += 1
+
+                        mention_id_str = mention[u'id_str']
+                        mention_screen_name = mention[u'screen_name'].lower()
+
+                        username[mention_screen_name] = mention[u'id_str']
+                        mentioned = user_index.get(mention_id_str)
+                        if mentioned is None:
+                            mentioned = intern_user(mention_id_str, mention_screen_name)
+                        inbound_mention[mentioned] += 1
+
+                        # Is it an @-reply (not visible to all followers)?
+                        # (aka, does this mention occur at position 0 in the body?)
+                        if mention[u'indices'][0] == 0:
+                            frequency[u'is_reply'] += 1
+                            record[u'is_reply'] = True
+                            outbound_replies[author] += 1
+                            inbound_replies[mentioned] += 1
+
+                # Is it a RT?
+                # (only shares and texts with a retweet marker can be one)
+                if scan[1] or tweet.get(u'verb', u'') == 'share':
+                    rt = parse_retweet(tweet, scan)
+                else:
+                    rt = {}
+                if rt:
+                    frequency[u'is_retweet'] += 1
+                    record[u'is_retweet'] = True
+                    outbound_retweets[author] += 1
+                    rt_retweeted_author_id_str = rt[u'retweeted_author_id_str']
+                    retweeted_author_username = rt[u'retweeted_author_username'].lower()
+                    username[retweeted_author_username] = rt[u'retweeted_author_id_str']
+                    retweeted = user_index.get(rt_retweeted_author_id_str)
+                    if retweeted is None:
+                        retweeted = intern_user(rt_retweeted_author_id_str, retweeted_author_username)
+                    inbound_retweets[retweeted] += 1
+                    # Is it an "edited" or "unedited" retweet?
+                    if rt[u'edited']:
+                        frequency[u'is_edited_retweet'] += 1
+                        record[u'is_edited_retweet'] = True
+                        outbound_edited_retweets[author] += 1
+                        inbound_edited_retweets[retweeted] += 1
+                    else:
+                        frequency[u'is_unedited_retweet'] += 1
+                        record[u'is_unedited_retweet'] = True
+                        outbound_unedited_retweets[author] += 1
+                        inbound_unedited_retweets[retweeted] += 1
+                else:
+                    frequency[u'is_original'] += 1
+                    record[u'is_original'] = True
+                    is_original[author] += 1
+
+                # URLs?
+                urls = parse_urls(tweet)
+                if urls:
+                    frequency[u'has_url'] += 1
+                    record[u'has_url'] = True
+                    tweets_with_url[author] += 1
+                    has_url[author] += len(urls)
+                    batch_urls.extend(urls)
+
+                # Hashtags?
+                hashtags = parse_hashtags(tweet)
+                if hashtags:
+                    frequency[u'has_hashtag'] += 1
+                    record[u'has_hashtag'] = True
+                    tweets_with_hashtag[author] += 1
+                    has_hashtag[author] += len(hashtags)
+                    batch_hashtags.extend(hashtags)
+
+                if index is not None:
+                    index.add(author,
+                              [(user_index[mention[u'id_str']], mention[u'indices'][0] == 0,
+                                None if mention[u'id_str'] else mention[u'screen_name'].lower())
+                               for mention in mentions],
+                              retweeted if rt else -1, urls, hashtags)
+
+                # Update the running totals for each period we are tracking
+                for period in periods:
+                    batch_periods[period, period_start(period, epoch)].append((record, author_id_str, urls))
+
+                # Index the tweet by the time it was sent
+                if streaming:
+                    pass
+                elif columnar:
+                    time_index.add(epoch, len(store))
+                    store.append(tweet_id, epoch, record)
+                elif is_new:
+                    time_index.add(epoch, len(tweet_ids) - 1)
+        finally:
+            if batch_urls:
+                self.url.update(batch_urls)
+            if batch_hashtags:
+                self.hashtag.update(batch_hashtags)
+            for (period, key), tweets in batch_periods.iteritems():
+                buckets = self.period[period]
+                if not key in buckets:
+                    buckets[key] = PeriodMetrics(self.sketch, self.sketch_precision)
+                buckets[key].add_many(tweets)
+
+        if profiler is not None:
+            parsed = profiler.seconds[u'parse'] - parsed
+            profiler.add(u'count', time.time() - began - parsed)
+            profiler.tweets += eaten
+            profiler.tick()
+        return eaten
+
+
+class LiveWindows:
+    """Running totals for the periods of an endless stream of tweets.
+        Each period is eaten by its own small streaming Metrifier, which
+        is dropped, with its users, as soon as the period closes. A period
+        closes once a tweet arrives that was posted lateness seconds or
+        more after the period ended. Tweets that arrive for a closed
+        period are counted as late and otherwise ignored.
+    """
 
-        # Add this tweet to the pile
-        self.tweet[id_str] = {u'id_str': id_str}
-        self.tweet_id.append(id_str)
-        self.frequency[u'tweet'] += 1
+    def __init__(self, period='minute', lateness=0, window=None, sketch=None, sketch_precision=12):
+        """period: the granularity (see PERIODS) of each window
+            lateness: seconds to wait for tweets that arrive out of order
+            window: if set, each closed period is reported together with
+                the periods that started less than window seconds before
+                it ended (sliding windows), rather than on its own
+            sketch, sketch_precision: see Metrifier
+        """
+        self.period = period
+        self.lateness = lateness
+        self.window = window
+        self.sketch = sketch
+        self.sketch_precision = sketch_precision
+        self.open = {}
+        self.recent = []
+        self.watermark = None
+        self.late = 0
 
-        # Evaluate the date and time that this tweet was sent
+    def eat(self, tweet):
+        """Eat a tweet and return the totals of any periods it closed, as a
+            list of PeriodMetrics in chronological order
+        """
         if u'postedTimeObj' in tweet:
-            postedTimeObj = tweet.get(u'postedTimeObj')
+            epoch = to_epoch(tweet[u'postedTimeObj'])
         else:
-            postedTimeObj = from_postedTime(tweet[u'postedTime'])
-        self.tweet[id_str][u'postedTimeObj'] = postedTimeObj
-
-        # Test the time bounds
-        if postedTimeObj < self.timebounds[u'first']:
-            self.timebounds[u'first'] = postedTimeObj
-        elif postedTimeObj > self.timebounds[u'last']:
-            self.timebounds[u'last'] = postedTimeObj
-
-        # Increment tweet count for this author
-        author_id_str = tweet.get(u'actor', {}).get(u'id_str', '-1')
-        author_username = tweet.get(u'actor', {}).get(u'preferredUsername', u'').lower()
-        self.username[author_username] = author_id_str
-        if not author_id_str in self.user:
-            self.user[author_id_str] = Counter()
-            self.user[author_id_str][u'id_str'] = author_id_str
-            self.user[author_id_str][u'username'] = author_username
-            self.frequency[u'author'] += 1
-        self.user[author_id_str][u'tweet'] += 1
-        self.user_tweet[author_id_str].append(id_str)
-
-        # Does the text include one or more @-mentions?
-        mentions = self.parse_mentions(tweet)
-        if mentions:
-            self.frequency[u'is_mention'] += 1
-            self.tweet[id_str][u'is_mention'] = True
-            for mention in mentions:
-                # Placing the following line inside the loop means
-                # that we are counting individual @s,
-                # not just tweets containing >= 1 @s
-                self.user[author_id_str][u'outbound_mention'] += 1
-
-                mention_id_str = mention[u'id_str']
-                mention_screen_name = mention[u'screen_name'].lower()
-
-                self.username[mention_screen_name] = mention[u'id_str']
-                if not mention_id_str in self.user:
-                    self.user[mention_id_str] = Counter()
-                    self.user[mention_id_str][u'id_str'] = mention_id_str
-                    self.user[mention_id_str][u'username'] = mention_screen_name
-                self.user[mention_id_str][u'inbound_mention'] += 1
-
-                # Is it an @-reply (not visible to all followers)?
-                # (aka, does this mention occur at position 0 in the body?)
-                if mention[u'indices'][0] == 0:
-                    self.frequency[u'is_reply'] += 1
-                    self.tweet[id_str][u'is_reply'] = True
-                    self.user[author_id_str][u'outbound_replies'] += 1
-                    self.user[mention[u'id_str']][u'inbound_replies'] += 1
-
-        # Is it a RT?
-        rt = self.parse_retweet(tweet)
-        if rt:
-            self.frequency[u'is_retweet'] += 1
-            self.tweet[id_str][u'is_retweet'] = True
-            self.user[author_id_str][u'outbound_retweets'] += 1
-            rt_retweeted_author_id_str = rt[u'retweeted_author_id_str']
-            retweeted_author_username = rt[u'retweeted_author_username'].lower()
-            self.username[retweeted_author_username] = rt[u'retweeted_author_id_str']
-            if not rt_retweeted_author_id_str in self.user:
-                self.user[rt_retweeted_author_id_str] = Counter()
-                self.user[rt_retweeted_author_id_str][u'id_str'] = rt_retweeted_author_id_str
-                self.user[rt_retweeted_author_id_str][u'username'] = retweeted_author_username
-            self.user[rt_retweeted_author_id_str][u'inbound_retweets'] += 1
-            # Is it an "edited" or "unedited" retweet?
-            if rt[u'edited']:
-                self.frequency[u'is_edited_retweet'] += 1
-                self.tweet[id_str][u'is_edited_retweet'] = True
-                self.user[author_id_str][u'outbound_edited_retweets'] += 1
-                self.user[rt_retweeted_author_id_str][u'inbound_edited_retweets'] += 1
-            else:
-                self.frequency[u'is_unedited_retweet'] += 1
-                self.tweet[id_str][u'is_unedited_retweet'] = True
-                self.user[author_id_str][u'outbound_unedited_retweets'] += 1
-                self.user[rt_retweeted_author_id_str][u'inbound_unedited_retweets'] += 1
+            epoch = parse_postedTime(tweet[u'postedTime'])
+        key = period_start(self.period, epoch)
+        if self.watermark is not None and period_end(self.period, key) <= self.watermark:
+            self.late += 1
+            return []
+        if not key in self.open:
+            self.open[key] = Metrifier(periods=(self.period,), streaming=True, sketch=self.sketch,
+                                       sketch_precision=self.sketch_precision)
+        self.open[key].eat(tweet)
+        if self.watermark is None or epoch - self.lateness > self.watermark:
+            self.watermark = epoch - self.lateness
+            return self.close(self.watermark)
+        return []
+
+    def close(self, watermark=None):
+        """Close every open period that ended by watermark (epoch seconds),
+            or every open period if watermark is None, and return their
+            totals as a list of PeriodMetrics in chronological order
+        """
+        closed = []
+        for start in sorted(self.open):
+            end = period_end(self.period, start)
+            if watermark is not None and end > watermark:
+                break
+            bucket = self.open.pop(start).period[self.period][start]
+            if self.window:
+                self.recent = [(s, b) for s, b in self.recent if s > end - self.window]
+                self.recent.append((start, bucket))
+                bucket = PeriodMetrics(self.sketch, self.sketch_precision)
+                for s, b in self.recent:
+                    bucket.merge(b)
+            closed.append(bucket)
+        return closed
+
+
+#
+# PROFILING
+#
+
+
+class Profiler:
+    """Cumulative seconds spent in each of the STAGES of a run, and the
+        number of tweets and bytes eaten, with a progress line every
+        interval seconds. Nothing is timed unless PROFILER is set to a
+        Profiler, e.g. pymetrify.PROFILER = Profiler(hook=record)
+        Stages: read (reading and decompressing lines), decode (JSON),
+        parse (mentions, retweets, URLs and hashtags), count (updating the
+        running totals), merge (the shards of eat_parallel()), group
+        (users by percentile) and report (writing the report). The stages
+        of eat_parallel() workers are summed over all of the workers.
+    """
+
+    def __init__(self, interval=PROGRESS_INTERVAL, out=sys.stderr, hook=None):
+        """interval: seconds between progress lines, None for no progress
+            out: file to write progress lines and the summary to, or None
+            hook: called with snapshot() at every progress line, and with
+                the final snapshot() (u'done' is True) at finish()
+        """
+        self.interval = interval
+        self.out = out
+        self.hook = hook
+        self.seconds = defaultdict(float)
+        self.tweets = 0
+        self.bytes = 0
+        self.began = time.time()
+        self.next_progress = self.began + (interval or 0)
+
+    def add(self, stage, seconds):
+        self.seconds[stage] += seconds
+
+    def timed(self, stage, function):
+        """Return function wrapped to add the time of every call to stage"""
+        seconds = self.seconds
+        clock = time.time
+
+        def timed_function(*args):
+            began = clock()
+            result = function(*args)
+            seconds[stage] += clock() - began
+            return result
+        return timed_function
+
+    def merge(self, snapshot):
+        """Add the totals of a snapshot(), e.g. from another process"""
+        for stage, seconds in snapshot[u'stages'].iteritems():
+            self.seconds[stage] += seconds
+        self.tweets += snapshot[u'tweets']
+        self.bytes += snapshot[u'bytes']
+
+    def snapshot(self):
+        """Return the totals so far as a dict"""
+        elapsed = max(time.time() - self.began, 1e-6)
+        return {
+            u'elapsed': elapsed,
+            u'tweets': self.tweets,
+            u'bytes': self.bytes,
+            u'tweets_per_second': self.tweets / elapsed,
+            u'bytes_per_second': self.bytes / elapsed,
+            u'stages': dict(self.seconds),
+            u'done': False
+        }
+
+    def tick(self):
+        """Report progress if interval seconds have passed since the last time"""
+        if self.interval and time.time() >= self.next_progress:
+            self.progress()
+
+    def progress(self):
+        snapshot = self.snapshot()
+        self.next_progress = time.time() + (self.interval or 0)
+        if self.out is not None:
+            self.out.write(u'{0:.0f}s: {1}\n'.format(snapshot[u'elapsed'], self.throughput(snapshot)))
+        if self.hook is not None:
+            self.hook(snapshot)
+
+    def throughput(self, snapshot):
+        text = u'{0} tweets ({1:.0f} tweets/s)'.format(snapshot[u'tweets'], snapshot[u'tweets_per_second'])
+        if snapshot[u'bytes']:
+            text += u', {0:.1f} MB ({1:.1f} MB/s)'.format(snapshot[u'bytes'] / 1e6, snapshot[u'bytes_per_second'] / 1e6)
+        return text
+
+    def finish(self):
+        """Write a summary of every stage and return the final snapshot()"""
+        snapshot = self.snapshot()
+        snapshot[u'done'] = True
+        if self.out is not None:
+            elapsed = snapshot[u'elapsed']
+            stages = [stage for stage in STAGES if stage in self.seconds]
+            stages += sorted(stage for stage in self.seconds if not stage in STAGES)
+            self.out.write(u'{0:.1f}s: {1}\n'.format(elapsed, self.throughput(snapshot)))
+            for stage in stages:
+                self.out.write(u'{0:>8}: {1:8.2f}s {2:6.1%}\n'.format(stage, self.seconds[stage], self.seconds[stage] / elapsed))
+        if self.hook is not None:
+            self.hook(snapshot)
+        return snapshot
+
+
+def finish_profile(profiler, path=None):
+    """Write the summary of profiler, and its totals as JSON to path
+        if given
+    """
+    profile = profiler.finish()
+    if path:
+        with open(path, 'w') as f:
+            json.dump(profile, f, indent=2, sort_keys=True)
+
+
+#
+# INPUT functions
+#
+
+
+def is_input(path, inputs):
+    """Return True if path is the same file as one of the paths in inputs,
+        so that writing to it would destroy the input
+    """
+    if not os.path.exists(path):
+        return False
+    for other in inputs:
+        if other != '-' and os.path.exists(other) and os.path.samefile(path, other):
+            return True
+    return False
+
+
+def sniff_compression(head):
+    """Return the compression format (see COMPRESSION_MAGIC) of data that
+        starts with head, or None if it does not look compressed
+    """
+    for codec, magic in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def compression(path):
+    """Return the compression format of the file at path, or None"""
+    with open(path, 'rb') as f:
+        return sniff_compression(f.read(6))
+
+
+def decompressor(codec):
+    """Return a new incremental decompressor, with a decompress() method,
+        for a compression format
+    """
+    if codec == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if codec == 'bz2':
+        return bz2.BZ2Decompressor()
+    if codec == 'xz':
+        if lzma is None:
+            raise ValueError("Reading xz requires the lzma module (backports.lzma on Python 2).")
+        return lzma.LZMADecompressor()
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError("Reading zstd requires the zstandard module.")
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError("Unknown compression format: {0}".format(codec))
+
+
+def decompress_chunks(chunks, codec):
+    """Decompress an iterable of compressed chunks. Files made of several
+        concatenated streams, e.g. by cat a.gz b.gz, are read to the end.
+    """
+    d = decompressor(codec)
+    for data in chunks:
+        while data:
+            try:
+                out = d.decompress(data)
+            except EOFError:
+                # The last stream ended with the previous chunk
+                d = decompressor(codec)
+                continue
+            if out:
+                yield out
+            data = getattr(d, 'unused_data', b'')
+            if data:
+                d = decompressor(codec)
+
+
+def read_ahead(chunks, queue_size=8):
+    """Produce an iterable of chunks on a background thread, keeping up to
+        queue_size of them ready
+    """
+    queue = Queue.Queue(queue_size)
+
+    def produce():
+        try:
+            for chunk in chunks:
+                queue.put(chunk)
+            queue.put(None)
+        except Exception as e:
+            queue.put(e)
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    while True:
+        chunk = queue.get()
+        if chunk is None:
+            return
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+
+def iter_lines(chunks):
+    """Yield the lines in an iterable of chunks of bytes"""
+    rest = b''
+    for chunk in chunks:
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    if rest:
+        yield rest
+
+
+def read_lines(path, chunk_size=1 << 20):
+    """Yield the lines of a file, or of stdin if path is '-'. Input that
+        is compressed (see COMPRESSION_MAGIC) is decompressed on a
+        background thread, chunk_size bytes at a time. An uncompressed
+        regular file is memory-mapped instead, while other files, such as
+        pipes, are read a chunk at a time.
+        Reads return as soon as any input is available, so lines from a
+        pipe are not held back to fill a chunk.
+    """
+    if path == '-':
+        f = sys.stdin
+    else:
+        f = open(path, 'rb')
+    try:
+        fd = f.fileno()
+        head = b''
+        while len(head) < 6:
+            data = os.read(fd, chunk_size)
+            if not data:
+                break
+            head += data
+        codec = sniff_compression(head)
+        if codec is None and f is not sys.stdin and head and stat.S_ISREG(os.fstat(fd).st_mode):
+            m = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            try:
+                for line in iter(m.readline, b''):
+                    yield line
+            finally:
+                m.close()
+            return
+        chunks = itertools.chain([head], iter(lambda: os.read(fd, chunk_size), b''))
+        if codec is not None:
+            chunks = decompress_chunks(chunks, codec)
+        for line in iter_lines(read_ahead(chunks)):
+            yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def split_lines(path, n):
+    """Split the file at path into n (start, end) byte ranges that begin
+        and end on line boundaries. Ranges may be empty.
+    """
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, n):
+            position = size * i // n
+            if position <= offsets[-1]:
+                offsets.append(offsets[-1])
+                continue
+            # Finish the line that position falls in
+            f.seek(position - 1)
+            f.readline()
+            offsets.append(min(f.tell(), size))
+    offsets.append(size)
+    return zip(offsets[:-1], offsets[1:])
+
+
+def eat_file(metrifier, path, start=None, end=None):
+    """Eat the tweets in a file (see read_lines()), or in the byte range
+        from start to end of an uncompressed file, and report the
+        throughput with debug(). If PROFILER is set, reading and decoding
+        are timed too.
+    """
+    began = time.time()
+    tweets = metrifier.frequency[u'tweet']
+    size = [0]
+
+    def lines():
+        if start is None:
+            for line in read_lines(path):
+                size[0] += len(line)
+                yield line
+            return
+        with open(path, 'rb') as f:
+            f.seek(start)
+            while size[0] < end - start:
+                line = f.readline()
+                if not line:
+                    break
+                size[0] += len(line)
+                yield line
+
+    profiler = PROFILER
+    if profiler is None:
+        metrifier.eat_many(json.loads(line) for line in lines())
+    else:
+        read = lines()
+        counted = 0
+        while True:
+            reading = time.time()
+            batch = list(itertools.islice(read, 1000))
+            decoding = time.time()
+            batch = [json.loads(line) for line in batch]
+            profiler.add(u'read', decoding - reading)
+            profiler.add(u'decode', time.time() - decoding)
+            profiler.bytes += size[0] - counted
+            counted = size[0]
+            if not batch:
+                break
+            metrifier.eat_batch(batch)
+    size = size[0]
+    if VERBOSE:
+        seconds = max(time.time() - began, 1e-6)
+        tweets = metrifier.frequency[u'tweet'] - tweets
+        label = path if start is None else u'{0} [{1}:{2}]'.format(path, start, end)
+        debug(u'{0}: {1} tweets, {2:.1f} MB in {3:.1f}s ({4:.0f} tweets/s, {5:.1f} MB/s)\n'.format(
+            label, tweets, size / 1e6, seconds, tweets / seconds, size / 1e6 / seconds))
+    return metrifier
+
+
+def eat_lines(task):
+    """Eat the tweets in one file, or one byte range of a file, into a
+        new shard. Returns (shard, profile) where profile is the
+        Profiler.snapshot() of the task, or None if PROFILER is not set.
+        task: (path, start, end, options) where options are keyword
+            arguments for Metrifier(), and start and end are None to eat
+            the whole file
+    """
+    global PROFILER
+    path, start, end, options = task
+    if PROFILER is not None:
+        PROFILER = Profiler(interval=None, out=None)
+    shard = eat_file(Metrifier(shard=True, **options), path, start, end)
+    return shard, PROFILER and PROFILER.snapshot()
+
+
+def eat_parallel(paths, jobs=None, metrifier=None, **options):
+    """Eat one or more files of Activity Streams objects, one per line,
+        using several processes. Each file is eaten into a shard, and the
+        shards are merged in order, which gives the same results as eating
+        the files one after another. If there are more jobs than files,
+        uncompressed files are also split into byte ranges that are eaten
+        separately.
+        paths: a path, or a sequence of paths
+        jobs: number of worker processes (defaults to the number of CPUs)
+        metrifier: a Metrifier to merge the shards into, e.g. one loaded
+            from a state file (by default, a new one)
+        options: keyword arguments for Metrifier()
+    """
+    if isinstance(paths, basestring):
+        paths = [paths]
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+    ranges = max(1, jobs // len(paths))
+    tasks = []
+    for path in paths:
+        # Only regular files can be split, and sniffing a pipe would use it up
+        if ranges > 1 and os.path.isfile(path) and not compression(path):
+            tasks.extend((path, start, end, options) for start, end in split_lines(path, ranges))
         else:
-            self.frequency[u'is_original'] += 1
-            self.tweet[id_str][u'is_original'] = True
-            self.user[author_id_str][u'is_original'] += 1
-
-        # URLs?
-        urls = self.parse_urls(tweet)
-        if urls:
-            self.frequency[u'has_url'] += 1
-            self.tweet[id_str][u'has_url'] = True
-            for url in urls:
-                self.user[author_id_str][u'has_url'] += 1
-                self.url[url] += 1
-
-        # Hashtags?
-        hashtags = self.parse_hashtags(tweet)
-        if hashtags:
-            self.frequency[u'has_hashtag'] += 1
-            self.tweet[id_str][u'has_hashtag'] = True
-            for hashtag in hashtags:
-                self.user[author_id_str][u'has_hashtag'] += 1
-                self.hashtag[hashtag] += 1
+            tasks.append((path, None, None, options))
+    if metrifier is None:
+        metrifier = Metrifier(**options)
+    profiler = PROFILER
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for shard, profile in pool.imap(eat_lines, tasks):
+            merging = time.time()
+            metrifier += shard
+            debug(u'Merged {0} tweets\n'.format(metrifier.frequency[u'tweet']))
+            if profiler is not None:
+                profiler.add(u'merge', time.time() - merging)
+                profiler.merge(profile)
+                profiler.tick()
+    finally:
+        pool.close()
+        pool.join()
+    return metrifier
+
+
+def parse_address(address):
+    """Return a socket address for a string
+        e.g., u'localhost:5000' returns ('localhost', 5000), anything
+        without a port, e.g. u'/tmp/pymetrify.sock', is a Unix socket path
+    """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return host, int(port)
+    return address
+
+
+class IngestConnection(asyncore.dispatcher):
+    """A producer sending Activity Streams objects, one per line, to an
+        IngestServer. The connection is not read while queue_size or more
+        of its lines are waiting in the server's queue, so a producer that
+        sends too fast is held back by its socket buffers without holding
+        back the others.
+    """
 
-        return True
+    def __init__(self, server, sock):
+        asyncore.dispatcher.__init__(self, sock, map=server.map)
+        self.server = server
+        self.buffer = b''
+        # Lines of this connection that are in the server's queue
+        self.pending = 0
+
+    def readable(self):
+        return self.pending < self.server.queue_size
+
+    def writable(self):
+        return False
+
+    def queue(self, lines):
+        if lines:
+            self.pending += len(lines)
+            self.server.queue.append((self, lines))
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if data:
+            lines = (self.buffer + data).split(b'\n')
+            self.buffer = lines.pop()
+            self.queue([line for line in lines if line.strip()])
+
+    def handle_close(self):
+        if self.buffer.strip():
+            self.queue([self.buffer])
+        self.buffer = b''
+        self.close()
+
+
+class IngestListener(asyncore.dispatcher):
+    """Accepts producers on a TCP (host, port) or Unix socket path"""
+
+    def __init__(self, server, address):
+        asyncore.dispatcher.__init__(self, map=server.map)
+        self.server = server
+        if isinstance(address, tuple):
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+        else:
+            if os.path.exists(address):
+                os.unlink(address)
+            self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.bind(address)
+        self.listen(128)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            IngestConnection(self.server, pair[0])
+
+
+class IngestServer:
+    """Feeds one Metrifier with the tweets of many producers at once.
+        Producers connect over TCP or Unix sockets and send Activity
+        Streams objects, one per line. Lines wait in a queue, and each
+        connection is not read while about queue_size of its lines are
+        waiting. dump() reports what has been eaten so far without stopping.
+    """
+
+    def __init__(self, metrifier, addresses, queue_size=10000, **report_options):
+        """addresses: sockets to listen on, see parse_address()
+            report_options: keyword arguments for report() when dumping
+        """
+        self.metrifier = metrifier
+        self.queue_size = queue_size
+        self.report_options = report_options
+        self.queue = deque()
+        self.map = {}
+        self.errors = 0
+        self.stopped = False
+        self.dump_requested = False
+        self.listeners = [IngestListener(self, address) for address in addresses]
+
+    def address(self, i=0):
+        """Return the address that listener i is bound to, e.g. to find
+            the port chosen for ('localhost', 0)
+        """
+        return self.listeners[i].socket.getsockname()
+
+    def poll(self, timeout=0.1):
+        """Accept and read from producers once, then eat every queued tweet.
+            Lines that are not JSON objects, or that eat_batch() cannot eat,
+            are counted in errors and skipped.
+        """
+        asyncore.loop(timeout, map=self.map, count=1)
+        queue = self.queue
+        tweets = []
+        while queue:
+            connection, lines = queue.popleft()
+            connection.pending -= len(lines)
+            for line in lines:
+                try:
+                    tweet = json.loads(line)
+                except ValueError:
+                    tweet = None
+                if isinstance(tweet, dict):
+                    tweets.append(tweet)
+                else:
+                    self.errors += 1
+                    debug(u'Skipped a line that is not a JSON object: {0!r}\n'.format(line[:80]))
+
+        # eat_batch() leaves the tweets before a bad one eaten, so after an
+        # error carry on from the tweet that follows it
+        position = [0]
+
+        def following():
+            while position[0] < len(tweets):
+                position[0] += 1
+                yield tweets[position[0] - 1]
+
+        while position[0] < len(tweets):
+            try:
+                self.metrifier.eat_batch(following())
+            except (ValueError, KeyError, TypeError, AttributeError, IndexError) as e:
+                self.errors += 1
+                debug(u'Skipped a tweet that could not be eaten: {0!r}\n'.format(e))
+        if self.dump_requested:
+            self.dump_requested = False
+            self.dump()
+
+    def dump(self):
+        if self.metrifier.frequency[u'tweet']:
+            report(self.metrifier, **self.report_options)
+
+    def request_dump(self, *args):
+        """Dump at the end of the next poll(), safe to use as a signal handler"""
+        self.dump_requested = True
+
+    def stop(self, *args):
+        """Stop serve_forever(), safe to use as a signal handler"""
+        self.stopped = True
+
+    def serve_forever(self, timeout=0.1):
+        while not self.stopped:
+            self.poll(timeout)
+
+    def close(self):
+        """Close every connection and eat what is left in the queue"""
+        for dispatcher in self.map.values():
+            dispatcher.handle_close()
+        self.poll(0)
+
+
+#
+# STATE functions
+#
+
+STATE_MAGIC = b'PYMETRIF'
+STATE_VERSION = 4
+
+
+class StateWriter:
+    """Builds a state file: a JSON header followed by the raw contents of
+        named arrays, each aligned to 8 bytes so it can be read straight
+        from a memory map.
+    """
+
+    def __init__(self):
+        self.header = {}
+        self.arrays = []
+
+    def array(self, name, values, typecode=INT64):
+        if not isinstance(values, array):
+            values = array(typecode, values)
+        self.arrays.append((name, values))
+
+    def strings(self, name, strings):
+        """Store a sequence of strings as their UTF-8 lengths and bytes"""
+        encoded = [s.encode('utf-8') for s in strings]
+        self.array(name + u'.length', (len(s) for s in encoded))
+        self.array(name, array('B', b''.join(encoded)))
+
+    def write(self, path):
+        contents = {}
+        offset = 0
+        for name, values in self.arrays:
+            size = len(values) * values.itemsize
+            contents[name] = (values.typecode, offset, len(values))
+            offset += (size + 7) // 8 * 8
+        header = dict(self.header,
+                      byteorder=sys.byteorder,
+                      arrays=contents)
+        header = json.dumps(header).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(STATE_MAGIC)
+            f.write(struct.pack('<IQ', STATE_VERSION, len(header)))
+            f.write(header)
+            f.write(b'\x00' * (-f.tell() % 8))
+            for name, values in self.arrays:
+                values.tofile(f)
+                f.write(b'\x00' * (-len(values) * values.itemsize % 8))
+
+
+class StateReader:
+    """Reads the header and arrays of a state file written by StateWriter,
+        from a read-only memory map of the file. array() copies an array
+        out, for one that will be changed; view() reads one in place.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(STATE_MAGIC)] != STATE_MAGIC:
+            raise ValueError("Not a PyMetrify state file: {0}".format(path))
+        position = len(STATE_MAGIC)
+        version, length = struct.unpack('<IQ', self.map[position:position + 12])
+        if version != STATE_VERSION:
+            raise ValueError("Unsupported state file version: {0}".format(version))
+        position += 12
+        self.header = json.loads(self.map[position:position + length].decode('utf-8'))
+        position += length
+        self.start = position + (-position % 8)
+        self.swap = self.header[u'byteorder'] != sys.byteorder
+
+    def close(self):
+        self.map.close()
+
+    def array(self, name, start=0, stop=None):
+        """Return a copy of the array called name, or of its items from
+            start to stop, that can be changed
+        """
+        typecode, offset, length = self.header[u'arrays'][name]
+        if stop is None:
+            stop = length
+        values = array(str(typecode))
+        first = self.start + offset + start * values.itemsize
+        values.fromstring(self.map[first:first + (stop - start) * values.itemsize])
+        if self.swap:
+            values.byteswap()
+        return values
+
+    def view(self, name):
+        """Return the array called name without copying it, as a read-only
+            numpy array over the memory map that is only valid until
+            close(). Without numpy, or if the file has the other byte
+            order, return a copy as array() does. Iterating over a numpy
+            array is slow, so this is for arrays that are read whole.
+        """
+        typecode, offset, length = self.header[u'arrays'][name]
+        if numpy is None or self.swap or not length:
+            return self.array(name)
+        return numpy.frombuffer(self.map, numpy.dtype(str(typecode)), length, self.start + offset)
+
+    def strings(self, name):
+        lengths = self.array(name + u'.length')
+        typecode, offset, length = self.header[u'arrays'][name]
+        position = self.start + offset
+        strings = []
+        for length in lengths:
+            strings.append(self.map[position:position + length].decode('utf-8'))
+            position += length
+        return strings
+
+
+def save_counter(writer, name, counter):
+    """Store a Counter or a SpaceSaving table of strings"""
+    if isinstance(counter, SpaceSaving):
+        items = counter.count.keys()
+        writer.strings(name, items)
+        writer.array(name + u'.count', (counter.count[item] for item in items))
+        writer.array(name + u'.error', (counter.error[item] for item in items))
+        save_registers(writer, name + u'.distinct', [counter.distinct])
+    else:
+        items = counter.keys()
+        writer.strings(name, items)
+        writer.array(name + u'.count', (counter[item] for item in items))
+
+
+def load_counter(reader, name, counter):
+    """Fill an empty Counter or SpaceSaving table stored by save_counter()"""
+    items = reader.strings(name)
+    counts = reader.array(name + u'.count')
+    if isinstance(counter, SpaceSaving):
+        errors = reader.array(name + u'.error')
+        for item, n, error in itertools.izip(items, counts, errors):
+            counter.count[item] = n
+            counter.error[item] = error
+            counter.bucket.setdefault(n, set()).add(item)
+        counter.minimum = min(counter.bucket) if counter.bucket else 0
+        load_registers(reader, name + u'.distinct', [counter.distinct])
+    else:
+        counter.update(dict(itertools.izip(items, counts)))
+
+
+def save_registers(writer, name, sketches):
+    """Store the registers that are set in each of a list of HyperLogLogs"""
+    registers = [sketch.iterregisters() for sketch in sketches]
+    writer.array(name + u'.count', (len(pairs) for pairs in registers))
+    writer.array(name + u'.index', (index for pairs in registers for index, rank in pairs))
+    writer.array(name + u'.rank', (rank for pairs in registers for index, rank in pairs), 'B')
+
+
+def load_registers(reader, name, sketches):
+    """Fill a list of empty HyperLogLogs stored by save_registers()"""
+    counts = reader.array(name + u'.count')
+    pairs = itertools.izip(reader.array(name + u'.index'), reader.array(name + u'.rank'))
+    for sketch, count in itertools.izip(sketches, counts):
+        for index, rank in itertools.islice(pairs, count):
+            sketch.set(index, rank)
+
+
+def save_index(writer, name, index):
+    """Store an EntityIndex"""
+    for key in ENTITY_INDEX_ARRAYS:
+        writer.array(name + u'.' + key, getattr(index, key))
+    for key in (u'hashtag', u'url', u'domain', u'mention', u'unresolved'):
+        postings = getattr(index, key)
+        if key == u'mention':
+            writer.array(name + u'.mention', postings.term)
+        else:
+            writer.strings(name + u'.' + key, postings.term)
+        writer.array(name + u'.' + key + u'.count', (len(rows) for rows in postings.rows))
+        writer.array(name + u'.' + key + u'.rows', (row for rows in postings.rows for row in rows))
+
+
+def load_index(reader, name, index):
+    """Fill an empty EntityIndex stored by save_index()"""
+    for key in ENTITY_INDEX_ARRAYS:
+        setattr(index, key, reader.array(name + u'.' + key))
+    for key in (u'hashtag', u'url', u'domain', u'mention', u'unresolved'):
+        postings = getattr(index, key)
+        if key == u'mention':
+            terms = reader.array(name + u'.mention')
+        else:
+            terms = reader.strings(name + u'.' + key)
+        counts = reader.array(name + u'.' + key + u'.count')
+        start = 0
+        for term, count in itertools.izip(terms, counts):
+            postings.intern(term)
+            postings.rows[-1] = reader.array(name + u'.' + key + u'.rows', start, start + count)
+            start += count
+
+
+def save_state(metrifier, path):
+    """Write a Metrifier to a compact, versioned binary state file at path.
+        The file is written beside path and then moved over it, so a
+        failed save leaves the previous state intact.
+    """
+    m = metrifier
+    writer = StateWriter()
+    header = writer.header
+    header[u'options'] = {
+        u'periods': m.periods,
+        u'columnar': m.columnar,
+        u'shard': m.shard,
+        u'streaming': m.streaming,
+        u'dedup': m.dedup,
+        u'sketch': m.sketch,
+        u'sketch_precision': m.sketch_precision
+    }
+    header[u'timebounds'] = [m.timebounds[u'first'], m.timebounds[u'last']]
+    header[u'frequency'] = m.frequency
+
+    users = m.user
+    writer.strings(u'user.id_str', users.id_str)
+    writer.strings(u'user.username', users.username)
+    for key in USER_COUNTERS:
+        writer.array(u'user.' + key, users.column(key))
+    writer.strings(u'username', m.username.keys())
+    writer.strings(u'username.id_str', m.username.values())
+
+    save_counter(writer, u'url', m.url)
+    save_counter(writer, u'hashtag', m.hashtag)
+
+    if m.dedup == 'exact':
+        writer.array(u'seen', m.seen)
+    elif m.dedup == 'bloom':
+        header[u'bloom'] = [m.seen.capacity, m.seen.error_rate]
+        writer.array(u'seen', m.seen.bits, 'B')
+
+    if not m.streaming:
+        if m.columnar:
+            writer.array(u'tweet.id', m.tweet.id)
+            writer.strings(u'tweet.prefix', m.tweet.prefix)
+            writer.array(u'tweet.prefix_id', m.tweet.prefix_id)
+            writer.array(u'tweet.time', m.tweet.time)
+            writer.array(u'tweet.flags', m.tweet.flags)
+        else:
+            records = [m.tweet[id_str] for id_str in m.tweet_id]
+            writer.strings(u'tweet.id_str', m.tweet_id)
+            writer.array(u'tweet.time', (r[u'epoch'] for r in records))
+            writer.array(u'tweet.flags', (pack_flags(r) for r in records), 'B')
+        header[u'time_index.is_sorted'] = m.time_index.is_sorted
+        writer.array(u'time_index.time', m.time_index.time)
+        writer.array(u'time_index.row', m.time_index.row)
+        authors = []
+        tweets = []
+        for author_id_str, author_tweets in m.user_tweet.iteritems():
+            authors.extend(itertools.repeat(users.index[author_id_str], len(author_tweets)))
+            tweets.extend(author_tweets)
+        writer.array(u'user_tweet.author', authors)
+        if m.columnar:
+            writer.array(u'user_tweet.row', tweets)
+        else:
+            writer.strings(u'user_tweet.id_str', tweets)
+        if m.index is not None:
+            header[u'options'][u'index'] = True
+            save_index(writer, u'index', m.index)
+
+    for period in m.periods:
+        name = u'period.' + period
+        keys = sorted(m.period[period])
+        buckets = [m.period[period][key] for key in keys]
+        writer.array(name, keys)
+        writer.array(name + u'.first', (b.timebounds[u'first'] for b in buckets))
+        writer.array(name + u'.last', (b.timebounds[u'last'] for b in buckets))
+        for key in PERIOD_COUNTERS:
+            writer.array(name + u'.' + key, (b.frequency[key] for b in buckets))
+        writer.array(name + u'.author.user', (users.index[a] for b in buckets for a in b.author))
+        if m.sketch:
+            save_registers(writer, name + u'.url', [b.url for b in buckets])
+        else:
+            writer.array(name + u'.url.count', (len(b.url) for b in buckets))
+            writer.strings(name + u'.url', (url for b in buckets for url in b.url))
+
+    temporary = path + '.tmp'
+    writer.write(temporary)
+    os.rename(temporary, path)
+
+
+def load_state(path):
+    """Return the Metrifier saved in the state file at path by save_state()"""
+    reader = StateReader(path)
+    try:
+        header = reader.header
+        options = dict((str(k), v) for k, v in header[u'options'].iteritems())
+        if u'bloom' in header:
+            options['capacity'], options['error_rate'] = header[u'bloom']
+        m = Metrifier(**options)
+        m.timebounds[u'first'], m.timebounds[u'last'] = header[u'timebounds']
+        m.frequency.update(header[u'frequency'])
+
+        users = m.user
+        for id_str, username in itertools.izip(reader.strings(u'user.id_str'),
+                                               reader.strings(u'user.username')):
+            users.intern(id_str, username)
+        for key in USER_COUNTERS:
+            users.counter[key] = reader.array(u'user.' + key)
+        users.columns = users.counter.values()
+        m.username = dict(itertools.izip(reader.strings(u'username'),
+                                         reader.strings(u'username.id_str')))
+
+        load_counter(reader, u'url', m.url)
+        load_counter(reader, u'hashtag', m.hashtag)
+
+        if m.dedup == 'exact':
+            m.seen.update(reader.array(u'seen'))
+        elif m.dedup == 'bloom':
+            m.seen.bits = bytearray(reader.view(u'seen'))
+
+        if not m.streaming:
+            if m.columnar:
+                m.tweet.id = reader.array(u'tweet.id')
+                for prefix in reader.strings(u'tweet.prefix'):
+                    m.tweet.intern_prefix(prefix)
+                m.tweet.prefix_id = reader.array(u'tweet.prefix_id')
+                m.tweet.time = reader.array(u'tweet.time')
+                m.tweet.flags = reader.array(u'tweet.flags')
+            else:
+                m.tweet_id = reader.strings(u'tweet.id_str')
+                times = reader.array(u'tweet.time')
+                flags = reader.array(u'tweet.flags')
+                for id_str, epoch, bits in itertools.izip(m.tweet_id, times, flags):
+                    record = {u'id_str': id_str, u'epoch': epoch}
+                    m.tweet[id_str] = unpack_flags(bits, record)
+            m.time_index.time = reader.array(u'time_index.time')
+            m.time_index.row = reader.array(u'time_index.row')
+            m.time_index.is_sorted = header[u'time_index.is_sorted']
+            authors = reader.array(u'user_tweet.author')
+            if m.columnar:
+                tweets = reader.array(u'user_tweet.row')
+            else:
+                tweets = reader.strings(u'user_tweet.id_str')
+            for author, tweet in itertools.izip(authors, tweets):
+                m.user_tweet[users.id_str[author]].append(tweet)
+            if m.index is not None:
+                load_index(reader, u'index', m.index)
+
+        for period in m.periods:
+            name = u'period.' + period
+            keys = reader.array(name)
+            firsts = reader.array(name + u'.first')
+            lasts = reader.array(name + u'.last')
+            counters = [(key, reader.array(name + u'.' + key)) for key in PERIOD_COUNTERS]
+            authors = iter(reader.array(name + u'.author.user'))
+            if not m.sketch:
+                url_counts = reader.array(name + u'.url.count')
+                urls = iter(reader.strings(name + u'.url'))
+            buckets = m.period[period]
+            for i, key in enumerate(keys):
+                bucket = PeriodMetrics(m.sketch, m.sketch_precision)
+                bucket.timebounds[u'first'] = firsts[i]
+                bucket.timebounds[u'last'] = lasts[i]
+                for counter, column in counters:
+                    if column[i]:
+                        bucket.frequency[counter] = column[i]
+                bucket.author.update(users.id_str[a] for a in itertools.islice(authors, bucket.frequency[u'author']))
+                if not m.sketch:
+                    bucket.url.update(itertools.islice(urls, url_counts[i]))
+                buckets[key] = bucket
+            if m.sketch:
+                load_registers(reader, name + u'.url', [buckets[key].url for key in keys])
+    finally:
+        reader.close()
+    return m
 
 
 #
@@ -422,34 +3023,361 @@ class Metrifier:
 #
 
 
-def report(metrifier, period='hour', percentiles=(100,), includeusers=False, separator=SEPARATOR):
-    """ Produce output in the style of metrify.awk by Mapping Online Publics
-        metrifier: Metrifier() object that has already ingested tweets
-        period: a time period with which to group tweets
-        percentiles: a sequence of percentiles used to group users by activity (1, 9, 90)
-        includeusers: option to skipping calculating per-user stats
-        separator: field separator character
+class ReportTable:
+    """One table of a report as named, typed columns, see build_report().
+        Each column is an array (see COLUMN_TYPECODES) or, for text, a list.
+        table[u'tweets'] returns a column, rows() the rows as tuples.
+    """
+
+    def __init__(self, name, columns, kinds, rows=()):
+        """name: u'period', u'percentile' or u'user'
+            columns: the names of the columns
+            kinds: the kind of each column, one of COLUMN_TYPECODES
+            rows: sequences of values, one per column
+        """
+        if len(columns) != len(kinds):
+            raise ValueError("Table {0} has {1} columns but {2} kinds.".format(name, len(columns), len(kinds)))
+        self.name = name
+        self.columns = list(columns)
+        self.kinds = list(kinds)
+        self.data = [[] if COLUMN_TYPECODES[kind] is None else array(COLUMN_TYPECODES[kind])
+                     for kind in self.kinds]
+        self.extend(rows)
+
+    def __len__(self):
+        return len(self.data[0]) if self.data else 0
+
+    def __getitem__(self, column):
+        return self.data[self.columns.index(column)]
+
+    def extend(self, rows):
+        """Append rows, transposed into the columns"""
+        rows = list(rows)
+        if not rows:
+            return
+        lengths = set(map(len, rows))
+        if lengths != set([len(self.columns)]):
+            raise ValueError("Table {0} has {1} columns but rows have {2}.".format(
+                             self.name, len(self.columns), u', '.join(str(length) for length in sorted(lengths))))
+        for values, column in itertools.izip(self.data, itertools.izip(*rows)):
+            values.extend(column)
+
+    def extend_columns(self, columns):
+        """Append whole columns, one sequence of values per column"""
+        if len(columns) != len(self.columns) or len(set(map(len, columns))) > 1:
+            raise ValueError("Table {0} needs {1} columns of the same length.".format(self.name, len(self.columns)))
+        for values, column in itertools.izip(self.data, columns):
+            values.extend(column)
+
+    def column_values(self, i):
+        """Return column i as Python values, as they were before typing"""
+        values = self.data[i]
+        if self.kinds[i] == u'ratio':
+            return [int(value) if value == 0 or value == -1 else value for value in values]
+        return values
+
+    def rows(self):
+        return itertools.izip(*[self.column_values(i) for i in xrange(len(self.data))])
+
+    def to_numpy(self):
+        """Return the columns as a list of numpy arrays that share the
+            memory of the numeric columns, text columns are object arrays
+        """
+        if numpy is None:
+            raise ValueError("Converting a report table to numpy requires the numpy module.")
+        columns = []
+        for kind, values in itertools.izip(self.kinds, self.data):
+            if COLUMN_TYPECODES[kind] is None:
+                columns.append(numpy.array(values, dtype=object))
+            else:
+                columns.append(as_numpy(values))
+        return columns
 
+    def to_pandas(self):
+        """Return the table as a pandas DataFrame with one column for
+            each of its columns. Requires pandas.
+        """
+        try:
+            import pandas
+        except ImportError:
+            raise ValueError("Converting a report table to a DataFrame requires the pandas module.")
+        return pandas.DataFrame(OrderedDict(itertools.izip(self.columns, self.to_numpy())), columns=self.columns)
+
+    def to_arrow(self):
+        """Return the table as a pyarrow Table. Requires pyarrow."""
+        if pyarrow is None:
+            raise ValueError("Converting a report table to Arrow requires the pyarrow module.")
+        arrays = []
+        for kind, values in itertools.izip(self.kinds, self.to_numpy()):
+            if COLUMN_TYPECODES[kind] is None:
+                arrays.append(pyarrow.array(values, type=pyarrow.string()))
+            else:
+                arrays.append(pyarrow.array(values))
+        return pyarrow.Table.from_arrays(arrays, names=self.columns)
+
+
+class ReportWriter:
+    """Where report() sends its tables. Each table is written as
+        start_table(), any number of write_rows() and end_table().
+        A subclass implements write_row(), and write_rows() too if it can
+        write many rows faster than one at a time.
+        Text is buffered and written WRITE_BUFFER_SIZE bytes at a time,
+        call flush() to write it out sooner.
+        out: a file path, a file, or None for stdout. A report for a path
+            is written next to it and only renamed to it by close(), so a
+            run that fails leaves any earlier report in place.
     """
 
-    #
-    # Prepare
-    #
+    def __init__(self, out=None):
+        self.owned = isinstance(out, basestring)
+        self.path = self.temp = None
+        if self.owned:
+            self.path = out
+            # Pipes and devices, e.g. /dev/stdout, are written directly
+            if not os.path.exists(out) or os.path.isfile(out):
+                self.temp = out = u'{0}.tmp'.format(out)
+            out = open(out, 'wb')
+        self.out = out
+        self.buffer = io.BytesIO()
+        self.name = None
+        self.header = None
+
+    def start_table(self, name, header):
+        """name: u'period', u'percentile' or u'user'
+            header: the names of the columns
+        """
+        self.name = name
+        self.header = list(header)
+
+    def write_row(self, row):
+        """row: the values of each column, in the order of the header"""
+        raise NotImplementedError
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def end_table(self):
+        self.name = None
+        self.header = None
+
+    def write_table(self, table):
+        """Write a whole ReportTable"""
+        self.start_table(table.name, table.columns)
+        self.write_rows(table.rows())
+        self.end_table()
+
+    def write(self, data):
+        self.buffer.write(data)
+        if self.buffer.tell() >= WRITE_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        out = self.out if self.out is not None else sys.stdout
+        data = self.buffer.getvalue()
+        if data:
+            out.write(data)
+            self.buffer.seek(0)
+            self.buffer.truncate()
+        out.flush()
+
+    def close(self):
+        """Flush, and close the output if it was opened from a path"""
+        self.flush()
+        if self.owned:
+            self.out.close()
+        if self.temp is not None:
+            os.rename(self.temp, self.path)
+            self.temp = None
+
+    def discard(self):
+        """Remove what has been written to a path that was not closed yet"""
+        if self.temp is not None:
+            self.out.close()
+            os.remove(self.temp)
+            self.temp = None
+
+
+class CSVWriter(ReportWriter):
+    """Writes each table as CSV followed by a blank line, the report
+        format of metrify.awk. Fields that contain the separator, a quote
+        or a line break are quoted, as by csv.QUOTE_MINIMAL.
+    """
+
+    def __init__(self, out=None, separator=SEPARATOR):
+        ReportWriter.__init__(self, out)
+        self.separator = separator
+
+    def quote(self, field):
+        if (self.separator in field or u'"' in field or
+                u'\n' in field or u'\r' in field):
+            return u'"' + field.replace(u'"', u'""') + u'"'
+        return field
+
+    def start_table(self, name, header):
+        ReportWriter.start_table(self, name, header)
+        self.write_rows([header])
+
+    def write_row(self, row):
+        self.write_rows([row])
+
+    def write_rows(self, rows):
+        separator = self.separator
+        lines = []
+        for row in rows:
+            row = map(unicode, row)
+            line = separator.join(row)
+            # Only rows with something to quote take the slow path
+            if (line.count(separator) != len(row) - 1 or u'"' in line or
+                    u'\n' in line or u'\r' in line):
+                line = separator.join(map(self.quote, row))
+            lines.append(line)
+            if len(lines) == 1000:
+                self.write((u'\n'.join(lines) + u'\n').encode('utf-8'))
+                lines = []
+        if lines:
+            self.write((u'\n'.join(lines) + u'\n').encode('utf-8'))
+
+    def end_table(self):
+        ReportWriter.end_table(self)
+        self.write(b'\n')
+
+
+class NDJSONWriter(ReportWriter):
+    """Writes each row as a JSON object, one per line, keyed by the
+        column names, with the name of its table in u'table'
+    """
+
+    def start_table(self, name, header):
+        ReportWriter.start_table(self, name, header)
+        self.prefix = u'{{"table": {0}, '.format(json.dumps(name))
+        self.keys = [json.dumps(column) + u': ' for column in header]
+
+    def write_row(self, row):
+        self.write_rows([row])
+
+    def write_rows(self, rows):
+        prefix = self.prefix
+        keys = self.keys
+        dumps = json.dumps
+        for row in rows:
+            line = prefix + u', '.join(key + dumps(value) for key, value in itertools.izip(keys, row)) + u'}\n'
+            self.write(line.encode('utf-8'))
+
+
+class ArrowWriter(ReportWriter):
+    """Writes each table to its own Parquet or Arrow file, named after
+        the table, e.g. report.period.parquet for a path of report.parquet.
+        A table is only written once it ends, so this cannot write a live
+        report (see report_live()). Requires pyarrow.
+        format: 'parquet' or 'arrow'
+    """
+
+    def __init__(self, path, format='parquet'):
+        if pyarrow is None:
+            raise ValueError("Writing {0} requires the pyarrow module.".format(format))
+        if not isinstance(path, basestring):
+            raise ValueError("Writing {0} requires a file path.".format(format))
+        ReportWriter.__init__(self)
+        self.path = path
+        self.format = format
+        self.columns = None
+        self.paths = []
+
+    def start_table(self, name, header):
+        ReportWriter.start_table(self, name, header)
+        self.columns = [[] for column in self.header]
+
+    def write_row(self, row):
+        self.write_rows([row])
+
+    def write_rows(self, rows):
+        columns = self.columns
+        for row in rows:
+            for column, value in itertools.izip(columns, row):
+                # Text columns are strings, not binary
+                if isinstance(value, bytes):
+                    value = value.decode('utf-8')
+                column.append(value)
+
+    def end_table(self):
+        table = pyarrow.Table.from_arrays([pyarrow.array(column) for column in self.columns], names=self.header)
+        self.write_arrow(table)
+        self.columns = None
+        ReportWriter.end_table(self)
+
+    def write_table(self, table):
+        ReportWriter.start_table(self, table.name, table.columns)
+        self.write_arrow(table.to_arrow())
+        ReportWriter.end_table(self)
+
+    def write_arrow(self, table):
+        root, extension = os.path.splitext(self.path)
+        path = u'{0}.{1}{2}'.format(root, self.name, extension)
+        if self.format == 'parquet':
+            pyarrow.parquet.write_table(table, path)
+        else:
+            writer = pyarrow.RecordBatchFileWriter(path, table.schema)
+            writer.write_table(table)
+            writer.close()
+        self.paths.append(path)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def open_writer(out=None, format=None, separator=SEPARATOR):
+    """Return a ReportWriter for out (a path, a file, or None for stdout)
+        format: one of FORMATS, by default guessed from the extension of
+            out (see FORMAT_EXTENSIONS), or CSV
+    """
+    if format is None:
+        if isinstance(out, basestring):
+            format = FORMAT_EXTENSIONS.get(os.path.splitext(out)[1].lower(), 'csv')
+        else:
+            format = 'csv'
+    if format == 'csv':
+        return CSVWriter(out, separator)
+    if format == 'ndjson':
+        return NDJSONWriter(out)
+    if format in ('parquet', 'arrow'):
+        return ArrowWriter(out, format)
+    raise ValueError("Unknown output format: {0}".format(format))
+
+
+def build_report(metrifier, period='hour', percentiles=(100,), includeusers=False):
+    """ Return the tables of the report() of a metrifier as an OrderedDict
+        of ReportTables: u'period', u'percentile' and, if includeusers,
+        u'user'. See report() for the arguments.
+    """
 
     if not percentiles:
         percentiles = (100,)
 
+    profiler = PROFILER
+    if profiler is not None:
+        began = time.time()
+
     user_percentiles = []
-    for percentile, cohort, tweets in sorted(metrifier.group_users_by_percentile(percentiles)):
+    for percentile, cohort, tweets in sorted(metrifier.group_users_by_percentile(percentiles, include_tweets=False)):
         user_percentiles.append((percentile, cohort, tweets))
     user_percentiles.reverse()
 
+    if profiler is not None:
+        grouped = time.time()
+        profiler.add(u'group', grouped - began)
+
+    tables = OrderedDict()
+
     #
     # Time period breakdown
     #
 
-    sys.stdout.write(SEPARATOR.join(report_period_header(metrifier, user_percentiles)))
-    sys.stdout.write('\n')
+    table = ReportTable(u'period', report_period_header(metrifier, user_percentiles),
+                        report_period_kinds(user_percentiles))
     if period:
         # We can skip calculating multiple periods
         # if the total collection spans less than 1 period.
@@ -466,62 +3394,102 @@ def report(metrifier, period='hour', percentiles=(100,), includeusers=False, sep
             p = 2592000
         elif period == 'year':
             p = 946080000
-        if abs(delta.total_seconds()) > p:
-
-            periods = {
-                'year': 1,
-                'month': 2,
-                'day': 3,
-                'hour': 4,
-                'minute': 5,
-                'second': 6
-            }
-
-            def grouper(tweet):
-                return tweet[u'postedTimeObj'].timetuple()[:periods[period]]
-
-            for count, (key, group) in enumerate(itertools.groupby(metrifier.itertweets(), key=grouper)):
-                # datetime requires at least (year, month, day)
-                while len(key) < 3:
-                    key += (1,)
-                subset = Metrifier()
-                # Here's where we use the actual tweet objects
-                for tweet in group:
-                    subset.eat(tweet)
-                period_label = str(count)
-                sys.stdout.write(SEPARATOR.join(map(unicode, report_period_row(subset, user_percentiles, period_label))))
-                sys.stdout.write('\n')
-                sys.stdout.flush()
-    sys.stdout.write(SEPARATOR.join(map(unicode, report_period_row(metrifier, user_percentiles, "total"))))
-    sys.stdout.write('\n\n')
-    sys.stdout.flush()
-
+        if abs(delta) > p:
+            buckets = metrifier.period_buckets(period)
+            table.extend(report_period_row(buckets[key], user_percentiles, str(count))
+                         for count, key in enumerate(sorted(buckets)))
+    table.extend([report_period_row(metrifier, user_percentiles, "total")])
+    tables[table.name] = table
 
     #
     # Percentile breakdown
     #
-    sys.stdout.write(SEPARATOR.join(report_percentile_header()))
-    sys.stdout.write('\n')
+
+    table = ReportTable(u'percentile', report_percentile_header(), report_percentile_kinds())
     if not percentiles == (100,):
-        for row in iter_report_percentile_rows(metrifier, user_percentiles):
-            sys.stdout.write(SEPARATOR.join(map(unicode, row)))
-            sys.stdout.write('\n')
-            sys.stdout.flush()
-    sys.stdout.write(SEPARATOR.join(map(unicode, report_100_percent_row(metrifier))))
-    sys.stdout.write('\n\n')
-    sys.stdout.flush()
+        table.extend(iter_report_percentile_rows(metrifier, user_percentiles))
+    table.extend([report_100_percent_row(metrifier)])
+    tables[table.name] = table
 
     #
     # Individual user statistics
     #
 
     if includeusers:
-        sys.stdout.write(SEPARATOR.join(report_user_header()))
-        sys.stdout.write('\n')
-        for row in iter_report_user_rows(metrifier, user_percentiles):
-            sys.stdout.write(SEPARATOR.join(map(unicode, row)))
-            sys.stdout.write('\n')
-            sys.stdout.flush()
+        table = ReportTable(u'user', report_user_header(), report_user_kinds())
+        table.extend_columns(report_user_columns(metrifier, user_percentiles))
+        tables[table.name] = table
+
+    if profiler is not None:
+        profiler.add(u'report', time.time() - grouped)
+
+    return tables
+
+
+def report(metrifier, period='hour', percentiles=(100,), includeusers=False, separator=SEPARATOR, writer=None):
+    """ Produce output in the style of metrify.awk by Mapping Online Publics
+        metrifier: Metrifier() object that has already ingested tweets
+        period: a time period with which to group tweets
+        percentiles: a sequence of percentiles used to group users by activity (1, 9, 90)
+        includeusers: option to skipping calculating per-user stats
+        separator: field separator character
+        writer: a ReportWriter for the tables (see open_writer()), by
+            default CSV to stdout
+
+    """
+
+    tables = build_report(metrifier, period, percentiles, includeusers)
+
+    profiler = PROFILER
+    if profiler is not None:
+        began = time.time()
+
+    owned = writer is None
+    if owned:
+        writer = CSVWriter(separator=separator)
+    for table in tables.itervalues():
+        writer.write_table(table)
+    if owned:
+        writer.close()
+    else:
+        writer.flush()
+
+    if profiler is not None:
+        profiler.add(u'report', time.time() - began)
+
+
+def report_live(tweets, period='minute', lateness=0, window=None, sketch=None, sketch_precision=12,
+                separator=SEPARATOR, writer=None):
+    """ Report the totals for each period of a stream of tweets as soon as
+        the period closes, see LiveWindows
+        tweets: an iterable of tweets, which may never end
+        writer: see report(), but not an ArrowWriter
+        Returns the LiveWindows, e.g. to read how many tweets were late.
+    """
+    if isinstance(writer, ArrowWriter):
+        raise ValueError("A live report cannot be written to {0} files, which are only written once a table ends.".format(writer.format))
+    owned = writer is None
+    if owned:
+        writer = CSVWriter(separator=separator)
+    live = LiveWindows(period, lateness, window, sketch, sketch_precision)
+    writer.start_table(u'period', report_period_header(None, []))
+    writer.flush()
+    count = 0
+    for tweet in itertools.chain(tweets, [None]):
+        if tweet is None:
+            buckets = live.close()
+        else:
+            buckets = live.eat(tweet)
+        if buckets:
+            writer.write_rows(report_period_row(bucket, [], str(count + i)) for i, bucket in enumerate(buckets))
+            writer.flush()
+            count += len(buckets)
+    writer.end_table()
+    if owned:
+        writer.close()
+    else:
+        writer.flush()
+    return live
 
 
 def report_user_header():
@@ -529,7 +3497,7 @@ def report_user_header():
         u'user',
         u'id_str',
         u'percentile',
-        u'tweets'
+        u'tweets',
         u"original tweets",
         u"% original",
         u"outbound @-mentions",
@@ -561,71 +3529,91 @@ def report_user_header():
         u"inbound edited retweets:outbound tweets"
         ]
 
-def iter_report_user_rows(metrifier, percentiles):
+def report_user_kinds():
+    return ([u'text', u'text', u'int', u'int'] +
+            [u'int', u'float'] * 8 +
+            [u'int', u'ratio'] +
+            [u'int', u'float', u'ratio'] +
+            [u'int', u'ratio'] +
+            [u'int', u'float', u'ratio'] * 2)
+
+
+def report_user_columns(metrifier, percentiles):
+    """Returns the columns of the per-user statistics, one sequence per
+        column of report_user_header(), computed a column at a time"""
+    users = metrifier.user
+    id_strs = []
+    labels = []
     for percentile, cohort, tweet in reversed(percentiles):
-        for id_str in sorted(cohort[u'user']):
-            tweets = metrifier.user[id_str].get(u'tweet', 0)
-            original_tweets = metrifier.user[id_str].get(u'is_original', 0)
-            outbound_mentions = metrifier.user[id_str].get(u'outbound_mention', 0)
-            outbound_replies = metrifier.user[id_str].get(u'outbound_replies', 0)
-            outbound_retweets = metrifier.user[id_str].get(u'outbound_retweets', 0)
-            outbound_unedited_retweets = metrifier.user[id_str].get(u'outbound_unedited_retweets', 0)
-            outbound_edited_retweets = metrifier.user[id_str].get(u'outbound_edited_retweets', 0)
-            inbound_mentions = metrifier.user[id_str].get(u'inbound_mention', 0)
-            inbound_replies = metrifier.user[id_str].get(u'inbound_replies', 0)
-            inbound_retweets = metrifier.user[id_str].get(u'inbound_retweets', 0)
-            inbound_unedited_retweets = metrifier.user[id_str].get(u'inbound_unedited_retweets', 0)
-            inbound_edited_retweets = metrifier.user[id_str].get(u'inbound_edited_retweets', 0)
-            has_url = metrifier.user[id_str].get(u'has_url', 0)
-            has_hashtag = metrifier.user[id_str].get(u'has_hashtag', 0)
-            row = [
-                metrifier.user[id_str][u'username'],
-                id_str,
-                percentile,
-                metrifier.user[id_str][u'tweet'],
-                original_tweets,
-                percent(original_tweets, tweets),
-                outbound_mentions,
-                percent(outbound_mentions, tweets),
-                outbound_replies,
-                percent(outbound_replies, tweets),
-                outbound_retweets,
-                percent(outbound_retweets, tweets),
-                outbound_unedited_retweets,
-                percent(outbound_unedited_retweets, tweets),
-                outbound_edited_retweets,
-                percent(outbound_edited_retweets, tweets),
-                has_url,
-                percent(has_url, tweets),
-                has_hashtag,
-                percent(has_hashtag, tweets),
-                inbound_mentions,
-                ratio(inbound_mentions, tweets),
-                inbound_replies,
-                percent(inbound_replies, inbound_mentions),
-                ratio(inbound_replies, tweets),
-                inbound_retweets,
-                ratio(inbound_retweets, tweets),
-                inbound_unedited_retweets,
-                percent(inbound_unedited_retweets, inbound_retweets),
-                ratio(inbound_unedited_retweets, tweets),
-                inbound_edited_retweets,
-                percent(inbound_edited_retweets, inbound_retweets),
-                ratio(inbound_edited_retweets, tweets)
-                ]
-            yield row
-
-
-def report_percentile_row(metrifier, label, total_tweets):
-    tweets = metrifier.frequency.get(u'tweet', 0)
-    original = metrifier.frequency.get(u'is_original', 0)
-    mentions = metrifier.frequency.get(u'is_mention', 0)
-    replies = metrifier.frequency.get(u'is_reply', 0)
-    retweets = metrifier.frequency.get(u'is_retweet', 0)
-    unedited_rt = metrifier.frequency.get(u'is_unedited_retweet', 0)
-    edited_rt = metrifier.frequency.get(u'is_edited_retweet', 0)
-    has_url = metrifier.frequency.get(u'has_url', 0)
-    has_hashtag = metrifier.frequency.get(u'has_hashtag', 0)
+        cohort_users = sorted(cohort[u'user'])
+        id_strs.extend(cohort_users)
+        labels.extend([percentile] * len(cohort_users))
+    rows = array(INT64, map(users.index.__getitem__, id_strs))
+
+    def counts(key):
+        return take(users.column(key), rows)
+
+    tweets = counts(u'tweet')
+    original_tweets = counts(u'is_original')
+    outbound_mentions = counts(u'outbound_mention')
+    outbound_replies = counts(u'outbound_replies')
+    outbound_retweets = counts(u'outbound_retweets')
+    outbound_unedited_retweets = counts(u'outbound_unedited_retweets')
+    outbound_edited_retweets = counts(u'outbound_edited_retweets')
+    inbound_mentions = counts(u'inbound_mention')
+    inbound_replies = counts(u'inbound_replies')
+    inbound_retweets = counts(u'inbound_retweets')
+    inbound_unedited_retweets = counts(u'inbound_unedited_retweets')
+    inbound_edited_retweets = counts(u'inbound_edited_retweets')
+    has_url = counts(u'has_url')
+    has_hashtag = counts(u'has_hashtag')
+    return [
+        map(users.username.__getitem__, rows),
+        id_strs,
+        labels,
+        tweets,
+        original_tweets,
+        percent_column(original_tweets, tweets),
+        outbound_mentions,
+        percent_column(outbound_mentions, tweets),
+        outbound_replies,
+        percent_column(outbound_replies, tweets),
+        outbound_retweets,
+        percent_column(outbound_retweets, tweets),
+        outbound_unedited_retweets,
+        percent_column(outbound_unedited_retweets, tweets),
+        outbound_edited_retweets,
+        percent_column(outbound_edited_retweets, tweets),
+        has_url,
+        percent_column(has_url, tweets),
+        has_hashtag,
+        percent_column(has_hashtag, tweets),
+        inbound_mentions,
+        ratio_column(inbound_mentions, tweets),
+        inbound_replies,
+        percent_column(inbound_replies, inbound_mentions),
+        ratio_column(inbound_replies, tweets),
+        inbound_retweets,
+        ratio_column(inbound_retweets, tweets),
+        inbound_unedited_retweets,
+        percent_column(inbound_unedited_retweets, inbound_retweets),
+        ratio_column(inbound_unedited_retweets, tweets),
+        inbound_edited_retweets,
+        percent_column(inbound_edited_retweets, inbound_retweets),
+        ratio_column(inbound_edited_retweets, tweets)
+        ]
+
+
+def report_percentile_row(frequency, label, total_tweets):
+    tweets = frequency.get(u'tweet', 0)
+    original = frequency.get(u'is_original', 0)
+    mentions = frequency.get(u'is_mention', 0)
+    replies = frequency.get(u'is_reply', 0)
+    retweets = frequency.get(u'is_retweet', 0)
+    unedited_rt = frequency.get(u'is_unedited_retweet', 0)
+    edited_rt = frequency.get(u'is_edited_retweet', 0)
+    has_url = frequency.get(u'has_url', 0)
+    has_hashtag = frequency.get(u'has_hashtag', 0)
     return [
         label,
         tweets,
@@ -652,16 +3640,13 @@ def report_percentile_row(metrifier, label, total_tweets):
 def report_100_percent_row(metrifier):
     label = u'All {0} users'.format(metrifier.frequency[u'author'])
     total_tweets = metrifier.frequency.get(u'tweet', 0)
-    return report_percentile_row(metrifier, label, total_tweets)
+    return report_percentile_row(metrifier.frequency, label, total_tweets)
 
 
 def iter_report_percentile_rows(metrifier, percentiles):
     lower_bound = 0
     total_tweets = metrifier.frequency.get(u'tweet', 0)
     for percentile, cohort, tweets in percentiles:
-        subset = Metrifier()
-        for tweet_id_str in tweets:
-            subset.eat(metrifier.tweet[tweet_id_str])
         label = u'users {0}% ({1} < outbound tweets <= {2}; {3} of {4} users)'.format(
                                                                         percentile,
                                                                         lower_bound,
@@ -670,7 +3655,8 @@ def iter_report_percentile_rows(metrifier, percentiles):
                                                                         len(metrifier.user)
                                                                        )
         lower_bound = cohort[u'activity']
-        yield report_percentile_row(subset, label, total_tweets)
+        frequency = metrifier.cohort_frequency(cohort[u'user'])
+        yield report_percentile_row(frequency, label, total_tweets)
 
 
 def report_percentile_header():
@@ -698,6 +3684,10 @@ def report_percentile_header():
     return row
 
 
+def report_percentile_kinds():
+    return [u'text', u'int', u'float'] + [u'int', u'ratio'] * 8
+
+
 def report_period_header(metrifier, percentiles):
     """Returns a sequence of strings corresponding to the column headers
         at the top of the default output from metrify.awk"""
@@ -740,6 +3730,11 @@ def report_period_header(metrifier, percentiles):
     return row
 
 
+def report_period_kinds(percentiles):
+    return ([u'text'] * 3 + [u'int'] * 2 + [u'ratio'] * 8 + [u'int'] * 6 +
+            [u'float'] * 5 + [u'ratio'] + [u'int', u'float'] * 2 * len(percentiles))
+
+
 def report_period_row(metrifier, percentiles, label=''):
     """Returns a sequence of numbers corresponding to the columns at the top
         of the default output from metrify.awk"""
@@ -750,8 +3745,8 @@ def report_period_row(metrifier, percentiles, label=''):
     row = [label]
 
     # Time boundaries
-    row.append(metrifier.timebounds['first'].strftime(ISOFORMAT))
-    row.append(metrifier.timebounds['last'].strftime(ISOFORMAT))
+    row.append(format_epoch(metrifier.timebounds['first']))
+    row.append(format_epoch(metrifier.timebounds['last']))
 
     # Tweets collected
     tweets = metrifier.frequency[u'tweet']
@@ -805,7 +3800,7 @@ def report_period_row(metrifier, percentiles, label=''):
     rt_edited = metrifier.frequency[u'is_edited_retweet']
     row.append(rt_edited)
 
-    # Unique URLs
+    # Unique URLs (an estimate if the metrifier keeps a sketch)
     urls = len(metrifier.url)
     row.append(urls)
 
@@ -827,7 +3822,7 @@ def report_period_row(metrifier, percentiles, label=''):
     # % of tweets with any URLs
     row.append(ratio(metrifier.frequency[u'has_url'], tweets))
 
-    for percentile, cohort, tweets in percentiles:
+    for percentile, cohort, tweet in percentiles:
 
         # number of current users _% (_ < tweets <= _)
         row.append(cohort[u'user_count'])
@@ -839,7 +3834,7 @@ def report_period_row(metrifier, percentiles, label=''):
         row.append(cohort[u'count'])
 
         # % of tweets _% (_ < tweets <= _)
-        row.append(percent(cohort[u'count'], len(tweets)))
+        row.append(percent(cohort[u'count'], tweets))
 
     return row
 
@@ -857,16 +3852,181 @@ if __name__ == "__main__":
     parser.add_argument('-p', '--percentiles', help="Report user activity metrics by percentiles, e.g. 90,9,1 (Note: these must sum to less than 100)", action=PercentilesAction)
     parser.add_argument('-t', '--timeperiod', help="Report tweet metrics by time period", choices=['year', 'month', 'day', 'hour', 'minute', 'second'], type=str)
     parser.add_argument('-u', '--includeusers', help="Report descriptive statistics for each user", action="store_true")
+    parser.add_argument('--columnar', help="Store tweets in compact arrays (requires numeric tweet ids)", action="store_true")
+    parser.add_argument('-s', '--streaming', help="Keep only per-user and per-period counters, not the tweets themselves (URLs and hashtags are still counted exactly unless --sketch is given)", action="store_true")
+    parser.add_argument('--dedup', help="Reject tweets with an id that has already been seen, using an exact set or a fixed-size Bloom filter", choices=['exact', 'bloom'])
+    parser.add_argument('--dedup-capacity', help="Number of tweets the Bloom filter is sized for", default=10000000, type=int)
+    parser.add_argument('--dedup-error-rate', help="Share of new tweets the Bloom filter may wrongly reject", default=0.001, type=float)
+    parser.add_argument('--sketch', help="Count only the N most frequent URLs and hashtags, and estimate unique URLs, in fixed memory", metavar='N', type=int)
+    parser.add_argument('--sketch-precision', help="With --sketch, estimate unique URLs with at most 2 ** P bytes per time period, from 4 to 16 (default 12, within about 1.6%%)", metavar='P', type=int, default=12)
+    parser.add_argument('--hashtag', help="Report only on tweets with this hashtag")
+    parser.add_argument('--url', help="Report only on tweets linking to this expanded URL")
+    parser.add_argument('--domain', help="Report only on tweets linking to a URL on this domain, e.g. example.com")
+    parser.add_argument('--mention', help="Report only on tweets that @-mention this username", metavar='USERNAME')
+    parser.add_argument('-j', '--jobs', help="Number of processes used to read INPUT, each reading whole files or byte ranges of uncompressed files (requires files, not stdin)", default=1, type=int)
+    parser.add_argument('--state', help="Load the results of earlier runs from FILE (if it exists), add INPUT, and save them back to FILE", metavar='FILE')
+    parser.add_argument('--live', help="Report each time period as soon as it closes, keeping only the open periods in memory (requires -t)", action="store_true")
+    parser.add_argument('--lateness', help="With --live, seconds to wait for tweets that arrive out of order", default=0, type=int)
+    parser.add_argument('--window', help="With --live, report each period together with the periods that started less than SECONDS before it ended", metavar='SECONDS', type=int)
+    parser.add_argument('--listen', help="Instead of reading INPUT, accept Activity Streams objects from many producers on a TCP HOST:PORT or a Unix socket PATH (may be repeated). Send SIGUSR1 to print a report, SIGINT or SIGTERM to stop", metavar='ADDRESS', action='append')
+    parser.add_argument('--queue-size', help="With --listen, number of lines to queue from each producer before it is held back", default=10000, type=int)
+    parser.add_argument('-o', '--output', help="Write the report to FILE instead of stdout", metavar='FILE')
+    parser.add_argument('-f', '--format', help="Format of the report: csv, ndjson (one JSON object per row), or parquet or arrow (one file per table, requires pyarrow). By default, guessed from the extension of --output, or csv", choices=FORMATS)
+    parser.add_argument('--profile', help="Time each stage of the run, writing progress and a summary to stderr", action="store_true")
+    parser.add_argument('--profile-output', help="With --profile, also save the totals as JSON to FILE", metavar='FILE')
     parser.add_argument('-v', '--verbose', help="Verbose output to stderr", action="store_true")
-    parser.add_argument('INPUT', help="Source with Activity Streams objects, one per line", default="-", type=argparse.FileType('r'))
+    parser.add_argument('INPUT', help="Files or glob patterns with Activity Streams objects, one per line, which may be compressed with gzip, bzip2, xz or zstd (default: stdin, or nothing with --state)", nargs='*')
     args = parser.parse_args()
 
+    patterns = args.INPUT
+    if not patterns:
+        if args.state:
+            # Report on the saved state alone
+            if not os.path.exists(args.state):
+                parser.error("--state {0} does not exist and there is no INPUT to add to it".format(args.state))
+            patterns = []
+        else:
+            patterns = ['-']
+    inputs = []
+    for pattern in patterns:
+        # Any path that exists, including pipes such as /dev/fd/63, is read
+        # as it is, and only the others are expanded as glob patterns
+        if pattern == '-' or os.path.exists(pattern):
+            if os.path.isdir(pattern):
+                parser.error("Is a directory: {0}".format(pattern))
+            inputs.append(pattern)
+        else:
+            paths = sorted(path for path in glob.glob(pattern) if not os.path.isdir(path))
+            if not paths:
+                parser.error("No such file: {0}".format(pattern))
+            inputs.extend(paths)
+    if args.columnar and args.streaming:
+        parser.error("--streaming does not store tweets, so --columnar does not apply")
+    if args.listen and (args.output or args.format):
+        parser.error("--listen writes its reports to stdout as CSV")
+    query = {}
+    for key in ('hashtag', 'url', 'domain', 'mention'):
+        if getattr(args, key) is not None:
+            query[key] = getattr(args, key).decode('utf-8')
+    if query and (args.live or args.listen):
+        parser.error("--hashtag, --url, --domain and --mention do not apply to --live or --listen")
+    if not 4 <= args.sketch_precision <= 16:
+        parser.error("--sketch-precision must be from 4 to 16")
+    if args.profile_output:
+        args.profile = True
+        if is_input(args.profile_output, inputs):
+            parser.error("--profile-output {0} is also an INPUT".format(args.profile_output))
+
+    writer = None
+    if not args.listen:
+        if args.output and is_input(args.output, inputs):
+            parser.error("--output {0} is also an INPUT".format(args.output))
+        try:
+            writer = open_writer(args.output, args.format)
+        except (IOError, ValueError) as e:
+            parser.error(str(e))
+        # Leave an earlier report in place if this run fails
+        atexit.register(writer.discard)
+
     VERBOSE = args.verbose
+    if args.profile:
+        PROFILER = Profiler()
+
+    if args.live:
+        if not args.timeperiod:
+            parser.error("--live requires -t")
+        if isinstance(writer, ArrowWriter):
+            parser.error("--live writes each period as it closes, which {0} files cannot do".format(writer.format))
+        if args.percentiles or args.includeusers or args.state or args.jobs > 1:
+            parser.error("--live only reports the time period breakdown")
+        tweets = (json.loads(line) for path in inputs for line in read_lines(path))
+        live = report_live(tweets, args.timeperiod, args.lateness, args.window, args.sketch, args.sketch_precision,
+                           writer=writer)
+        writer.close()
+        if live.late:
+            sys.stderr.write('Ignored {0} tweets that arrived too late\n'.format(live.late))
+        if PROFILER is not None:
+            finish_profile(PROFILER, args.profile_output)
+        sys.exit(0)
+
+    if args.timeperiod:
+        periods = (args.timeperiod,)
+    else:
+        periods = ()
+
+    options = {
+        'periods': periods,
+        'columnar': args.columnar,
+        'streaming': args.streaming,
+        'dedup': args.dedup,
+        'capacity': args.dedup_capacity,
+        'error_rate': args.dedup_error_rate,
+        'sketch': args.sketch,
+        'sketch_precision': args.sketch_precision
+    }
+
+    state = None
+    if args.state and os.path.exists(args.state):
+        state = Metrifier.load(args.state)
+        saved = (state.periods, state.columnar, state.streaming, state.dedup, state.sketch, state.sketch_precision)
+        if saved != (periods, args.columnar, args.streaming, args.dedup, args.sketch, args.sketch_precision):
+            parser.error("--state {0} was saved with different options".format(args.state))
+        if query and state.index is None:
+            parser.error("--state {0} was saved without an index, so it cannot be queried".format(args.state))
+    if query and args.streaming:
+        parser.error("--streaming does not store tweets, so they cannot be queried")
+    # Keep indexing the tweets of a state that has an index
+    options['index'] = bool(query) or (state is not None and state.index is not None)
+
+    if args.listen:
+        if args.jobs > 1:
+            parser.error("--listen reads from sockets, so --jobs does not apply")
+        metrifier = state or Metrifier(**options)
+        server = IngestServer(metrifier,
+                              [parse_address(address) for address in args.listen],
+                              args.queue_size,
+                              period=args.timeperiod,
+                              percentiles=args.percentiles,
+                              includeusers=args.includeusers)
+        signal.signal(signal.SIGUSR1, server.request_dump)
+        # Stop between polls, rather than with a KeyboardInterrupt that
+        # could leave a batch half eaten
+        signal.signal(signal.SIGINT, server.stop)
+        signal.signal(signal.SIGTERM, server.stop)
+        server.serve_forever()
+        server.close()
+        if server.errors:
+            sys.stderr.write('Skipped {0} lines that were not tweets\n'.format(server.errors))
+    elif args.jobs > 1 and inputs:
+        if '-' in inputs:
+            parser.error("--jobs requires INPUT to be files")
+        if args.dedup:
+            parser.error("--dedup cannot reject duplicates that span --jobs")
+        metrifier = eat_parallel(inputs, args.jobs, state, **options)
+    else:
+        metrifier = state or Metrifier(**options)
+        for path in inputs:
+            eat_file(metrifier, path)
+
+    if args.dedup:
+        sys.stderr.write('Rejected {0} duplicate tweets\n'.format(metrifier.frequency[u'duplicate']))
+
+    if args.sketch:
+        sys.stderr.write('Unique URLs are estimates within about {0:.1%}\n'.format(metrifier.url.distinct.error))
+        sys.stderr.write('URL counts may be overestimated by up to {0}, hashtag counts by up to {1}\n'.format(metrifier.url.floor(), metrifier.hashtag.floor()))
+
+    if args.state and (inputs or args.listen):
+        metrifier.save(args.state)
 
-    metrifier = Metrifier()
+    if query:
+        metrifier = metrifier.query(**query)
+        if not metrifier.frequency:
+            sys.stderr.write('No tweets match {0}\n'.format(u' '.join(u'--{0} {1}'.format(*item) for item in sorted(query.items())).encode('utf-8')))
+            sys.exit(1)
 
-    for line in args.INPUT:
-        tweet = json.loads(line)
-        metrifier.eat(tweet)
+    report(metrifier, args.timeperiod, args.percentiles, args.includeusers, writer=writer)
+    if writer is not None:
+        writer.close()
 
-    report(metrifier, args.timeperiod, args.percentiles, args.includeusers)
+    if PROFILER is not None:
+        finish_profile(PROFILER, args.profile_output)
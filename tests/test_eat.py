@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pymetrify import Metrifier
+
+
+def tweet(n, body=u'hello', username=u'author', user_id_str=u'1'):
+    return {
+        u'id': u'tag:search.twitter.com,2005:{0}'.format(n),
+        u'postedTime': u'2013-02-04T17:{0:02d}:00.000Z'.format(n),
+        u'verb': u'post',
+        u'body': body,
+        u'actor': {u'id_str': user_id_str, u'preferredUsername': username},
+        u'object': {},
+        u'twitter_entities': {u'user_mentions': [], u'hashtags': [], u'urls': []}
+    }
+
+
+class EatBatchTest(unittest.TestCase):
+
+    def tweets(self):
+        return [tweet(1), tweet(2, u'RT @other: hello'), tweet(3, user_id_str=u'2', username=u'other')]
+
+    def test_same_as_eat(self):
+        for options in ({}, {'columnar': True}, {'streaming': True}, {'dedup': 'exact'}):
+            one = Metrifier(**options)
+            for t in self.tweets():
+                one.eat(t)
+            many = Metrifier(**options)
+            many.eat_batch(self.tweets())
+            self.assertEqual(many.frequency, one.frequency)
+            self.assertEqual(many.timebounds, one.timebounds)
+
+    def test_skips_tweets_without_an_id(self):
+        m = Metrifier()
+        self.assertEqual(m.eat_batch([tweet(1), {u'postedTime': u'not a time'}, tweet(2)]), 2)
+        self.assertEqual(m.frequency[u'tweet'], 2)
+
+    def test_bad_time_is_not_counted(self):
+        for options in ({}, {'columnar': True}, {'dedup': 'exact'}):
+            m = Metrifier(**options)
+            bad = tweet(9)
+            del bad[u'postedTime']
+            self.assertRaises(ValueError, m.eat_batch, [tweet(1), bad, tweet(2)])
+            self.assertEqual(m.frequency[u'tweet'], 1)
+            self.assertEqual(len(list(m.chronological())), 1)
+            # The rejected tweet was not remembered as seen either
+            bad[u'postedTime'] = u'2013-02-04T17:09:00.000Z'
+            self.assertTrue(m.eat(bad))
+
+
+if __name__ == '__main__':
+    unittest.main()
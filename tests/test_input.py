@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pymetrify import read_lines, split_lines
+
+LINES = [b'{"id": "tag:search.twitter.com,2005:%d"}\n' % n for n in range(1000)]
+
+
+def read(path):
+    # Lines are read with or without their newline
+    return [line.rstrip(b'\n') for line in read_lines(path)]
+
+
+def stripped(lines):
+    return [line.rstrip(b'\n') for line in lines]
+
+
+class ReadLinesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_regular_file(self):
+        with open(self.path('plain'), 'wb') as f:
+            f.writelines(LINES)
+        self.assertEqual(read(self.path('plain')), stripped(LINES))
+
+    def test_compressed_file(self):
+        f = gzip.open(self.path('gz'), 'wb')
+        f.writelines(LINES)
+        f.close()
+        self.assertEqual(read(self.path('gz')), stripped(LINES))
+
+    def test_pipe(self):
+        os.mkfifo(self.path('fifo'))
+
+        def write():
+            with open(self.path('fifo'), 'wb') as f:
+                f.writelines(LINES)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            self.assertEqual(read(self.path('fifo')), stripped(LINES))
+        finally:
+            writer.join()
+
+    def test_empty_file(self):
+        self.assertEqual(read(os.devnull), [])
+
+    def test_split_lines(self):
+        with open(self.path('plain'), 'wb') as f:
+            f.writelines(LINES)
+        data = b''.join(LINES)
+        ranges = split_lines(self.path('plain'), 7)
+        self.assertEqual(b''.join(data[start:end] for start, end in ranges), data)
+        for start, end in ranges:
+            self.assertTrue(start == end or data[end - 1:end] == b'\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pymetrify import CSVWriter, LiveWindows, report_live
+
+
+def tweet(n, minute, second=0, user=u'1'):
+    return {
+        u'id': u'tag:search.twitter.com,2005:{0}'.format(n),
+        u'postedTime': u'2013-02-04T17:{0:02d}:{1:02d}.000Z'.format(minute, second),
+        u'verb': u'post',
+        u'body': u'hello',
+        u'actor': {u'id_str': user, u'preferredUsername': u'user' + user},
+        u'twitter_entities': {u'user_mentions': [], u'hashtags': [], u'urls': []}
+    }
+
+
+class LiveWindowsTest(unittest.TestCase):
+
+    def test_periods_close_in_order(self):
+        live = LiveWindows('minute')
+        self.assertEqual(live.eat(tweet(1, 0, 10)), [])
+        self.assertEqual(live.eat(tweet(2, 0, 20, u'2')), [])
+        closed = live.eat(tweet(3, 1, 5))
+        self.assertEqual([bucket.frequency[u'tweet'] for bucket in closed], [2])
+        self.assertEqual(closed[0].frequency[u'author'], 2)
+        # The minute has closed, so this tweet is late
+        self.assertEqual(live.eat(tweet(4, 0, 50)), [])
+        self.assertEqual(live.late, 1)
+        closed = live.eat(tweet(5, 3, 0))
+        self.assertEqual([bucket.frequency[u'tweet'] for bucket in closed], [1])
+        self.assertEqual([bucket.frequency[u'tweet'] for bucket in live.close()], [1])
+        self.assertEqual(live.open, {})
+
+    def test_lateness(self):
+        live = LiveWindows('minute', lateness=30)
+        live.eat(tweet(1, 0, 10))
+        self.assertEqual(live.eat(tweet(2, 1, 20)), [])
+        # Still within the lateness of the first minute
+        self.assertEqual(live.eat(tweet(3, 0, 50)), [])
+        closed = live.eat(tweet(4, 1, 40))
+        self.assertEqual([bucket.frequency[u'tweet'] for bucket in closed], [2])
+        self.assertEqual(live.late, 0)
+
+    def test_sliding_window(self):
+        live = LiveWindows('minute', window=150)
+        tweets = [tweet(1, 0), tweet(2, 1), tweet(3, 1, 30), tweet(4, 2), tweet(5, 3)]
+        closed = []
+        for t in tweets:
+            closed.extend(live.eat(t))
+        closed.extend(live.close())
+        # Each minute is reported with the minute before it
+        self.assertEqual([bucket.frequency[u'tweet'] for bucket in closed], [1, 3, 3, 2])
+
+    def test_report_live(self):
+        out = io.BytesIO()
+        live = report_live([tweet(1, 0), tweet(2, 0, 30), tweet(3, 2), tweet(4, 1)], writer=CSVWriter(out))
+        self.assertEqual(live.late, 1)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith(b'period,'))
+        # One row for each of the two minutes, numbered as they close
+        self.assertEqual([line.split(b',')[0] for line in lines[1:]], [b'0', b'1', b''])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pymetrify import USER_COUNTERS, Metrifier
+
+
+def tweet(n, user, body=u'hello', mentions=()):
+    return {
+        u'id': u'tag:search.twitter.com,2005:{0}'.format(n),
+        u'postedTime': u'2013-02-04T{0:02d}:{1:02d}:00.000Z'.format(n // 60 % 24, n % 60),
+        u'verb': u'post',
+        u'body': body,
+        u'actor': {u'id_str': unicode(user), u'preferredUsername': u'user{0}'.format(user)},
+        u'twitter_entities': {u'user_mentions': list(mentions), u'hashtags': [], u'urls': []}
+    }
+
+
+def tweets():
+    """Users 1 to 4 tweet, and mention each other before they tweet"""
+    return [
+        tweet(1, 1, u'@user2 hi', [{u'id_str': u'2', u'screen_name': u'user2', u'indices': [0, 6]}]),
+        tweet(2, 1),
+        tweet(3, 3, u'RT @user4: hi'),
+        tweet(4, 2),
+        tweet(5, 4, u'@user1 thanks'),
+        tweet(6, 2),
+        tweet(7, 5, u'@user3 and @user6'),
+    ]
+
+
+def users(metrifier):
+    """Return the counters of each user by id_str"""
+    table = metrifier.user
+    return dict((id_str, [table.counter[key][i] for key in USER_COUNTERS])
+                for i, id_str in enumerate(table.id_str))
+
+
+def eat(start, stop, **options):
+    m = Metrifier(**options)
+    m.eat_many(tweets()[start:stop])
+    return m
+
+
+class MergeTest(unittest.TestCase):
+
+    def assertSame(self, merged, whole):
+        self.assertEqual(merged.frequency, whole.frequency)
+        self.assertEqual(merged.timebounds, whole.timebounds)
+        self.assertEqual(users(merged), users(whole))
+
+    def test_shards(self):
+        for options in ({}, {'columnar': True}, {'streaming': True}):
+            whole = eat(0, 7, **options)
+            for split in range(8):
+                merged = Metrifier(**options)
+                merged += eat(0, split, shard=True, **options)
+                merged += eat(split, 7, shard=True, **options)
+                self.assertSame(merged, whole)
+
+    def test_many_shards(self):
+        whole = eat(0, 7)
+        merged = Metrifier()
+        for i in range(7):
+            merged += eat(i, i + 1, shard=True)
+        self.assertSame(merged, whole)
+        self.assertEqual(merged.frequency[u'author'], 5)
+
+    def test_period_totals(self):
+        whole = eat(0, 7, periods=('minute',))
+        merged = eat(0, 3, periods=('minute',), shard=True)
+        merged += eat(3, 7, periods=('minute',), shard=True)
+        buckets = merged.period_buckets('minute')
+        self.assertEqual(sorted(buckets), sorted(whole.period_buckets('minute')))
+        for key, bucket in whole.period_buckets('minute').iteritems():
+            self.assertEqual(buckets[key].frequency, bucket.frequency)
+
+    def test_different_options(self):
+        self.assertRaises(ValueError, Metrifier(periods=('hour',)).merge, Metrifier(periods=('day',)))
+        self.assertRaises(ValueError, Metrifier().merge, Metrifier(columnar=True))
+        self.assertRaises(ValueError, Metrifier().merge, Metrifier(index=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
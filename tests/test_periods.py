@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import calendar
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pymetrify import Metrifier, PeriodMetrics, period_end, period_start
+
+
+def tweet(n, body, username=u'author', user_id_str=u'1', urls=()):
+    return {
+        u'id': u'tag:search.twitter.com,2005:{0}'.format(n),
+        u'postedTime': u'2013-02-04T17:{0:02d}:00.000Z'.format(n),
+        u'verb': u'post',
+        u'body': body,
+        u'actor': {u'id_str': user_id_str, u'preferredUsername': username},
+        u'object': {},
+        u'twitter_entities': {u'user_mentions': [], u'hashtags': [],
+                              u'urls': [{u'expanded_url': url} for url in urls]}
+    }
+
+
+def epoch(*t):
+    return calendar.timegm(t + (0,) * (6 - len(t)))
+
+
+class PeriodBoundsTest(unittest.TestCase):
+
+    def test_fixed_length(self):
+        seconds = epoch(2013, 2, 4, 17, 5, 30)
+        self.assertEqual(period_start('second', seconds), seconds)
+        self.assertEqual(period_start('minute', seconds), epoch(2013, 2, 4, 17, 5))
+        self.assertEqual(period_start('hour', seconds), epoch(2013, 2, 4, 17))
+        self.assertEqual(period_start('day', seconds), epoch(2013, 2, 4))
+        self.assertEqual(period_end('hour', epoch(2013, 2, 4, 17)), epoch(2013, 2, 4, 18))
+
+    def test_calendar(self):
+        seconds = epoch(2012, 12, 31, 23, 59, 59)
+        self.assertEqual(period_start('month', seconds), epoch(2012, 12, 1))
+        self.assertEqual(period_start('year', seconds), epoch(2012, 1, 1))
+        self.assertEqual(period_end('month', epoch(2012, 12, 1)), epoch(2013, 1, 1))
+        self.assertEqual(period_end('month', epoch(2012, 2, 1)), epoch(2012, 3, 1))
+        self.assertEqual(period_end('year', epoch(2012, 1, 1)), epoch(2013, 1, 1))
+
+
+class PeriodMetricsTest(unittest.TestCase):
+
+    def test_add(self):
+        bucket = PeriodMetrics()
+        bucket.add({u'epoch': 20, u'is_retweet': True}, u'1', [u'http://a'])
+        bucket.add_many([({u'epoch': 10}, u'2', []), ({u'epoch': 30}, u'1', [u'http://a', u'http://b'])])
+        self.assertEqual(bucket.frequency, {u'tweet': 3, u'author': 2, u'is_retweet': 1})
+        self.assertEqual(bucket.timebounds, {u'first': 10, u'last': 30})
+        self.assertEqual(bucket.url, set([u'http://a', u'http://b']))
+
+    def test_merge(self):
+        for sketch in (False, True):
+            first = PeriodMetrics(sketch)
+            first.add({u'epoch': 20}, u'1', [u'http://a'])
+            second = PeriodMetrics(sketch)
+            second.add_many([({u'epoch': 10}, u'1', [u'http://b']), ({u'epoch': 15}, u'2', [])])
+            first.merge(second)
+            first.merge(PeriodMetrics(sketch))
+            self.assertEqual(first.frequency, {u'tweet': 3, u'author': 2})
+            self.assertEqual(first.timebounds, {u'first': 10, u'last': 20})
+            self.assertEqual(len(first.url), 2)
+
+    def test_metrifier_buckets(self):
+        m = Metrifier(periods=('minute', 'hour'))
+        m.eat_many([tweet(1, u'hi', urls=[u'http://a']), tweet(2, u'RT @bob: hi', user_id_str=u'2')])
+        minutes = m.period_buckets('minute')
+        self.assertEqual(sorted(minutes), [epoch(2013, 2, 4, 17, 1), epoch(2013, 2, 4, 17, 2)])
+        self.assertEqual(minutes[epoch(2013, 2, 4, 17, 1)].frequency,
+                         {u'tweet': 1, u'author': 1, u'is_original': 1, u'has_url': 1})
+        self.assertEqual(minutes[epoch(2013, 2, 4, 17, 2)].frequency[u'is_retweet'], 1)
+        hour = m.period_buckets('hour')[epoch(2013, 2, 4, 17)]
+        self.assertEqual(hour.frequency[u'tweet'], 2)
+        self.assertEqual(hour.url, set([u'http://a']))
+
+
+class PeriodBucketsTest(unittest.TestCase):
+
+    def test_undeclared_period_from_the_index(self):
+        tweets = [tweet(1, u'hello @foo'), tweet(2, u'@bar', username=u'bar', user_id_str=u'3'), tweet(3, u'@baz')]
+        declared = Metrifier(periods=('minute',))
+        declared.eat_many(tweets)
+        indexed = Metrifier(periods=('hour',), index=True)
+        indexed.eat_many(tweets)
+        expected = declared.period_buckets('minute')
+        buckets = indexed.period_buckets('minute')
+        self.assertEqual(sorted(buckets), sorted(expected))
+        for key in expected:
+            self.assertEqual(buckets[key].frequency, expected[key].frequency)
+            self.assertEqual(buckets[key].timebounds, expected[key].timebounds)
+
+    def test_undeclared_period_without_an_index(self):
+        m = Metrifier(periods=('hour',))
+        m.eat_many([tweet(1, u'hello')])
+        self.assertRaises(ValueError, m.period_buckets, 'minute')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pymetrify import Metrifier
+
+
+def tweet(n, body, username=u'author', user_id_str=u'1', mentions=()):
+    return {
+        u'id': u'tag:search.twitter.com,2005:{0}'.format(n),
+        u'postedTime': u'2013-02-04T17:{0:02d}:00.000Z'.format(n),
+        u'verb': u'post',
+        u'body': body,
+        u'actor': {u'id_str': user_id_str, u'preferredUsername': username},
+        u'object': {},
+        u'twitter_entities': {u'user_mentions': list(mentions), u'hashtags': [], u'urls': []}
+    }
+
+
+def ids(metrifier):
+    return [t[u'id_str'] for t in metrifier.itertweets()]
+
+
+class QueryMentionTest(unittest.TestCase):
+
+    def test_mentions_without_entities(self):
+        m = Metrifier(index=True)
+        m.eat_many([tweet(1, u'hello @foo'), tweet(2, u'@bar'), tweet(3, u'@baz')])
+        self.assertEqual(ids(m.query(mention=u'foo')), [u'tag:search.twitter.com,2005:1'])
+        self.assertEqual(ids(m.query(mention=u'@BAR')), [u'tag:search.twitter.com,2005:2'])
+        self.assertEqual(ids(m.query(mention=u'nobody')), [])
+
+    def test_mentions_before_and_after_the_id_is_known(self):
+        m = Metrifier(index=True)
+        m.eat_many([
+            tweet(1, u'hello @foo'),
+            tweet(2, u'hi @foo', mentions=[{u'id_str': u'2', u'screen_name': u'foo', u'indices': [3, 7]}]),
+            tweet(3, u'@bar')])
+        self.assertEqual(ids(m.query(mention=u'foo')),
+                         [u'tag:search.twitter.com,2005:1', u'tag:search.twitter.com,2005:2'])
+
+    def test_merged_shards(self):
+        whole = Metrifier(index=True)
+        whole.eat_many([tweet(1, u'hello @foo'), tweet(2, u'@bar'), tweet(3, u'@foo', username=u'foo', user_id_str=u'2')])
+        first = Metrifier(index=True, shard=True)
+        first.eat_many([tweet(1, u'hello @foo'), tweet(2, u'@bar')])
+        second = Metrifier(index=True, shard=True)
+        second.eat_many([tweet(3, u'@foo', username=u'foo', user_id_str=u'2')])
+        merged = Metrifier(index=True)
+        merged += first
+        merged += second
+        for name in (u'foo', u'bar', u'baz'):
+            self.assertEqual(ids(merged.query(mention=name)), ids(whole.query(mention=name)))
+
+
+if __name__ == '__main__':
+    unittest.main()
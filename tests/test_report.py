@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pymetrify import Metrifier, build_report
+
+
+def tweet(n, user):
+    return {
+        u'id': u'tag:search.twitter.com,2005:{0}'.format(n),
+        u'postedTime': u'2013-02-04T17:{0:02d}:00.000Z'.format(n % 60),
+        u'verb': u'post',
+        u'body': u'hello',
+        u'actor': {u'id_str': unicode(user), u'preferredUsername': u'user{0}'.format(user)}
+    }
+
+
+def column(table, prefix):
+    return [list(table[name]) for name in table.columns if name.startswith(prefix)]
+
+
+class ReportPeriodTest(unittest.TestCase):
+
+    def setUp(self):
+        # 9 users with 1 tweet, 5 with 2 and 1 with 10: 29 tweets
+        self.metrifier = Metrifier()
+        tweets = []
+        for user, count in enumerate([1] * 9 + [2] * 5 + [10]):
+            for i in range(count):
+                tweets.append(tweet(len(tweets) + 1, user))
+        self.metrifier.eat_many(tweets)
+
+    def test_share_of_tweets_by_percentile(self):
+        table = build_report(self.metrifier, None, (50,))[u'period']
+        counts = column(table, u'number of tweets from')
+        shares = column(table, u'% of tweets from')
+        self.assertEqual(counts, [[10], [19]])
+        self.assertEqual(len(shares), 2)
+        for count, share in zip(counts, shares):
+            self.assertAlmostEqual(share[0], 100.0 * count[0] / 29)
+        self.assertAlmostEqual(shares[0][0] + shares[1][0], 100.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pymetrify import mention_indices, scan_body
+
+
+class ScanBodyTest(unittest.TestCase):
+
+    def test_no_mentions(self):
+        self.assertEqual(scan_body(u'just text'), ((), None, False))
+        self.assertEqual(scan_body(u'an @ alone')[1], None)
+
+    def test_mentions(self):
+        body = u'@alice and @bob_2 hi'
+        mentions, retweet, edited = scan_body(body)
+        self.assertEqual([username for marker, username in mentions], [u'alice', u'bob_2'])
+        self.assertEqual(retweet, None)
+        self.assertEqual(mention_indices(body), [(0, u'alice'), (11, u'bob_2')])
+
+    def test_retweets(self):
+        self.assertEqual(scan_body(u'RT @bob: hello')[1:], ((u'RT @', u'bob'), False))
+        self.assertEqual(scan_body(u'so true MT @carol: hi')[1:], ((u'MT @', u'carol'), True))
+        self.assertEqual(scan_body(u'"@dave: a badge?"')[1:], ((u'"@', u'dave'), False))
+        self.assertEqual(scan_body(u'"@dave: a badge?" I do')[1:], ((u'"@', u'dave'), True))
+        self.assertEqual(scan_body(u'a read via @frank')[1:], ((u'via @', u'frank'), False))
+        # Markers are case sensitive
+        self.assertEqual(scan_body(u'a read VIA @frank')[1:], (None, False))
+
+    def test_marker_after_a_mention(self):
+        # The first mention takes in the R of RT, which is still a marker
+        mentions, retweet, edited = scan_body(u'@bobRT @carol: hi "@dave')
+        self.assertEqual([username for marker, username in mentions], [u'bobRT', u'carol', u'dave'])
+        self.assertEqual(retweet, (u'RT @', u'carol'))
+
+
+if __name__ == '__main__':
+    unittest.main()
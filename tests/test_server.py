@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import asyncore
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pymetrify import IngestConnection, IngestServer, Metrifier
+
+
+def line(n):
+    return json.dumps({
+        u'id': u'tag:search.twitter.com,2005:{0}'.format(n),
+        u'postedTime': u'2013-02-04T17:{0:02d}:00.000Z'.format(n),
+        u'verb': u'post',
+        u'body': u'hello',
+        u'actor': {u'id_str': u'1', u'preferredUsername': u'author'}
+    }).encode('utf-8') + b'\n'
+
+
+class IngestServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.metrifier = Metrifier()
+        self.server = IngestServer(self.metrifier, [os.path.join(self.directory, 'sock')], queue_size=100)
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def connect(self):
+        producer = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        producer.connect(self.server.address())
+        # Accept it
+        self.server.poll(0.1)
+        return producer
+
+    def serve(self, tweets):
+        for i in range(100):
+            if self.metrifier.frequency[u'tweet'] >= tweets:
+                break
+            self.server.poll(0.05)
+
+    def test_bad_lines_are_skipped(self):
+        producer = self.connect()
+        bad = json.dumps({u'id': u'tag:search.twitter.com,2005:99'}).encode('utf-8') + b'\n'
+        producer.sendall(b''.join(line(n) for n in range(1, 6)) + bad + b'[]\nnot json\n' +
+                         b''.join(line(n) for n in range(6, 16)))
+        self.serve(15)
+        producer.close()
+        self.assertEqual(self.metrifier.frequency[u'tweet'], 15)
+        self.assertEqual(self.server.errors, 3)
+        self.assertEqual(len(list(self.metrifier.chronological())), 15)
+
+    def test_backpressure_per_connection(self):
+        self.server.queue_size = 10
+        fast = self.connect()
+        slow = self.connect()
+        fast.sendall(b''.join(line(n) for n in range(1, 21)))
+        connections = [d for d in self.server.map.values() if isinstance(d, IngestConnection)]
+        for i in range(100):
+            if sum(c.pending for c in connections) >= 20:
+                break
+            # Read without eating
+            asyncore.loop(0.05, map=self.server.map, count=1)
+        held = [c for c in connections if not c.readable()]
+        self.assertEqual([c.pending for c in held], [20])
+        self.assertEqual(len(connections), 2)
+        slow.sendall(line(30))
+        self.serve(21)
+        self.assertEqual(self.metrifier.frequency[u'tweet'], 21)
+        self.assertTrue(all(c.readable() for c in connections))
+        fast.close()
+        slow.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import unittest
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pymetrify import BloomFilter, HyperLogLog, SpaceSaving
+
+
+class BloomFilterTest(unittest.TestCase):
+
+    def test_membership(self):
+        bloom = BloomFilter(1000, 0.01)
+        for n in xrange(0, 2000, 2):
+            bloom.add(n)
+        # No false negatives, and about error_rate false positives
+        self.assertTrue(all(n in bloom for n in xrange(0, 2000, 2)))
+        false = sum(1 for n in xrange(1, 2000, 2) if n in bloom)
+        self.assertTrue(false < 40, false)
+
+    def test_update(self):
+        first = BloomFilter(100)
+        first.add(1)
+        second = BloomFilter(100)
+        second.add(2)
+        first.update(second)
+        self.assertTrue(1 in first and 2 in first)
+        self.assertRaises(ValueError, first.update, BloomFilter(200))
+
+
+class HyperLogLogTest(unittest.TestCase):
+
+    def test_estimate(self):
+        for n in (0, 1, 10, 100, 1000, 20000):
+            sketch = HyperLogLog(12)
+            sketch.update(u'item{0}'.format(i) for i in xrange(n))
+            # Adding again changes nothing
+            sketch.update(u'item{0}'.format(i) for i in xrange(n))
+            self.assertTrue(abs(len(sketch) - n) <= max(1, 4 * sketch.error * n), (n, len(sketch)))
+
+    def test_sparse_and_dense_agree(self):
+        sketch = HyperLogLog(12)
+        sketch.update(xrange(5))
+        self.assertTrue(sketch.registers is None)
+        registers = sketch.iterregisters()
+        estimate = len(sketch)
+        sketch.densify()
+        self.assertEqual(sketch.iterregisters(), registers)
+        self.assertEqual(len(sketch), estimate)
+
+    def test_update(self):
+        first = HyperLogLog(10)
+        first.update(xrange(0, 3000))
+        second = HyperLogLog(10)
+        second.update(xrange(2000, 5000))
+        both = HyperLogLog(10)
+        both.update(xrange(5000))
+        first.update(second)
+        self.assertEqual(first.iterregisters(), both.iterregisters())
+        self.assertRaises(ValueError, first.update, HyperLogLog(12))
+        self.assertRaises(ValueError, HyperLogLog, 20)
+
+
+class SpaceSavingTest(unittest.TestCase):
+
+    def test_exact_while_not_full(self):
+        items = list(u'abracadabra')
+        table = SpaceSaving(10)
+        table.update(items)
+        self.assertEqual(table.most_common(), Counter(items).most_common())
+        self.assertEqual(table[u'a'], 5)
+        self.assertEqual(table[u'z'], 0)
+        self.assertEqual(table.bounds(u'b'), (2, 2))
+        self.assertEqual(len(table), 5)
+
+    def test_heavy_hitters(self):
+        items = [u'common'] * 300 + [u'rare{0}'.format(i) for i in xrange(500)] + [u'often'] * 200
+        table = SpaceSaving(5)
+        table.update(items)
+        self.assertEqual(sorted(item for item, count in table.most_common(2)), [u'common', u'often'])
+        # Counts are never underestimated, and bounds hold the true count
+        for item, true in Counter(items).iteritems():
+            low, high = table.bounds(item)
+            self.assertTrue(low <= true <= high, (item, low, true, high))
+            self.assertTrue(table[item] == 0 or table[item] >= true)
+        self.assertEqual(len(table.most_common()), 5)
+
+    def test_update(self):
+        first = SpaceSaving(3)
+        first.update(u'aaabbc')
+        second = SpaceSaving(3)
+        second.update(u'aabbbd')
+        first.update(second)
+        self.assertEqual(first[u'a'], 5)
+        self.assertEqual(first[u'b'], 5)
+        self.assertEqual(len(first.most_common()), 3)
+        self.assertEqual(len(first), 4)
+        self.assertRaises(ValueError, SpaceSaving, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pymetrify import USER_COUNTERS, Metrifier
+
+
+def tweet(n, user, body=u'hello', hashtags=(), urls=()):
+    return {
+        u'id': u'tag:search.twitter.com,2005:{0}'.format(n),
+        u'postedTime': u'2013-02-04T{0:02d}:{1:02d}:00.000Z'.format(n // 60 % 24, n % 60),
+        u'verb': u'post',
+        u'body': body,
+        u'actor': {u'id_str': unicode(user), u'preferredUsername': u'user{0}'.format(user)},
+        u'twitter_entities': {u'user_mentions': [],
+                              u'hashtags': [{u'text': hashtag} for hashtag in hashtags],
+                              u'urls': [{u'expanded_url': url} for url in urls]}
+    }
+
+
+def tweets():
+    return ([tweet(n, n % 7, u'@user{0} hi'.format(n % 5), hashtags=[u'Tag{0}'.format(n % 3)])
+             for n in range(1, 60)] +
+            [tweet(n, n % 11, u'RT @user{0}: hi'.format(n % 4), urls=[u'http://example.com/{0}'.format(n % 9)])
+             for n in range(60, 200)])
+
+
+def summary(metrifier):
+    users = metrifier.user
+    return (metrifier.frequency, metrifier.timebounds,
+            dict((id_str, [users.counter[key][i] for key in USER_COUNTERS])
+                 for i, id_str in enumerate(users.id_str)),
+            sorted(metrifier.url.most_common()), sorted(metrifier.hashtag.most_common()),
+            dict((period, dict((key, bucket.frequency) for key, bucket in buckets.iteritems()))
+                 for period, buckets in metrifier.period.iteritems()))
+
+
+class StateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'archive.state')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def options(self):
+        return ({}, {'columnar': True}, {'streaming': True}, {'dedup': 'exact'},
+                {'dedup': 'bloom', 'capacity': 1000}, {'index': True}, {'periods': ('hour', 'minute')})
+
+    def test_round_trip(self):
+        for options in self.options():
+            m = Metrifier(**options)
+            m.eat_many(tweets())
+            m.save(self.path)
+            loaded = Metrifier.load(self.path)
+            self.assertEqual(summary(loaded), summary(m), options)
+            if not options.get('streaming'):
+                self.assertEqual([t[u'id_str'] for t in loaded.chronological()],
+                                 [t[u'id_str'] for t in m.chronological()])
+
+    def test_eat_more(self):
+        for options in self.options():
+            whole = Metrifier(**options)
+            whole.eat_many(tweets())
+            m = Metrifier(**options)
+            m.eat_many(tweets()[:80])
+            m.save(self.path)
+            loaded = Metrifier.load(self.path)
+            loaded.eat_many(tweets()[80:])
+            self.assertEqual(summary(loaded), summary(whole), options)
+
+    def test_rejects_duplicates_after_loading(self):
+        m = Metrifier(dedup='bloom', capacity=1000)
+        m.eat_many(tweets())
+        m.save(self.path)
+        loaded = Metrifier.load(self.path)
+        self.assertFalse(loaded.eat(tweets()[0]))
+        self.assertEqual(loaded.frequency[u'duplicate'], 1)
+
+    def test_query_after_loading(self):
+        m = Metrifier(index=True)
+        m.eat_many(tweets())
+        m.save(self.path)
+        loaded = Metrifier.load(self.path)
+        self.assertEqual(summary(loaded.query(hashtag=u'#tag1')), summary(m.query(hashtag=u'tag1')))
+        self.assertEqual(loaded.query(domain=u'example.com').frequency[u'tweet'], 140)
+
+    def test_sketch(self):
+        m = Metrifier(sketch=5, sketch_precision=8)
+        m.eat_many(tweets())
+        m.save(self.path)
+        loaded = Metrifier.load(self.path)
+        self.assertEqual(sorted(loaded.url.most_common()), sorted(m.url.most_common()))
+        self.assertEqual(len(loaded.url.distinct), len(m.url.distinct))
+        self.assertEqual(loaded.sketch_precision, 8)
+
+    def test_not_a_state_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a state file at all')
+        self.assertRaises(ValueError, Metrifier.load, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import os
+from datetime import datetime
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pymetrify import Metrifier, TimeIndex, TweetStore
+
+
+def tweet(n, minute, user=u'1'):
+    return {
+        u'id': u'tag:search.twitter.com,2005:{0}'.format(n),
+        u'postedTime': u'2013-02-04T17:{0:02d}:00.000Z'.format(minute),
+        u'verb': u'post',
+        u'body': u'hello',
+        u'actor': {u'id_str': user, u'preferredUsername': u'user' + user},
+        u'twitter_entities': {u'user_mentions': [], u'hashtags': [], u'urls': []}
+    }
+
+
+class TweetStoreTest(unittest.TestCase):
+
+    def test_append(self):
+        store = TweetStore()
+        store.append(12, 100, {u'id_str': u'tag:a:12', u'is_retweet': True})
+        store.append(7, 50, {u'id_str': u'007'})
+        self.assertEqual(len(store), 2)
+        self.assertEqual(list(store), [u'tag:a:12', u'007'])
+        self.assertEqual(store.record(0), {u'id_str': u'tag:a:12', u'epoch': 100, u'is_retweet': True})
+        self.assertEqual(store.record(1), {u'id_str': u'007', u'epoch': 50})
+        self.assertEqual(store.prefix, [u'tag:a:', u'00'])
+
+    def test_extend(self):
+        store = TweetStore()
+        store.append(1, 10, {u'id_str': u'a:1'})
+        other = TweetStore()
+        other.append(2, 20, {u'id_str': u'b:2'})
+        other.append(3, 30, {u'id_str': u'a:3', u'is_reply': True})
+        store.extend(other)
+        self.assertEqual(list(store), [u'a:1', u'b:2', u'a:3'])
+        self.assertEqual(store.record(2), {u'id_str': u'a:3', u'epoch': 30, u'is_reply': True})
+        self.assertEqual(store.prefix, [u'a:', u'b:'])
+
+    def test_columnar_metrifier(self):
+        tweets = [tweet(1, 5), tweet(2, 3, u'2'), tweet(3, 4)]
+        columnar = Metrifier(columnar=True)
+        columnar.eat_many(tweets)
+        default = Metrifier()
+        default.eat_many(tweets)
+        self.assertEqual(list(columnar.chronological()), list(default.chronological()))
+        self.assertEqual(columnar.frequency, default.frequency)
+
+
+class TimeIndexTest(unittest.TestCase):
+
+    def test_rows(self):
+        index = TimeIndex()
+        for row, epoch in enumerate([10, 30, 20, 20, 40]):
+            index.add(epoch, row)
+        self.assertFalse(index.is_sorted)
+        self.assertEqual(list(index.rows()), [0, 2, 3, 1, 4])
+        self.assertTrue(index.is_sorted)
+        self.assertEqual(list(index.rows(20, 30)), [2, 3, 1])
+        self.assertEqual(list(index.rows(start=25)), [1, 4])
+        self.assertEqual(list(index.rows(end=15)), [0])
+        self.assertEqual(list(index.rows(41)), [])
+
+    def test_extend(self):
+        index = TimeIndex()
+        index.add(10, 0)
+        index.add(30, 1)
+        other = TimeIndex()
+        other.add(20, 0)
+        index.extend(other, 2)
+        self.assertEqual(len(index), 3)
+        self.assertFalse(index.is_sorted)
+        self.assertEqual(list(index.rows()), [0, 2, 1])
+
+    def test_itertweets_by_time(self):
+        m = Metrifier()
+        m.eat_many([tweet(1, 5), tweet(2, 3), tweet(3, 4)])
+        self.assertEqual([t[u'id_str'][-1] for t in m.chronological()], [u'2', u'3', u'1'])
+        tweets = m.itertweets(start=datetime(2013, 2, 4, 17, 4), end=datetime(2013, 2, 4, 17, 5))
+        self.assertEqual([t[u'id_str'][-1] for t in tweets], [u'3', u'1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pymetrify import Metrifier, UserTable
+
+
+def tweet(n, user_id_str, username, mentions=()):
+    return {
+        u'id': u'tag:search.twitter.com,2005:{0}'.format(n),
+        u'postedTime': u'2013-02-04T17:{0:02d}:00.000Z'.format(n),
+        u'verb': u'post',
+        u'body': u' '.join(u'@' + mention[u'screen_name'] for mention in mentions) or u'hello',
+        u'actor': {u'id_str': user_id_str, u'preferredUsername': username},
+        u'twitter_entities': {u'user_mentions': list(mentions), u'hashtags': [], u'urls': []}
+    }
+
+
+def mention(id_str, screen_name, start=0):
+    return {u'id_str': id_str, u'screen_name': screen_name, u'indices': [start, start + 1 + len(screen_name)]}
+
+
+class UserTableTest(unittest.TestCase):
+
+    def test_intern(self):
+        users = UserTable()
+        self.assertEqual(users.intern(u'1', u'alice'), 0)
+        self.assertEqual(users.intern(u'2', u'bob'), 1)
+        self.assertEqual(users.intern(u'1', u'ignored'), 0)
+        self.assertEqual(len(users), 2)
+        self.assertTrue(u'2' in users)
+        self.assertEqual(users[u'1'][u'username'], u'alice')
+        self.assertEqual(list(users.column(u'tweet')), [0, 0])
+
+    def test_view(self):
+        users = UserTable()
+        users.column(u'tweet')[users.intern(u'1', u'alice')] += 3
+        view = users[u'1']
+        self.assertEqual(view[u'tweet'], 3)
+        self.assertEqual(view[u'id_str'], u'1')
+        self.assertFalse(u'is_retweet' in view)
+        self.assertEqual(view.get(u'is_retweet', -1), -1)
+
+    def test_merge(self):
+        users = UserTable()
+        users.column(u'tweet')[users.intern(u'1', u'alice')] += 1
+        other = UserTable()
+        other.column(u'tweet')[other.intern(u'1', u'alice')] += 2
+        other.column(u'tweet')[other.intern(u'@bob', u'bob')] += 5
+        users.merge(other, {u'@bob': u'2'})
+        self.assertEqual(users[u'1'][u'tweet'], 3)
+        self.assertEqual(users[u'2'][u'tweet'], 5)
+        self.assertFalse(u'@bob' in users)
+        # Without renames
+        again = UserTable()
+        again.merge(other)
+        self.assertEqual(again[u'@bob'][u'tweet'], 5)
+
+
+class AuthorCountTest(unittest.TestCase):
+
+    def test_mentioned_user_becomes_an_author(self):
+        # "Authors" are the users who sent one or more tweets, including
+        # users who were mentioned before they tweeted
+        m = Metrifier()
+        m.eat(tweet(1, u'1', u'alice', [mention(u'2', u'bob')]))
+        self.assertEqual(m.frequency[u'author'], 1)
+        m.eat(tweet(2, u'2', u'bob'))
+        self.assertEqual(m.frequency[u'author'], 2)
+        m.eat(tweet(3, u'2', u'bob'))
+        self.assertEqual(m.frequency[u'author'], 2)
+        self.assertEqual(len(m.user), 2)
+
+    def test_mentioned_only_is_not_an_author(self):
+        m = Metrifier()
+        m.eat(tweet(1, u'1', u'alice', [mention(u'2', u'bob'), mention(u'3', u'carol', 5)]))
+        self.assertEqual(m.frequency[u'author'], 1)
+        self.assertEqual(len(m.user), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
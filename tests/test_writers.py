@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import pymetrify
+from pymetrify import CSVWriter, NDJSONWriter, ReportTable, open_writer
+
+
+def table():
+    return ReportTable(u'period', [u'period', u'tweets', u'share'], [u'text', u'int', u'float'],
+                       [(u'0', 3, 0.5), (u'a, "b"', 1, 0.25)])
+
+
+class WriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_csv(self):
+        out = io.BytesIO()
+        writer = CSVWriter(out)
+        writer.write_table(table())
+        writer.close()
+        self.assertEqual(out.getvalue(), b'period,tweets,share\n0,3,0.5\n"a, ""b""",1,0.25\n\n')
+
+    def test_ndjson(self):
+        out = io.BytesIO()
+        writer = NDJSONWriter(out)
+        writer.write_table(table())
+        writer.close()
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(rows[1], {u'table': u'period', u'period': u'a, "b"', u'tweets': 1, u'share': 0.25})
+
+    def test_format_from_extension(self):
+        self.assertTrue(isinstance(open_writer(io.BytesIO()), CSVWriter))
+        writer = open_writer(self.path('report.jsonl'))
+        self.assertTrue(isinstance(writer, NDJSONWriter))
+        writer.discard()
+        self.assertRaises(ValueError, open_writer, io.BytesIO(), 'xml')
+
+    def test_path_is_replaced_on_close(self):
+        with open(self.path('report.csv'), 'wb') as f:
+            f.write(b'old report\n')
+        writer = open_writer(self.path('report.csv'))
+        writer.write_table(table())
+        writer.flush()
+        with open(self.path('report.csv'), 'rb') as f:
+            self.assertEqual(f.read(), b'old report\n')
+        writer.close()
+        with open(self.path('report.csv'), 'rb') as f:
+            self.assertTrue(f.read().startswith(b'period,tweets,share\n'))
+        self.assertEqual(os.listdir(self.directory), ['report.csv'])
+
+    def test_discard_keeps_the_old_report(self):
+        with open(self.path('report.csv'), 'wb') as f:
+            f.write(b'old report\n')
+        writer = open_writer(self.path('report.csv'))
+        writer.write_table(table())
+        writer.discard()
+        writer.discard()
+        with open(self.path('report.csv'), 'rb') as f:
+            self.assertEqual(f.read(), b'old report\n')
+        self.assertEqual(os.listdir(self.directory), ['report.csv'])
+
+    @unittest.skipIf(pymetrify.pyarrow is None, "requires pyarrow")
+    def test_parquet(self):
+        writer = open_writer(self.path('report.parquet'))
+        writer.write_table(table())
+        writer.close()
+        read = pymetrify.pyarrow.parquet.read_table(self.path('report.period.parquet'))
+        self.assertEqual(read.schema.names, [u'period', u'tweets', u'share'])
+        self.assertEqual(read.num_rows, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()